@@ -4,9 +4,40 @@ __author__ = """Douglas Carvalho"""
 __email__ = "douglasc.dev@gmail.com"
 __version__ = "0.1.13"
 
-from .aoba_checks import *
-from .bot import *
-from .cli import *
-from .cogs import *
-from .db_models import *
-from .formatting import *
+import importlib
+
+# Public names of the package and the submodule defining each of them. Submodules are only imported when one of
+# their names is first used, so importing a single module like the CLI doesn't pull in discord.py and SQLAlchemy
+_EXPORTS = {
+    "author_is_admin": "aoba_checks",
+    "author_is_not_bot": "aoba_checks",
+    "AobaDiscordBot": "bot",
+    "DEFAULT_COMMAND_PREFIX": "caches",
+    "CustomCommandRegistry": "caches",
+    "PrefixCache": "caches",
+    "TTLCache": "caches",
+    "main": "cli",
+    "AobaBroadcast": "db_models",
+    "AobaCommand": "db_models",
+    "AobaGuild": "db_models",
+    "AobaLedgerEntry": "db_models",
+    "AobaUser": "db_models",
+    "Base": "db_models",
+    "mention_author": "formatting",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
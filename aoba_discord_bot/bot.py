@@ -1,26 +1,77 @@
 """Main module."""
+import asyncio
+import importlib
 import logging
 import pathlib
-import re
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional
 
+import aiohttp
 import discord
 from discord.ext import tasks
-from discord.ext.commands import Bot, Command, Context
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.future import select
-from sqlalchemy.orm import scoped_session, sessionmaker
+from discord.ext.commands import AutoShardedBot, Bot, Command, Context
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
-from aoba_discord_bot.db_models import AobaCommand, AobaGuild, Base
+from aoba_discord_bot import database, migrations, repository
+from aoba_discord_bot.caches import (
+    DEFAULT_COMMAND_PREFIX,
+    AnnouncementChannelIndex,
+    CustomCommandRegistry,
+    PrefixCache,
+)
+from aoba_discord_bot.metrics import BotMetrics
+from aoba_discord_bot.sharding import ShardStats, shard_id_for_guild
+from aoba_discord_bot.watchdog import LoopWatchdog
 
 
 class AobaDiscordBot(Bot):
-    def __init__(self, api_keys: dict, db_url: str, **options):
+    def __init__(
+        self,
+        api_keys: dict,
+        db_url: str,
+        db_options: dict = None,
+        osu_options: dict = None,
+        metrics_options: dict = None,
+        watchdog_options: dict = None,
+        economy_options: dict = None,
+        **options,
+    ):
+        # Incremented whenever a command is added or removed, set before Bot's constructor adds the help command
+        self.commands_version = 0
         super().__init__(**options, activity=discord.Game("on the cloud"))
 
-        self.Session: scoped_session = None
+        self.Session: async_sessionmaker = None
+        self.db_engine = None
         self.db_url = db_url
+        self.db_options = db_options or dict()
         self.api_keys = api_keys
+        self.osu_options = osu_options or dict()
+        self.economy_options = economy_options or dict()
+        self.metrics_options = metrics_options or dict()
+        self.metrics = BotMetrics(self)
+        # Event loop stall detection, only enabled when options are given because of its overhead
+        self.watchdog_options = watchdog_options
+        self.watchdog: Optional[LoopWatchdog] = None
+        self.shutdown_hooks: List[Callable[[], Awaitable[None]]] = list()
+        # Set once close starts, cogs unloaded by it leave their resources to the shutdown hooks
+        self.closing = False
+        # Keep-alive connections shared by the cogs' HTTP requests that don't go to Discord's API
+        self._http_session: Optional[aiohttp.ClientSession] = None
+        # ClusterClient when the bot runs as one of the processes of aoba_discord_bot_cluster
+        self.cluster = None
+        self.prefix_cache = PrefixCache()
+        self.custom_commands = CustomCommandRegistry()
+        self.announcement_channels = AnnouncementChannelIndex()
+        # Every custom command is invoked through this single command, which isn't added to the bot
+        self._custom_command = Command(self.custom_command, name="custom_command")
         self.command_prefix = self.get_guild_command_prefix
+        # Set once the startup tasks finish, commands received before that wait for it
+        self.startup_complete = asyncio.Event()
+        self._database_ready = asyncio.Event()
+        # Seconds each startup stage took, by stage name
+        self.startup_timings: Dict[str, float] = dict()
 
         self._on_bot_run.start()
 
@@ -31,96 +82,395 @@ class AobaDiscordBot(Bot):
 
         Not the same as on_ready, because that's called every
         time the bot connects.
+
+        The database and the cog modules don't depend on the gateway, so they're prepared while the bot connects.
+        The remaining stages run concurrently once the database is ready.
         """
-        await self.wait_until_ready()
+        start = time.perf_counter()
+        await self.metrics.start(**self.metrics_options)
+        self.shutdown_hooks.append(self.metrics.close)
+        if self.watchdog_options is not None:
+            self.watchdog = LoopWatchdog(
+                self.loop,
+                describe_task=self.metrics.describe_task,
+                on_stall=self.metrics.record_stall,
+                **self.watchdog_options,
+            )
+            self.watchdog.start()
+            self.shutdown_hooks.append(self.watchdog.close)
+        try:
+            database_ready = asyncio.ensure_future(
+                self._run_startup_stage("database", self._initialize_database())
+            )
+            cogs_imported = asyncio.ensure_future(
+                self._run_startup_stage("cog imports", self._import_all_cogs())
+            )
+            await database_ready
+            await cogs_imported
+
+            await asyncio.gather(
+                self._bootstrap_guilds(),
+                self._run_startup_stage(
+                    "custom commands", self._add_persisted_custom_commands()
+                ),
+                self._run_startup_stage("cogs", self._load_all_cogs()),
+            )
+        finally:
+            self.startup_complete.set()
 
-        await self._initialize_database()
-        await self._insert_new_guilds_in_db()
-        await self._add_persisted_custom_commands()
-        await self._load_all_cogs()
+        logging.info(
+            f"Startup finished in {(time.perf_counter() - start) * 1000:.2f}ms"
+        )
+        await self.wait_until_ready()
         await self._log_invite_url()
 
+    async def _run_startup_stage(self, name: str, stage: Awaitable[None]) -> None:
+        start = time.perf_counter()
+        await stage
+        self.startup_timings[name] = time.perf_counter() - start
+        logging.info(
+            f"Startup stage {name} took {self.startup_timings[name] * 1000:.2f}ms"
+        )
+
+    async def close(self):
+        """
+        Runs the shutdown hooks, for example to write buffered data to the database, before disconnecting.
+        """
+        self.closing = True
+        for hook in self.shutdown_hooks:
+            try:
+                await hook()
+            except Exception:
+                logging.exception(f"Shutdown hook {hook} failed")
+        if self._http_session is not None:
+            await self._http_session.close()
+        await super().close()
+
+    @property
+    def http_session(self) -> aiohttp.ClientSession:
+        """
+        HTTP session shared by the cogs, created on first use and closed with the bot.
+        """
+        if self._http_session is None or self._http_session.closed:
+            self._http_session = aiohttp.ClientSession()
+        return self._http_session
+
     async def _initialize_database(self):
-        # Since Heroku's environment variable DATABASE_URL is set in the format postgres:// instead of
-        # postgresql+asyncpg:// this replaces Heroku's URL to contain the dialect. For this reason, the
-        # format postgres:// is always replaced to postgresql+asyncpg:// even when running locally
-        self.db_url = re.sub(r"\w+:", "postgresql+asyncpg:", self.db_url, count=1)
+        # Heroku's DATABASE_URL is in the format postgres://, the url's backend is kept and its async driver is
+        # selected, so sqlite:///aoba.db runs the bot without a database server
+        self.db_url = database.normalize_url(self.db_url)
 
-        db_engine = create_async_engine(self.db_url)
+        self.db_engine = database.create_engine(self.db_url, **self.db_options)
+        self.metrics.instrument_engine(self.db_engine)
 
-        async with db_engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
+        # Only the schema version is read when the schema is up to date
+        schema_version = await migrations.get_schema_version(self.db_engine)
+        if schema_version < migrations.SCHEMA_VERSION:
+            logging.info(
+                f"Upgrading the database schema from version {schema_version} to {migrations.SCHEMA_VERSION}"
+            )
+            await migrations.upgrade(self.db_engine)
+        elif schema_version > migrations.SCHEMA_VERSION:
+            logging.warning(
+                f"The database schema version {schema_version} is newer than this version of the bot"
+            )
 
-        self.Session = scoped_session(
-            sessionmaker(db_engine, expire_on_commit=False, class_=AsyncSession)
-        )
+        self.Session = async_sessionmaker(self.db_engine, expire_on_commit=False)
+        self._database_ready.set()
 
-    async def _load_all_cogs(self) -> None:
-        logging.info("Loading cogs")
+    @asynccontextmanager
+    async def session_scope(self) -> AsyncIterator[AsyncSession]:
+        """
+        Unit of work for database writes. The transaction is committed when the block exits, rolled back if it
+        raises, and the session is closed and its connection returned to the pool either way.
+
+        Every task should open its own session, since sessions can't be shared between concurrent tasks.
+        """
+        async with self.Session() as session:
+            async with session.begin():
+                yield session
 
+    @staticmethod
+    def _cog_extension_names() -> List[str]:
+        extension_names = list()
         for cog_folder in (pathlib.Path(__file__).parent / "cogs").iterdir():
             # Exclude __pychache__ and __init__
             if "__" in str(cog_folder):
                 continue
 
             cog_name = cog_folder.stem
-            self.load_extension(f"aoba_discord_bot.cogs.{cog_name}.{cog_name + '_cog'}")
-            logging.debug(f"Loaded cog {cog_name}")
+            extension_names.append(
+                f"aoba_discord_bot.cogs.{cog_name}.{cog_name + '_cog'}"
+            )
+        return extension_names
 
-    async def _insert_new_guilds_in_db(self):
-        async with self.Session() as session:
-            bot_guild_ids = {guild.id for guild in self.guilds}
-            persisted_guilds = (
-                (await session.execute(select(AobaGuild))).scalars().all()
+    async def _import_all_cogs(self) -> None:
+        """
+        Imports the cog modules and their dependencies in a worker thread, so load_extension doesn't block the
+        event loop importing them. They're imported one after the other, concurrent imports of modules sharing
+        dependencies could deadlock on the import locks or see partially initialised modules.
+        """
+        await asyncio.get_event_loop().run_in_executor(None, self._import_cogs)
+
+    @classmethod
+    def _import_cogs(cls) -> None:
+        for extension_name in cls._cog_extension_names():
+            importlib.import_module(extension_name)
+
+    async def _load_all_cogs(self) -> None:
+        logging.info("Loading cogs")
+
+        for extension_name in self._cog_extension_names():
+            self.load_extension(extension_name)
+            logging.debug(f"Loaded cog {extension_name}")
+
+    async def _bootstrap_guilds(self) -> None:
+        await self.wait_until_ready()
+        await self._run_startup_stage(
+            "guilds", self._insert_new_guilds_in_db(self.guilds)
+        )
+
+    async def _insert_new_guilds_in_db(
+        self, guilds: Iterable[discord.Guild], shard_id: Optional[int] = None
+    ):
+        """
+        Adds database records for the guilds that added the bot while it was offline and loads their prefixes and
+        announcement channels. Only the ids of the new guilds, the prefixes that aren't the default and the
+        announcement channels that are set are read from the database.
+        :param guilds: guilds the bot is in
+        :param shard_id: shard the guilds belong to, if only the guilds of a shard are passed
+        """
+        bot_guild_ids = {guild.id for guild in guilds}
+        async with self.session_scope() as session:
+            new_guild_ids = await repository.add_guilds(session, bot_guild_ids)
+            custom_prefixes = await repository.get_custom_prefixes(
+                session, shard_id, self.shard_count or 1
+            )
+            announcement_channels = await repository.get_announcement_channels(
+                session, shard_id=shard_id, shard_count=self.shard_count or 1
             )
-            persisted_guild_ids = {guild.guild_id for guild in persisted_guilds}
-            new_guilds = bot_guild_ids.difference(persisted_guild_ids)
 
-            for new_guild_id in new_guilds:
-                new_guild = AobaGuild(guild_id=new_guild_id, command_prefix="!")
-                logging.info(f" - Added database record for guild `{new_guild_id}`")
-                session.add(new_guild)
+        self.prefix_cache.warm(
+            (guild_id, DEFAULT_COMMAND_PREFIX) for guild_id in bot_guild_ids
+        )
+        self.prefix_cache.warm(
+            (guild_id, prefix)
+            for guild_id, prefix in custom_prefixes
+            if guild_id in bot_guild_ids
+        )
+        self.announcement_channels.warm(
+            (guild_id, channel_id)
+            for guild_id, channel_id in announcement_channels
+            if guild_id in bot_guild_ids
+        )
 
-            if len(new_guilds) > 0:
-                await session.commit()
-                logging.info(
-                    f"{len(new_guilds)} guilds added the bot since the last run"
-                )
+        for new_guild_id in new_guild_ids:
+            logging.info(f" - Added database record for guild `{new_guild_id}`")
+        if len(new_guild_ids) > 0:
+            logging.info(
+                f"{len(new_guild_ids)} guilds added the bot since the last run"
+            )
 
     async def _add_persisted_custom_commands(self):
         async with self.Session() as session:
-            custom_cmds = (await session.execute(select(AobaCommand))).scalars().all()
+            custom_cmds = await repository.get_all_commands(session)
 
-            for command in custom_cmds:
-                self.add_command(Command(self.custom_command, name=command.name))
+            self.custom_commands.load(
+                (command.guild_id, command.name, command.text)
+                for command in custom_cmds
+            )
+            logging.info(f"Loaded {len(self.custom_commands)} custom commands")
 
     async def _log_invite_url(self):
         bot_invite_url = f"https://discord.com/oauth2/authorize?client_id={self.user.id}&permissions=8&scope=bot"
         logging.info(f"Bot invite url: {bot_invite_url}")
 
+    def stats_sections(self) -> Dict[str, dict]:
+        """
+        return: statistics of the bot's caches, database pool and cogs, by section title
+        """
+        sections = {
+            "Prefix cache": self.prefix_cache.stats(),
+            "Announcement channels": self.announcement_channels.stats(),
+            "Database pool": database.pool_stats(self.db_engine)
+            if self.db_engine
+            else {},
+        }
+        osu_cog = self.get_cog("Osu")
+        if osu_cog:
+            sections["osu! API cache"] = osu_cog.api.stats()
+            sections["osu! API rate limiter"] = osu_cog.api.rate_limiter.stats()
+        user_cog = self.get_cog("User")
+        if user_cog:
+            sections["Help cache"] = user_cog.help_pages.stats()
+        economy_cog = self.get_cog("Economy")
+        if economy_cog:
+            sections["Balance write-behind"] = economy_cog.balances.stats()
+            sections["User cache"] = economy_cog.users.stats()
+        return sections
+
+    def add_command(self, command: Command):
+        super().add_command(command)
+        self.commands_version += 1
+
+    def remove_command(self, name: str) -> Optional[Command]:
+        command = super().remove_command(name)
+        if command is not None:
+            self.commands_version += 1
+        return command
+
+    async def invoke(self, ctx: Context):
+        if ctx.command is None:
+            await super().invoke(ctx)
+            return
+
+        with self.metrics.track_command(ctx):
+            await super().invoke(ctx)
+
+    async def process_commands(self, message: discord.Message):
+        # Commands received while the bot starts up would see an empty prefix cache and no database yet
+        await self.startup_complete.wait()
+        await super().process_commands(message)
+
+    async def get_context(self, message: discord.Message, *, cls=Context):
+        ctx = await super().get_context(message, cls=cls)
+
+        # Bot commands take precedence over custom commands with the same name
+        if ctx.command is None and ctx.invoked_with and message.guild is not None:
+            if (message.guild.id, ctx.invoked_with) in self.custom_commands:
+                ctx.command = self._custom_command
+
+        return ctx
+
     async def custom_command(self, ctx: Context):
-        custom_cmds = (
-            (await self.Session().execute(select(AobaCommand))).scalars().all()
-        )
+        text = self.custom_commands.get(ctx.guild.id, ctx.invoked_with)
+
+        if text is None:
+            await ctx.channel.send("Custom command not found!")
+            return
 
-        called_command: AobaCommand = next(
-            iter(filter(lambda cmd: cmd.name == ctx.command.name, custom_cmds)), None
+        await ctx.channel.send(text)
+
+    async def on_guild_join(self, guild: discord.Guild):
+        await self._database_ready.wait()
+        async with self.session_scope() as session:
+            added = await repository.add_guilds(session, [guild.id])
+            # A guild that removed the bot while it was offline still has its record and prefix
+            guild_db_record = (
+                None if added else await repository.get_guild(session, guild.id)
+            )
+
+        self.prefix_cache.set(
+            guild.id,
+            guild_db_record.command_prefix
+            if guild_db_record
+            else DEFAULT_COMMAND_PREFIX,
         )
+        if guild_db_record:
+            self.announcement_channels.set(
+                guild.id, guild_db_record.announcement_channel_id
+            )
+        logging.info(f"Joined guild `{guild.id}`")
 
-        if not called_command:
-            await ctx.channel.send("Custom command not found!")
+    async def on_guild_remove(self, guild: discord.Guild):
+        await self._database_ready.wait()
+        async with self.session_scope() as session:
+            await repository.remove_guild(session, guild.id)
+
+        self.prefix_cache.remove(guild.id)
+        self.custom_commands.remove_guild(guild.id)
+        self.announcement_channels.remove(guild.id)
+        logging.info(f"Left guild `{guild.id}`")
+
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        # Only deleted announcement channels touch the database
+        guild_id = self.announcement_channels.remove_channel(channel.id)
+        if guild_id is None:
             return
 
-        await ctx.channel.send(called_command.text)
+        await self._database_ready.wait()
+        async with self.session_scope() as session:
+            await repository.clear_announcement_channel(session, guild_id, channel.id)
+        logging.info(f"Unset the deleted announcement channel of guild `{guild_id}`")
 
     async def get_guild_command_prefix(self, _: Bot, msg: discord.Message):
-        async with self.Session() as session:
-            q = select(AobaGuild)
-            result = await session.execute(q)
-            guild = next(
-                iter(
-                    filter(lambda g: g.guild_id == msg.guild.id, result.scalars().all())
+        """
+        Resolves the prefix for a message from the in-memory prefix cache, without touching the database.
+        """
+        if msg.guild is None:
+            return self.prefix_cache.default_prefix
+        return self.prefix_cache.get(msg.guild.id)
+
+
+class AobaShardedDiscordBot(AobaDiscordBot, AutoShardedBot):
+    """
+    Aoba over several gateway connections, needed once the bot is in more than 2500 guilds.
+
+    Each shard's guilds are bootstrapped as soon as that shard is ready, so the guilds of the first shards are
+    served while the others are still connecting.
+    """
+
+    def __init__(self, *args, **options):
+        """
+        Takes the same arguments as AobaDiscordBot, plus shard_count and shard_ids. Without shard_count the
+        number of shards recommended by Discord is used, shard_ids restricts the bot to some of the shards.
+        """
+        super().__init__(*args, **options)
+        self.shard_stats = ShardStats()
+        self._bootstrapped_shard_ids = set()
+        # Set once a shard's guilds are bootstrapped, commands from its guilds received before that wait for it
+        self._shard_bootstrapped: Dict[int, asyncio.Event] = defaultdict(asyncio.Event)
+
+    async def _bootstrap_guilds(self) -> None:
+        # Done per shard by on_shard_ready
+        pass
+
+    async def on_shard_ready(self, shard_id: int):
+        # on_shard_ready is dispatched again when a shard starts a new session, guilds are only bootstrapped once
+        if shard_id in self._bootstrapped_shard_ids:
+            return
+        self._bootstrapped_shard_ids.add(shard_id)
+
+        try:
+            await self._database_ready.wait()
+            await self._run_startup_stage(
+                f"shard {shard_id} guilds",
+                self._insert_new_guilds_in_db(
+                    [
+                        guild
+                        for guild in self.guilds
+                        if shard_id_for_guild(guild.id, self.shard_count) == shard_id
+                    ],
+                    shard_id,
                 ),
-                None,
             )
-            return guild.command_prefix if guild else "!"
+        finally:
+            self._shard_bootstrapped[shard_id].set()
+
+    async def on_shard_connect(self, shard_id: int):
+        self.shard_stats.record_connect(shard_id)
+
+    async def on_shard_disconnect(self, shard_id: int):
+        self.shard_stats.record_disconnect(shard_id)
+
+    async def on_message(self, message: discord.Message):
+        # Direct messages are always received by shard 0
+        self.shard_stats.record_message(message.guild.shard_id if message.guild else 0)
+        await super().on_message(message)
+
+    async def process_commands(self, message: discord.Message):
+        if message.guild is not None:
+            await self._shard_bootstrapped[message.guild.shard_id].wait()
+        await super().process_commands(message)
+
+    def stats_sections(self) -> Dict[str, dict]:
+        sections = super().stats_sections()
+        for shard_id, shard_stats in self.per_shard_stats().items():
+            sections[f"Shard {shard_id}"] = shard_stats
+        return sections
+
+    def per_shard_stats(self) -> Dict[int, dict]:
+        """
+        return: gateway latency, message rate and connection counts of each shard, by shard id
+        """
+        return self.shard_stats.stats(self.latencies)
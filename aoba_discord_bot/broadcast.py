@@ -0,0 +1,180 @@
+"""Concurrent delivery of owner announcements to the announcement channel of every guild."""
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+import discord
+
+from aoba_discord_bot import repository
+from aoba_discord_bot.db_models import AobaBroadcast
+from aoba_discord_bot.rate_limit import RateLimiter
+
+
+class Broadcast:
+    """
+    Sends a broadcast's text to a list of announcement channels with a bounded number of concurrent requests.
+
+    Channels are resolved from every guild the bot is in. Each channel is a separate Discord rate limit route and
+    receives a single message, so sends are paced only to stay under the global rate limit. When the bot runs as a
+    cluster, channels of guilds connected to other clusters are messaged by id, so the whole broadcast is paced by
+    the cluster sending it, since the global rate limit is shared by all of them.
+
+    Targets are processed in guild id order and the broadcast's cursor is saved as the highest guild id below
+    which every target was processed, so an interrupted broadcast resumes from there. Concurrent sends finish out
+    of order, so the ids of the guilds after the cursor that were already processed are saved too and skipped
+    when the broadcast resumes.
+    """
+
+    CONCURRENCY = 10
+    # Discord's global rate limit is 50 requests per second, shared with everything else the bot does
+    REQUESTS_PER_SECOND = 40.0
+    PROGRESS_INTERVAL = 5.0
+
+    def __init__(self, bot, record: AobaBroadcast, targets: List[Tuple[int, int]]):
+        """
+        :param bot: bot sending the broadcast
+        :param record: broadcast record with the text and where the progress is saved
+        :param targets: (guild id, announcement channel id) pairs after the record's cursor, ordered by guild id,
+                        the ones the record lists as processed are skipped
+        """
+        self.bot = bot
+        self.record = record
+        self._previously_processed = parse_guild_ids(record.processed_guild_ids)
+        self.targets = [
+            target for target in targets if target[0] not in self._previously_processed
+        ]
+
+        self.sent = 0
+        self.failures: List[Tuple[int, str]] = list()
+        # True for targets that received the message, False for failed ones and None for the rest
+        self._results: List[Optional[bool]] = [None] * len(self.targets)
+        self._checkpoint = 0
+        self._limiter = RateLimiter(
+            self.REQUESTS_PER_SECOND,
+            int(self.REQUESTS_PER_SECOND),
+            len(self.targets) + 1,
+        )
+
+    @property
+    def processed(self) -> int:
+        return self.sent + len(self.failures)
+
+    def _advance_checkpoint(self) -> int:
+        """
+        return: number of leading targets that were all processed
+        """
+        while (
+            self._checkpoint < len(self._results)
+            and self._results[self._checkpoint] is not None
+        ):
+            self._checkpoint += 1
+        return self._checkpoint
+
+    async def run(self, on_progress: Callable[["Broadcast"], Awaitable[None]]) -> None:
+        """
+        Sends the broadcast, calling on_progress periodically and once more at the end. Cancelling the task
+        running the broadcast stops it with its progress saved.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in range(len(self.targets)):
+            queue.put_nowait(index)
+
+        workers = [
+            asyncio.ensure_future(self._worker(queue))
+            for _ in range(min(self.CONCURRENCY, len(self.targets)))
+        ]
+        reporter = asyncio.ensure_future(self._report_progress(on_progress))
+        finished = False
+        try:
+            await asyncio.gather(*workers)
+            finished = True
+        finally:
+            reporter.cancel()
+            for worker in workers:
+                worker.cancel()
+            await self._save_progress(finished)
+            await on_progress(self)
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while not queue.empty():
+            index = queue.get_nowait()
+            guild_id, channel_id = self.targets[index]
+            error = await self._send(channel_id)
+            if error:
+                self.failures.append((guild_id, error))
+                logging.warning(f"Broadcast to guild {guild_id} failed: {error}")
+            else:
+                self.sent += 1
+            self._results[index] = error is None
+
+    async def _send(self, channel_id: int) -> Optional[str]:
+        try:
+            return await self._send_message(channel_id)
+        except Exception as e:
+            # Connection errors, timeouts or bugs fail the target instead of stopping the worker
+            logging.exception(f"Unexpected error broadcasting to channel {channel_id}")
+            return f"{type(e).__name__}: {e}"
+
+    async def _send_message(self, channel_id: int) -> Optional[str]:
+        """
+        return: None if the message was sent, otherwise the reason it failed
+        """
+        channel = self.bot.get_channel(channel_id)
+        if channel is None and self.bot.cluster is None:
+            return "channel not found"
+
+        await self._limiter.acquire()
+        try:
+            if channel is not None:
+                await channel.send(self.record.text)
+            else:
+                await self.bot.http.send_message(channel_id, self.record.text)
+        except discord.NotFound:
+            return "channel not found"
+        except discord.Forbidden:
+            return "missing permissions"
+        except discord.HTTPException as e:
+            return f"HTTP error {e.status}"
+        return None
+
+    async def _report_progress(
+        self, on_progress: Callable[["Broadcast"], Awaitable[None]]
+    ) -> None:
+        while True:
+            await asyncio.sleep(self.PROGRESS_INTERVAL)
+            await self._save_progress(finished=False)
+            await on_progress(self)
+
+    async def _save_progress(self, finished: bool) -> None:
+        """
+        Saves the cursor, the guilds after it that were already processed and the counts of every processed
+        target.
+        """
+        checkpoint = self._advance_checkpoint()
+        cursor = self.targets[checkpoint - 1][0] if checkpoint else self.record.cursor
+        processed_guild_ids = {
+            guild_id
+            for guild_id in self._previously_processed
+            if guild_id > (cursor or 0)
+        }
+        processed_guild_ids.update(
+            self.targets[index][0]
+            for index in range(checkpoint, len(self.targets))
+            if self._results[index] is not None
+        )
+
+        async with self.bot.session_scope() as session:
+            broadcast = await repository.get_broadcast(session, self.record.id)
+            broadcast.cursor = cursor
+            broadcast.processed_guild_ids = format_guild_ids(processed_guild_ids)
+            broadcast.sent = (self.record.sent or 0) + self.sent
+            broadcast.failed = (self.record.failed or 0) + len(self.failures)
+            broadcast.finished = finished
+
+
+def parse_guild_ids(value: Optional[str]) -> Set[int]:
+    return {int(guild_id) for guild_id in value.split(",")} if value else set()
+
+
+def format_guild_ids(guild_ids: Set[int]) -> str:
+    return ",".join(str(guild_id) for guild_id in sorted(guild_ids))
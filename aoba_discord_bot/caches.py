@@ -0,0 +1,230 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+DEFAULT_COMMAND_PREFIX = "!"
+
+
+class PrefixCache:
+    """
+    In-process mapping of guild ids to their command prefixes.
+
+    The bot resolves the prefix of every message it sees, so this is kept in memory and written through by
+    every code path that changes a guild's prefix instead of being read from the database.
+    """
+
+    def __init__(self, default_prefix: str = DEFAULT_COMMAND_PREFIX):
+        self.default_prefix = default_prefix
+        self._prefixes: Dict[int, str] = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._prefixes)
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self._prefixes
+
+    def get(self, guild_id: int) -> str:
+        """
+        Get the prefix of a guild, falling back to the default prefix for unknown guilds.
+        :param guild_id: id of the guild
+        return: the guild's command prefix
+        """
+        prefix = self._prefixes.get(guild_id)
+        if prefix is None:
+            self.misses += 1
+            return self.default_prefix
+        self.hits += 1
+        return prefix
+
+    def set(self, guild_id: int, prefix: str) -> None:
+        self._prefixes[guild_id] = prefix or self.default_prefix
+
+    def remove(self, guild_id: int) -> None:
+        self._prefixes.pop(guild_id, None)
+
+    def warm(self, prefixes: Iterable[Tuple[int, str]]) -> None:
+        """
+        Fill the cache with (guild id, prefix) pairs, usually every guild record in the database.
+        """
+        for guild_id, prefix in prefixes:
+            self.set(guild_id, prefix)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self), "hits": self.hits, "misses": self.misses}
+
+
+class CustomCommandRegistry:
+    """
+    Custom commands of every guild, indexed by (guild id, command name).
+
+    Custom commands are not registered as bot commands, so each guild only sees its own and the bot's command
+    table doesn't grow with the number of guilds.
+    """
+
+    def __init__(self):
+        self._commands: Dict[Tuple[int, str], str] = dict()
+
+    def __len__(self) -> int:
+        return len(self._commands)
+
+    def __contains__(self, key: Tuple[int, str]) -> bool:
+        return key in self._commands
+
+    def get(self, guild_id: int, name: str) -> Optional[str]:
+        """
+        Get the text of a custom command.
+        :param guild_id: id of the guild the command belongs to
+        :param name: name used to invoke the command
+        return: the text displayed by the command or None if the guild has no such command
+        """
+        return self._commands.get((guild_id, name))
+
+    def add(self, guild_id: int, name: str, text: str) -> None:
+        self._commands[(guild_id, name)] = text
+
+    def remove(self, guild_id: int, name: str) -> bool:
+        return self._commands.pop((guild_id, name), None) is not None
+
+    def remove_guild(self, guild_id: int) -> None:
+        """
+        Removes every custom command of a guild. Scans the whole registry, which is fine for the rare guild that
+        removes the bot.
+        """
+        for key in [key for key in self._commands if key[0] == guild_id]:
+            del self._commands[key]
+
+    def load(self, commands: Iterable[Tuple[int, str, str]]) -> None:
+        """
+        Fill the registry with (guild id, name, text) triples, usually every command record in the database.
+        """
+        for guild_id, name, text in commands:
+            self.add(guild_id, name, text)
+
+
+class TTLCache:
+    """
+    Bounded least recently used cache whose entries expire after a fixed time to live.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0):
+        """
+        :param max_size: maximum number of entries, the least recently used entry is evicted past it
+        :param ttl: seconds an entry stays valid after being set
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def remove(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 2) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class AnnouncementChannelIndex:
+    """
+    Announcement channel of every guild that set one, by guild id.
+
+    Written through by set_channel and kept in sync with channel deletions, so announcement commands don't
+    read the guild's record.
+    """
+
+    def __init__(self):
+        self._channels: Dict[int, int] = dict()
+        # Guild of each announcement channel, to find the guild when a channel is deleted
+        self._guilds: Dict[int, int] = dict()
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    def get(self, guild_id: int) -> Optional[int]:
+        return self._channels.get(guild_id)
+
+    def set(self, guild_id: int, channel_id: Optional[int]) -> None:
+        self.remove(guild_id)
+        if channel_id is not None:
+            self._channels[guild_id] = channel_id
+            self._guilds[channel_id] = guild_id
+
+    def remove(self, guild_id: int) -> None:
+        channel_id = self._channels.pop(guild_id, None)
+        if channel_id is not None:
+            del self._guilds[channel_id]
+
+    def remove_channel(self, channel_id: int) -> Optional[int]:
+        """
+        Removes a channel that was deleted.
+        return: id of the guild the channel was the announcement channel of, None if it wasn't one
+        """
+        guild_id = self._guilds.get(channel_id)
+        if guild_id is not None:
+            self.remove(guild_id)
+        return guild_id
+
+    def targets(self, after_guild_id: int = 0) -> List[Tuple[int, int]]:
+        """
+        return: (guild id, channel id) of the guilds with a greater id than after_guild_id, ordered by guild id
+        """
+        return sorted(
+            (guild_id, channel_id)
+            for guild_id, channel_id in self._channels.items()
+            if guild_id > after_guild_id
+        )
+
+    def warm(self, channels: Iterable[Tuple[int, int]]) -> None:
+        """
+        Fill the index with (guild id, channel id) pairs, usually the guild records with a channel set.
+        """
+        for guild_id, channel_id in channels:
+            self.set(guild_id, channel_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self)}
@@ -0,0 +1,427 @@
+"""
+Console script running Aoba as several processes (clusters), each connected to a range of shards, so the bot uses
+more than one CPU core.
+
+The supervisor process starts the clusters, restarts the ones that crash and relays messages between them. Each
+cluster talks to the supervisor over a pipe through a ClusterClient, which the cogs use for the operations that
+need the whole fleet.
+"""
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import signal
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection, wait
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+import aiohttp
+import click
+
+from aoba_discord_bot import cli
+from aoba_discord_bot.rate_limit import backoff_delay
+
+GATEWAY_BOT_URL = "https://discord.com/api/v8/gateway/bot"
+
+
+def split_shards(shard_count: int, cluster_count: int) -> List[range]:
+    """
+    Splits the shards in contiguous ranges of nearly the same size, one for each cluster.
+    """
+    size, remainder = divmod(shard_count, cluster_count)
+    ranges = list()
+    start = 0
+    for cluster_id in range(cluster_count):
+        end = start + size + (1 if cluster_id < remainder else 0)
+        ranges.append(range(start, end))
+        start = end
+    return ranges
+
+
+async def fetch_recommended_shard_count(token: str) -> int:
+    headers = {"Authorization": f"Bot {token}"}
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async with session.get(GATEWAY_BOT_URL) as response:
+            response.raise_for_status()
+            return (await response.json())["shards"]
+
+
+class _PendingRequest:
+    def __init__(self):
+        self.results: List[Any] = list()
+        self.expected: Optional[int] = None
+        self.done = asyncio.get_event_loop().create_future()
+
+    def expect(self, count: int) -> None:
+        self.expected = count
+        self._check_done()
+
+    def add(self, result: Any) -> None:
+        self.results.append(result)
+        self._check_done()
+
+    def _check_done(self) -> None:
+        if (
+            self.expected is not None
+            and len(self.results) >= self.expected
+            and not self.done.done()
+        ):
+            self.done.set_result(None)
+
+
+class ClusterClient:
+    """
+    Cluster side of the communication with the supervisor.
+
+    A request runs an operation in every cluster, including the one making it, and collects the results of the
+    handlers the clusters registered for the operation.
+    """
+
+    def __init__(self, cluster_id: int, connection: Connection, timeout: float = 5.0):
+        """
+        :param cluster_id: id of this cluster
+        :param connection: this cluster's end of the pipe to the supervisor
+        :param timeout: seconds to wait for the results of a request
+        """
+        self.cluster_id = cluster_id
+        self.connection = connection
+        self.timeout = timeout
+        self._handlers: Dict[str, Callable[..., Awaitable[Any]]] = dict()
+        self._requests: Dict[int, _PendingRequest] = dict()
+        self._request_ids = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Starts receiving messages from the supervisor, which are handled in the event loop.
+        """
+        self._loop = loop
+        threading.Thread(
+            target=self._receive, name="cluster-connection", daemon=True
+        ).start()
+
+    def register(self, operation: str, handler: Callable[..., Awaitable[Any]]):
+        self._handlers[operation] = handler
+
+    async def request(self, operation: str, *args) -> List[Any]:
+        """
+        Runs an operation in every cluster.
+        return: results of the clusters that answered before the timeout, None for the ones that failed
+        """
+        request_id = next(self._request_ids)
+        request = _PendingRequest()
+        self._requests[request_id] = request
+        self.connection.send(("request", request_id, operation, args))
+        try:
+            await asyncio.wait_for(request.done, self.timeout)
+        except asyncio.TimeoutError:
+            logging.warning(
+                f"Only {len(request.results)} clusters answered the {operation} request"
+            )
+        finally:
+            del self._requests[request_id]
+        return request.results
+
+    def publish(self, operation: str, *args) -> None:
+        """
+        Runs an operation in every cluster without waiting for the results.
+        """
+        self.connection.send(("request", None, operation, args))
+
+    def _receive(self) -> None:
+        while True:
+            try:
+                message = self.connection.recv()
+            except (EOFError, OSError):
+                logging.error("Lost the connection to the cluster supervisor")
+                return
+            self._loop.call_soon_threadsafe(self._dispatch, message)
+
+    def _dispatch(self, message: tuple) -> None:
+        kind = message[0]
+        if kind == "handle":
+            _, origin, request_id, operation, args = message
+            asyncio.ensure_future(self._handle(origin, request_id, operation, args))
+        elif kind == "sent":
+            _, request_id, count = message
+            if request_id in self._requests:
+                self._requests[request_id].expect(count)
+        elif kind == "response":
+            _, request_id, result = message
+            if request_id in self._requests:
+                self._requests[request_id].add(result)
+
+    async def _handle(
+        self, origin: int, request_id: Optional[int], operation: str, args: tuple
+    ) -> None:
+        result = None
+        handler = self._handlers.get(operation)
+        if handler is None:
+            logging.warning(f"No handler for the cluster operation {operation}")
+        else:
+            try:
+                result = await handler(*args)
+            except Exception:
+                logging.exception(f"Cluster operation {operation} failed")
+
+        if request_id is not None:
+            self.connection.send(("response", origin, request_id, result))
+
+
+def run_cluster(
+    cluster_id: int,
+    shard_ids: List[int],
+    shard_count: int,
+    bot_args: List[str],
+    connection: Connection,
+) -> None:
+    """
+    Entry point of a cluster process.
+    """
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format=f"cluster {cluster_id}:%(levelname)s:%(name)s:%(message)s",
+    )
+
+    args = list(bot_args) + [
+        "--shard_count",
+        str(shard_count),
+        "--shard_ids",
+        f"{shard_ids[0]}-{shard_ids[-1]}",
+    ]
+    options = cli.main.make_context("aoba_discord_bot", args).params
+    bot = cli.create_bot(**options)
+    bot.cluster = ClusterClient(cluster_id, connection)
+    bot.cluster.start(bot.loop)
+    bot.run(options["token"])
+
+
+class _Cluster:
+    def __init__(self, cluster_id: int, shard_ids: range):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.process: Optional[multiprocessing.Process] = None
+        self.connection: Optional[Connection] = None
+        self.started_at = 0.0
+        self.restart_at: Optional[float] = None
+        self.restarts = 0
+
+
+class ClusterSupervisor:
+    """
+    Starts a process for each cluster, restarts the ones that exit with an error and relays the requests and
+    results the clusters send each other.
+    """
+
+    RESTART_BASE_DELAY = 1.0
+    RESTART_MAX_DELAY = 60.0
+    # A cluster that crashes after running this long is restarted without the backoff of its previous crashes
+    STABLE_UPTIME = 300.0
+    SHUTDOWN_TIMEOUT = 30.0
+
+    def __init__(self, shard_count: int, cluster_count: int, bot_args: Sequence[str]):
+        """
+        :param shard_count: total number of shards
+        :param cluster_count: number of processes the shards are split between
+        :param bot_args: command line options of the bot, passed to every cluster
+        """
+        self.shard_count = shard_count
+        self.bot_args = list(bot_args)
+        self.clusters = [
+            _Cluster(cluster_id, shard_ids)
+            for cluster_id, shard_ids in enumerate(
+                split_shards(shard_count, cluster_count)
+            )
+        ]
+        # Clusters are started in a fresh interpreter, forking would copy the supervisor's threads and connections
+        self._context = multiprocessing.get_context("spawn")
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._on_sigterm)
+        for cluster in self.clusters:
+            self._start(cluster)
+
+        try:
+            while any(
+                cluster.process or cluster.restart_at for cluster in self.clusters
+            ):
+                self._supervise()
+        except KeyboardInterrupt:
+            logging.info("Stopping the clusters")
+        finally:
+            self._stop_all()
+
+    def _start(self, cluster: _Cluster) -> None:
+        supervisor_connection, cluster_connection = self._context.Pipe()
+        cluster.process = self._context.Process(
+            target=run_cluster,
+            args=(
+                cluster.cluster_id,
+                list(cluster.shard_ids),
+                self.shard_count,
+                self.bot_args,
+                cluster_connection,
+            ),
+            name=f"aoba-cluster-{cluster.cluster_id}",
+        )
+        cluster.process.start()
+        cluster_connection.close()
+        cluster.connection = supervisor_connection
+        cluster.started_at = time.monotonic()
+        cluster.restart_at = None
+        logging.info(
+            f"Started cluster {cluster.cluster_id} with shards {cluster.shard_ids[0]}-{cluster.shard_ids[-1]} "
+            f"as process {cluster.process.pid}"
+        )
+
+    def _supervise(self) -> None:
+        """
+        Waits for a message from a cluster, a cluster to exit or a restart to be due, and handles it.
+        """
+        connections = {
+            cluster.connection: cluster for cluster in self.clusters if cluster.process
+        }
+        sentinels = {
+            cluster.process.sentinel: cluster
+            for cluster in self.clusters
+            if cluster.process
+        }
+        restart_times = [
+            cluster.restart_at for cluster in self.clusters if cluster.restart_at
+        ]
+        timeout = (
+            max(0.0, min(restart_times) - time.monotonic()) if restart_times else None
+        )
+
+        for ready in wait(list(connections) + list(sentinels), timeout):
+            cluster = connections.get(ready) or sentinels.get(ready)
+            # Both the connection and the sentinel of an exiting cluster can be ready
+            if cluster.process is None:
+                continue
+            if ready in connections:
+                self._receive(cluster)
+            else:
+                self._on_exit(cluster)
+
+        for cluster in self.clusters:
+            if cluster.restart_at and cluster.restart_at <= time.monotonic():
+                self._start(cluster)
+
+    def _receive(self, cluster: _Cluster) -> None:
+        try:
+            message = cluster.connection.recv()
+        except (EOFError, OSError):
+            self._on_exit(cluster)
+            return
+
+        kind = message[0]
+        if kind == "request":
+            _, request_id, operation, args = message
+            running = [cluster for cluster in self.clusters if cluster.process]
+            if request_id is not None:
+                self._send(cluster, ("sent", request_id, len(running)))
+            for target in running:
+                self._send(
+                    target,
+                    ("handle", cluster.cluster_id, request_id, operation, args),
+                )
+        elif kind == "response":
+            _, origin, request_id, result = message
+            origin_cluster = self.clusters[origin]
+            if origin_cluster.process:
+                self._send(origin_cluster, ("response", request_id, result))
+
+    @staticmethod
+    def _send(cluster: _Cluster, message: tuple) -> None:
+        try:
+            cluster.connection.send(message)
+        except OSError:
+            # The cluster exited, which is handled when its sentinel is ready
+            pass
+
+    def _on_exit(self, cluster: _Cluster) -> None:
+        cluster.process.join()
+        exit_code = cluster.process.exitcode
+        cluster.connection.close()
+        cluster.process = None
+        cluster.connection = None
+
+        if exit_code == 0:
+            logging.info(f"Cluster {cluster.cluster_id} stopped")
+            return
+
+        if time.monotonic() - cluster.started_at >= self.STABLE_UPTIME:
+            cluster.restarts = 0
+        delay = backoff_delay(
+            cluster.restarts, self.RESTART_BASE_DELAY, self.RESTART_MAX_DELAY
+        )
+        cluster.restarts += 1
+        cluster.restart_at = time.monotonic() + delay
+        logging.error(
+            f"Cluster {cluster.cluster_id} exited with code {exit_code}, restarting it in {delay:.1f}s"
+        )
+
+    def _on_sigterm(self, signum, frame) -> None:
+        for cluster in self.clusters:
+            if cluster.process and cluster.process.is_alive():
+                cluster.process.terminate()
+        raise KeyboardInterrupt
+
+    def _stop_all(self) -> None:
+        """
+        Waits for the clusters to close the bot after being interrupted, terminating the ones that don't.
+        """
+        running = [cluster.process for cluster in self.clusters if cluster.process]
+        deadline = time.monotonic() + self.SHUTDOWN_TIMEOUT
+        for process in running:
+            process.join(max(0.0, deadline - time.monotonic()))
+
+        for process in running:
+            if process.is_alive():
+                logging.warning(f"Terminating {process.name}")
+                process.terminate()
+                process.join(self.SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                process.kill()
+
+
+@click.command(context_settings={"ignore_unknown_options": True})
+@click.option(
+    "--clusters",
+    type=int,
+    envvar="CLUSTERS",
+    help="Number of bot processes, defaults to the number of CPU cores",
+)
+@click.option(
+    "--shard_count",
+    type=int,
+    envvar="SHARD_COUNT",
+    help="Total number of shards, defaults to the number recommended by Discord",
+)
+@click.option("--token", prompt="Token", envvar="TOKEN", help="Discord API token")
+@click.argument("bot_options", nargs=-1, type=click.UNPROCESSED)
+def main(clusters, shard_count, token, bot_options):
+    """
+    Runs Aoba as several processes, each connected to a range of shards.
+
+    Options not listed here are passed to every process, see aoba_discord_bot --help.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    bot_args = list(bot_options) + ["--token", token]
+    # Invalid bot options are reported here instead of crashing every cluster
+    cli.main.make_context("aoba_discord_bot", list(bot_args))
+
+    if shard_count is None:
+        shard_count = asyncio.run(fetch_recommended_shard_count(token))
+        logging.info(f"Discord recommends {shard_count} shards")
+    cluster_count = min(clusters or multiprocessing.cpu_count(), shard_count)
+
+    ClusterSupervisor(shard_count, cluster_count, bot_args).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())  # pragma: no cover
@@ -1,12 +1,12 @@
+from typing import Optional
+
 import discord
 from discord import User
 from discord.ext import commands
 from discord.ext.commands import Context
-from sqlalchemy.future import select
 
-from aoba_discord_bot import AobaDiscordBot
+from aoba_discord_bot import AobaDiscordBot, repository
 from aoba_discord_bot.aoba_checks import author_is_admin
-from aoba_discord_bot.db_models import AobaCommand, AobaGuild
 
 
 class Admin(commands.Cog, name="Admin"):
@@ -35,71 +35,58 @@ class Admin(commands.Cog, name="Admin"):
         :param name: name used to invoke the new command
         :param text: text that will be displayed
         """
-        async with self.bot.Session() as session:
-            q = select(AobaGuild)
-            result = await session.execute(q)
-            guild_db_record = next(
-                iter(
-                    filter(lambda g: g.guild_id == ctx.guild.id, result.scalars().all())
-                ),
-                None,
+        # Bot commands take precedence, a custom command with the same name could never be invoked
+        if self.bot.get_command(name) is not None:
+            await ctx.channel.send(
+                f"Error adding command `{name}`, a bot command already has this name"
             )
-            if not guild_db_record:
-                await ctx.channel.send(
-                    "Error trying to get guild id record, check the logs for more information"
-                )
-                return
-            new_cmd = AobaCommand(name=name, text=text, guild=guild_db_record)
-            await session.merge(new_cmd)
-            await session.commit()
-
-            self.bot.add_command(commands.Command(ctx.bot.custom_command, name=name))
-            await ctx.channel.send(f"Command `{name}` was successfully added!")
+            return
+
+        async with self.bot.session_scope() as session:
+            guild_db_record = await repository.get_guild(session, ctx.guild.id)
+            if guild_db_record:
+                await repository.set_command(session, ctx.guild.id, name, text)
+
+        if not guild_db_record:
+            await ctx.channel.send(
+                "Error trying to get guild id record, check the logs for more information"
+            )
+            return
+
+        self.bot.custom_commands.add(ctx.guild.id, name, text)
+        await ctx.channel.send(f"Command `{name}` was successfully added!")
 
     @commands.check(author_is_admin)
     @custom_cmd.command(name="del", help="Delete a custom command")
     async def del_command(self, ctx: Context, name: str):
-        async with self.bot.Session() as session:
-            cmd_records = (await session.execute(select(AobaCommand))).scalars().all()
-            cmd_record = next(
-                iter(
-                    filter(
-                        lambda cmd: cmd.guild_id == ctx.guild.id and cmd.name == name,
-                        cmd_records,
-                    )
-                ),
-                None,
-            )
-            if not cmd_record:
-                await ctx.channel.send("Command not found!")
-                return
-            await session.delete(cmd_record)
-            await session.commit()
-            self.bot.remove_command(name)
-            await ctx.channel.send(f"Command `{name}` was successfully deleted!")
+        async with self.bot.session_scope() as session:
+            cmd_record = await repository.get_command(session, ctx.guild.id, name)
+            if cmd_record:
+                await session.delete(cmd_record)
+
+        if not cmd_record:
+            await ctx.channel.send("Command not found!")
+            return
+
+        self.bot.custom_commands.remove(ctx.guild.id, name)
+        await ctx.channel.send(f"Command `{name}` was successfully deleted!")
 
     @commands.check(author_is_admin)
     @commands.command(help="Set the default command prefix")
     async def prefix(self, ctx: Context, new_prefix: str):
-        async with self.bot.Session() as session:
-            q = select(AobaGuild)
-            result = await session.execute(q)
-            guild_db_record = next(
-                iter(
-                    filter(lambda g: g.guild_id == ctx.guild.id, result.scalars().all())
-                ),
-                None,
+        async with self.bot.session_scope() as session:
+            guild_db_record = await repository.get_guild(session, ctx.guild.id)
+            if guild_db_record:
+                guild_db_record.command_prefix = new_prefix
+
+        if not guild_db_record:
+            await ctx.channel.send(
+                "Error trying to get guild id record, check the logs for more information"
             )
-            if not guild_db_record:
-                await ctx.channel.send(
-                    "Error trying to get guild id record, check the logs for more information"
-                )
-                return
+            return
 
-            guild_db_record.command_prefix = new_prefix
-            await session.merge(guild_db_record)
-            await session.commit()
-            await ctx.channel.send(f"Command prefix changed to `{new_prefix}`")
+        self.bot.prefix_cache.set(ctx.guild.id, new_prefix)
+        await ctx.channel.send(f"Command prefix changed to `{new_prefix}`")
 
     @commands.check(author_is_admin)
     @commands.command(help="Kick a member from this server")
@@ -132,38 +119,48 @@ class Admin(commands.Cog, name="Admin"):
     @commands.check(author_is_admin)
     @announcement.command(help="Set the default announcement channel for the server")
     async def set_channel(self, ctx: Context, channel: discord.TextChannel):
-        async with self.bot.Session() as session:
-            query = select(AobaGuild).where(AobaGuild.guild_id == ctx.guild.id)
-            guild = (await session.execute(query)).scalars().first()
-            guild.announcement_channel_id = channel.id
-            await session.merge(guild)
-            await session.commit()
-            await ctx.send(f"Announcement channel set to {channel.name}!")
+        async with self.bot.session_scope() as session:
+            has_record = await repository.set_announcement_channel(
+                session, ctx.guild.id, channel.id
+            )
+
+        if not has_record:
+            await ctx.channel.send(
+                "Error trying to get guild id record, check the logs for more information"
+            )
+            return
+
+        self.bot.announcement_channels.set(ctx.guild.id, channel.id)
+        await ctx.send(f"Announcement channel set to {channel.name}!")
+
+    def _announcement_channel(self, ctx: Context) -> Optional[discord.TextChannel]:
+        """
+        return: the guild's announcement channel, None if it isn't set or the channel no longer exists
+        """
+        channel_id = self.bot.announcement_channels.get(ctx.guild.id)
+        return ctx.guild.get_channel(channel_id) if channel_id else None
 
     @commands.check(author_is_admin)
     @announcement.command(help="Get the default announcement channel for the server")
     async def get_channel(self, ctx: Context):
-        async with self.bot.Session() as session:
-            query = select(AobaGuild).where(AobaGuild.guild_id == ctx.guild.id)
-            guild = (await session.execute(query)).scalars().first()
-            channel_name = ctx.guild.get_channel(guild.announcement_channel_id).name
-            await ctx.send(f"The announcement channel is {channel_name}!")
+        channel = self._announcement_channel(ctx)
+        if channel is None:
+            await ctx.send("No announcement channel set!")
+            return
+
+        await ctx.send(f"The announcement channel is {channel.name}!")
 
     @commands.check(author_is_admin)
     @announcement.command(
         help="Make an announcement using the default announcement channel"
     )
     async def new(self, ctx: Context, *messages: str):
-        async with self.bot.Session() as session:
-            query = select(AobaGuild).where(AobaGuild.guild_id == ctx.guild.id)
-            guild = (await session.execute(query)).scalars().first()
-
-            if not guild.announcement_channel_id:
-                await ctx.send("No announcement channel set!")
-                return
+        channel = self._announcement_channel(ctx)
+        if channel is None:
+            await ctx.send("No announcement channel set!")
+            return
 
-            channel = ctx.guild.get_channel(guild.announcement_channel_id)
-            await channel.send(" ".join(messages))
+        await channel.send(" ".join(messages))
 
 
 def setup(bot: AobaDiscordBot):
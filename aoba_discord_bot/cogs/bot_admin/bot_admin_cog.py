@@ -1,12 +1,13 @@
-from typing import List
+import asyncio
+from typing import List, Optional, Tuple
 
 import discord
-from discord import Guild, Member, TextChannel
+from discord import Message
 from discord.ext import commands
 from discord.ext.commands import Context
-from sqlalchemy import select
 
-from aoba_discord_bot import AobaDiscordBot, AobaGuild
+from aoba_discord_bot import AobaBroadcast, AobaDiscordBot, repository
+from aoba_discord_bot.broadcast import Broadcast
 
 
 class BotAdmin(
@@ -15,20 +16,53 @@ class BotAdmin(
 ):
     def __init__(self, bot: AobaDiscordBot):
         self.bot = bot
+        self._broadcast_task: Optional[asyncio.Task] = None
+
+        if bot.cluster:
+            bot.cluster.register("shutdown", self._shutdown)
+            bot.cluster.register("guild_names", self._guild_names)
+            bot.cluster.register("broadcast_running", self._broadcast_running)
+            bot.cluster.register("cancel_broadcast", self._cancel_broadcast)
+
+    async def _shutdown(self):
+        await self.bot.change_presence(status=discord.Status.offline)
+        await self.bot.close()
+
+    async def _guild_names(self):
+        return [guild.name for guild in self.bot.guilds]
+
+    async def _broadcast_running(self) -> bool:
+        return self._broadcast_task is not None and not self._broadcast_task.done()
+
+    async def _cancel_broadcast(self) -> bool:
+        if not await self._broadcast_running():
+            return False
+        self._broadcast_task.cancel()
+        return True
 
     @commands.is_owner()
     @commands.command(help="Shutdown the bot")
     async def shutdown(self, ctx: Context):
         await ctx.channel.send("Shutting down, bye admin!")
-        await self.bot.change_presence(status=discord.Status.offline)
-        await self.bot.close()
+        if self.bot.cluster:
+            self.bot.cluster.publish("shutdown")
+        else:
+            await self._shutdown()
 
     @commands.is_owner()
     @commands.command(
         name="guilds", aliases=["servers"], help="List of servers running Aoba"
     )
     async def get_guilds(self, ctx: Context):
-        guilds_list_str = ", ".join([guild.name for guild in self.bot.guilds])
+        if self.bot.cluster:
+            guild_names = [
+                name
+                for cluster_guild_names in await self.bot.cluster.request("guild_names")
+                for name in cluster_guild_names or []
+            ]
+        else:
+            guild_names = await self._guild_names()
+        guilds_list_str = ", ".join(guild_names)
         await ctx.channel.send(f"**Guilds:**\n > {guilds_list_str}")
 
     @commands.is_owner()
@@ -44,6 +78,18 @@ class BotAdmin(
         await self.bot.change_presence(activity=self.bot.activity)
         await ctx.send(f"My status was changed to `{status}`!")
 
+    @commands.is_owner()
+    @commands.command(help="Show Aoba's internal statistics")
+    async def stats(self, ctx: Context):
+        sections = self.bot.stats_sections()
+        lines = [
+            f"**{title}:**\n > "
+            + ", ".join(f"{name}: {value}" for name, value in stats.items())
+            for title, stats in sections.items()
+            if stats
+        ]
+        await ctx.send("\n".join(lines))
+
     @commands.is_owner()
     @commands.command(
         help="Make an announcement in every server with an announcement server set"
@@ -51,18 +97,92 @@ class BotAdmin(
     async def aoba_announce(self, ctx: Context, *texts: str):
         text = " ".join(texts)
 
+        if await self._fleet_broadcast_running():
+            await ctx.send("An announcement is already being sent!")
+            return
+
+        async with self.bot.session_scope() as session:
+            record = AobaBroadcast(text=text)
+            session.add(record)
+        await self._run_broadcast(ctx, record)
+
+    @commands.is_owner()
+    @commands.command(help="Resume the last interrupted announcement")
+    async def aoba_announce_resume(self, ctx: Context):
+        if await self._fleet_broadcast_running():
+            await ctx.send("An announcement is already being sent!")
+            return
+
         async with self.bot.Session() as session:
-            query = select(AobaGuild).where(AobaGuild.announcement_channel_id != None)
-            aoba_guilds = (await session.execute(query)).scalars().all()
-            channels: List[TextChannel] = [
-                ctx.guild.get_channel(guild.announcement_channel_id)
-                for guild in aoba_guilds
-            ]
+            record = await repository.get_unfinished_broadcast(session)
+
+        if not record:
+            await ctx.send("There is no interrupted announcement!")
+            return
+        await self._run_broadcast(ctx, record)
+
+    @commands.is_owner()
+    @commands.command(help="Stop the announcement being sent, it can be resumed later")
+    async def aoba_announce_cancel(self, ctx: Context):
+        if self.bot.cluster:
+            cancelled = any(await self.bot.cluster.request("cancel_broadcast"))
+        else:
+            cancelled = await self._cancel_broadcast()
+
+        if not cancelled:
+            await ctx.send("No announcement is being sent!")
+
+    async def _fleet_broadcast_running(self) -> bool:
+        """
+        return: whether an announcement is being sent by this bot or, when running as a cluster, any cluster
+        """
+        if self.bot.cluster:
+            return any(await self.bot.cluster.request("broadcast_running"))
+        return await self._broadcast_running()
+
+    async def _announcement_targets(self, after_guild_id: int) -> List[Tuple[int, int]]:
+        """
+        return: (guild id, announcement channel id) of the guilds after the given one, ordered by guild id
+        """
+        # The index only has the guilds of this process, a cluster's announcement reaches every cluster's guilds
+        if self.bot.cluster:
+            async with self.bot.Session() as session:
+                return await repository.get_announcement_channels(
+                    session, after_guild_id=after_guild_id
+                )
+        return self.bot.announcement_channels.targets(after_guild_id)
 
-            await ctx.send(f"Announcing `{text}` in {len(channels)} servers.")
+    async def _run_broadcast(self, ctx: Context, record: AobaBroadcast):
+        targets = await self._announcement_targets(record.cursor or 0)
+        broadcast = Broadcast(self.bot, record, targets)
+        status_message: Message = await ctx.send(
+            f"Announcing `{record.text}` in {len(broadcast.targets)} servers."
+        )
+
+        async def on_progress(progress: Broadcast):
+            await status_message.edit(
+                content=f"Announcing `{record.text}`: {progress.processed}/{len(broadcast.targets)} servers done, "
+                f"{len(progress.failures)} failed."
+            )
+
+        self._broadcast_task = asyncio.ensure_future(broadcast.run(on_progress))
+        try:
+            await self._broadcast_task
+        except asyncio.CancelledError:
+            await ctx.send(
+                f"Announcement stopped after {broadcast.processed} servers, "
+                f"use `aoba_announce_resume` to continue it."
+            )
+            return
 
-            for channel in channels:
-                await channel.send(text)
+        summary = f"Announced in {broadcast.sent} servers."
+        if broadcast.failures:
+            failures = "\n".join(
+                f" > `{guild_id}`: {reason}"
+                for guild_id, reason in broadcast.failures[:10]
+            )
+            summary += f" Failed in {len(broadcast.failures)} servers:\n{failures}"
+        await ctx.send(summary)
 
 
 def setup(bot: AobaDiscordBot):
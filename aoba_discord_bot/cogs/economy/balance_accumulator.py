@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import AsyncContextManager, Callable, Dict, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from aoba_discord_bot import repository
+
+
+class BalanceAccumulator:
+    """
+    Write-behind buffer for small, frequent bank balance changes.
+
+    Changes are merged per user in memory and written to the database in bulk every flush interval, or as soon as
+    the number of users with pending changes reaches the flush size.
+    """
+
+    def __init__(
+        self,
+        session_scope: Callable[[], AsyncContextManager[AsyncSession]],
+        flush_interval: float = 10.0,
+        flush_size: int = 500,
+        on_flush: Callable[[Dict[int, int]], None] = None,
+    ):
+        """
+        :param session_scope: unit of work the changes are written in, usually AobaDiscordBot.session_scope
+        :param flush_interval: seconds between flushes
+        :param flush_size: number of users with pending changes that triggers an early flush
+        :param on_flush: called with the new balances, by discord id, after each flush
+        """
+        self.session_scope = session_scope
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.on_flush = on_flush
+
+        self._pending: Dict[int, int] = defaultdict(int)
+        # Changes being written by a flush, still pending until the write commits
+        self._in_flight: Dict[int, int] = dict()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._timer: Optional[asyncio.Task] = None
+
+        self.flushes = 0
+        self.flushed_changes = 0
+        self.failed_flushes = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    def start(self) -> None:
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.ensure_future(self._flush_periodically())
+
+    def add(self, discord_id: int, amount: int) -> None:
+        self._pending[discord_id] += amount
+        if len(self._pending) >= self.flush_size and (
+            self._flush_task is None or self._flush_task.done()
+        ):
+            self._flush_task = asyncio.ensure_future(self._flush_logging_errors())
+
+    def pending(self, discord_id: int) -> int:
+        """
+        return: amount added to the user's balance that isn't written to the database yet
+        """
+        return self._pending.get(discord_id, 0) + self._in_flight.get(discord_id, 0)
+
+    async def flush(self) -> None:
+        """
+        Writes every pending change to the database. Changes are kept pending if the write fails.
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return
+
+            pending = self._in_flight = self._pending
+            self._pending = defaultdict(int)
+            start = time.perf_counter()
+            try:
+                async with self.session_scope() as session:
+                    balances = await repository.change_balances(session, pending)
+            except BaseException:
+                self.failed_flushes += 1
+                for discord_id, amount in pending.items():
+                    self._pending[discord_id] += amount
+                raise
+            finally:
+                self._in_flight = dict()
+
+            latency = time.perf_counter() - start
+            self.flushes += 1
+            self.flushed_changes += len(pending)
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            logging.debug(
+                f"Flushed balance changes of {len(pending)} users in {latency * 1000:.2f}ms"
+            )
+            if self.on_flush:
+                self.on_flush(balances)
+
+    async def _flush_logging_errors(self) -> None:
+        try:
+            await self.flush()
+        except Exception:
+            logging.exception("Failed to flush balance changes, retrying later")
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_logging_errors()
+
+    async def close(self) -> None:
+        """
+        Stops the periodic flush and writes the remaining changes.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "backlog_users": len(self._pending),
+            "backlog_amount": sum(self._pending.values()),
+            "in_flight_users": len(self._in_flight),
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "flushed_changes": self.flushed_changes,
+            "last_flush_ms": round(self.last_flush_latency * 1000, 2),
+            "max_flush_ms": round(self.max_flush_latency * 1000, 2),
+        }
@@ -1,11 +1,23 @@
+import asyncio
 import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
 
 import discord
 from discord.ext import commands
 from discord.ext.commands import Context
-from sqlalchemy import select
 
-from aoba_discord_bot import AobaDiscordBot, AobaUser
+from aoba_discord_bot import AobaDiscordBot, repository
+from aoba_discord_bot.cogs.economy.balance_accumulator import BalanceAccumulator
+from aoba_discord_bot.cogs.economy.leaderboard import Leaderboard
+from aoba_discord_bot.cogs.economy.user_cache import CachedUser, UserCache
+from aoba_discord_bot.invalidation import (
+    InvalidationChannel,
+    LocalInvalidationChannel,
+    PostgresInvalidationChannel,
+)
+from aoba_discord_bot.rate_limit import backoff_delay
 
 
 class Economy(commands.Cog, name="Economy"):
@@ -13,8 +25,167 @@ class Economy(commands.Cog, name="Economy"):
     Category of commands that manage the server economy
     """
 
+    # Currency awarded for chatting, at most once per cooldown
+    ACTIVITY_REWARD = 1
+    ACTIVITY_COOLDOWN = 60.0
+    MAX_LEADERBOARD_SIZE = 25
+    # Topic of the user cache in the invalidation channel
+    USER_CACHE_TOPIC = "aobauser"
+    # Seconds before the first retry of a failed leaderboard load and the longest wait between retries
+    LEADERBOARD_RETRY_DELAY = 1.0
+    LEADERBOARD_MAX_RETRY_DELAY = 60.0
+
     def __init__(self, bot: AobaDiscordBot):
         self.bot = bot
+        self.leaderboard = Leaderboard()
+        self.balances = BalanceAccumulator(
+            bot.session_scope, on_flush=self._on_balances_flushed
+        )
+        self.users = UserCache(bot.economy_options.get("user_cache_size", 10000))
+        self.invalidations = self._create_invalidation_channel()
+        self.invalidations.subscribe(self.USER_CACHE_TOPIC, self.users.invalidate)
+        self.invalidations.subscribe(
+            self.USER_CACHE_TOPIC, self._on_remote_balance_changes
+        )
+        # When each user rewarded within the cooldown was rewarded, oldest first
+        self._last_rewarded: "OrderedDict[int, float]" = OrderedDict()
+
+        self.balances.start()
+        bot.shutdown_hooks.append(self.balances.close)
+        bot.shutdown_hooks.append(self.invalidations.close)
+        # Set when the leaderboard must be loaded again once the current load finishes
+        self._leaderboard_outdated = False
+        # Failed attempts of the running leaderboard load, told to users waiting for it
+        self._leaderboard_failures = 0
+        self._leaderboard_load = bot.loop.create_task(self._load_leaderboard())
+        bot.loop.create_task(self._start_invalidation_channel())
+
+    def _create_invalidation_channel(self) -> InvalidationChannel:
+        """
+        Other bot processes can only change balances through a shared PostgreSQL database, where their changes
+        are received with LISTEN/NOTIFY.
+        """
+        if (
+            self.bot.economy_options.get("user_cache_notify", True)
+            and self.bot.db_engine.dialect.name == "postgresql"
+        ):
+            return PostgresInvalidationChannel(self.bot.db_engine)
+        return LocalInvalidationChannel()
+
+    async def _start_invalidation_channel(self):
+        try:
+            await self.invalidations.start()
+        except Exception:
+            logging.exception(
+                "Failed to start the invalidation channel, the user cache is disabled"
+            )
+            self.users.max_size = 0
+            self.users.invalidate(None)
+
+    async def _load_leaderboard(self):
+        """
+        Loads every balance in the leaderboard, retrying with backoff until it succeeds.
+        """
+        self._leaderboard_outdated = True
+        while self._leaderboard_outdated:
+            self._leaderboard_outdated = False
+            try:
+                await self._read_leaderboard()
+            except Exception:
+                delay = backoff_delay(
+                    self._leaderboard_failures,
+                    self.LEADERBOARD_RETRY_DELAY,
+                    self.LEADERBOARD_MAX_RETRY_DELAY,
+                )
+                self._leaderboard_failures += 1
+                logging.exception(
+                    f"Failed to load the leaderboard, retrying in {delay:.2f}s"
+                )
+                self._leaderboard_outdated = True
+                await asyncio.sleep(delay)
+        self._leaderboard_failures = 0
+        logging.info(f"Loaded {len(self.leaderboard)} users in the leaderboard")
+
+    async def _read_leaderboard(self):
+        self.leaderboard.start_loading()
+        async with self.bot.Session() as session:
+            async for balances in repository.iter_balances(session):
+                self.leaderboard.load_chunk(balances)
+        self.leaderboard.finish_loading()
+
+    def _leaderboard_loading_message(self) -> str:
+        if self._leaderboard_failures:
+            return "The leaderboard couldn't be loaded yet, try again later!"
+        return "The leaderboard is still loading, try again soon!"
+
+    def _on_remote_balance_changes(self, discord_ids: Optional[List[int]]):
+        # The channel only carries the ids of the users, their balances are read from the database
+        if discord_ids is not None:
+            asyncio.ensure_future(self._refresh_leaderboard(discord_ids))
+        elif self._leaderboard_load.done():
+            self._leaderboard_load = asyncio.ensure_future(self._load_leaderboard())
+        else:
+            # Changes may have been missed after the running load read them
+            self._leaderboard_outdated = True
+
+    async def _refresh_leaderboard(self, discord_ids: List[int]):
+        try:
+            async with self.bot.Session() as session:
+                balances = await repository.get_balances(session, discord_ids)
+        except Exception:
+            logging.exception("Failed to read the balances changed by other processes")
+            return
+        for discord_id, balance in balances:
+            self.leaderboard.update(discord_id, balance or 0)
+
+    def _on_balances_flushed(self, balances: Dict[int, int]):
+        for discord_id, balance in balances.items():
+            self.leaderboard.update(discord_id, balance)
+        self.users.update(balances)
+        asyncio.ensure_future(self._publish_balance_changes(balances))
+
+    async def _publish_balance_changes(self, discord_ids: Iterable[int]):
+        try:
+            await self.invalidations.publish(self.USER_CACHE_TOPIC, discord_ids)
+        except Exception:
+            logging.exception("Failed to publish balance changes to other processes")
+
+    def _balance_changed(self, discord_id: int, balance: int):
+        self.leaderboard.update(discord_id, balance)
+        self.users.set(CachedUser(discord_id, balance))
+
+    async def _load_user(self, discord_id: int) -> Optional[CachedUser]:
+        async with self.bot.Session() as session:
+            aoba_user = await repository.get_user(session, discord_id)
+        return CachedUser(discord_id, aoba_user.bank_balance) if aoba_user else None
+
+    def cog_unload(self):
+        # A failing load would otherwise be retried forever
+        self._leaderboard_load.cancel()
+        # When the bot is closing, the shutdown hooks already closed them
+        if self.bot.closing:
+            return
+        for close in (self.balances.close, self.invalidations.close):
+            self.bot.shutdown_hooks.remove(close)
+            self.bot.loop.create_task(close())
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        if message.author.bot or message.guild is None:
+            return
+
+        now = time.monotonic()
+        # Expired users are at the front, each one is removed once
+        while self._last_rewarded:
+            oldest = next(iter(self._last_rewarded.values()))
+            if now - oldest < self.ACTIVITY_COOLDOWN:
+                break
+            self._last_rewarded.popitem(last=False)
+
+        if message.author.id in self._last_rewarded:
+            return
+        self._last_rewarded[message.author.id] = now
+        self.balances.add(message.author.id, self.ACTIVITY_REWARD)
 
     @commands.command(help="Get the bank balance of an user", pass_context=True)
     async def balance(self, ctx: Context, discord_user: discord.User = None):
@@ -30,14 +201,12 @@ class Economy(commands.Cog, name="Economy"):
             )
             return
 
-        async with self.bot.Session() as session:
-            query = select(AobaUser).where(AobaUser.discord_id == discord_user.id)
-            aoba_user = (await session.execute(query)).scalars().first()
+        aoba_user = await self.users.get(discord_user.id, self._load_user)
 
-        if aoba_user:
-            await ctx.send(
-                f"Balance for {discord_user.display_name} is {aoba_user.bank_balance}!"
-            )
+        pending = self.balances.pending(discord_user.id)
+        if aoba_user or pending:
+            balance = (aoba_user.bank_balance if aoba_user else 0) + pending
+            await ctx.send(f"Balance for {discord_user.display_name} is {balance}!")
         else:
             await ctx.send(f"No balance found for {discord_user.display_name}!")
 
@@ -49,26 +218,15 @@ class Economy(commands.Cog, name="Economy"):
 
         logging.info(f"Depositing {value} to {receiver.name}'s bank balance")
 
-        async with self.bot.Session() as session:
-            query = select(AobaUser).where(AobaUser.discord_id == receiver.id)
-            user = (await session.execute(query)).scalars().first()
-
-            if not user:
-                user = AobaUser(discord_id=receiver.id, bank_balance=value)
-                session.add(user)
-                logging.debug(
-                    f"Deposit receiver {receiver.name} not in database, created user {vars(user)}"
-                )
-            else:
-                user.bank_balance = user.bank_balance + value if user else value
-                logging.debug(
-                    f"Deposit receiver {receiver.name} in database, increased balance by {value}"
-                )
+        async with self.bot.session_scope() as session:
+            balance = await repository.change_balance(session, receiver.id, value)
+        self._balance_changed(receiver.id, balance)
+        await self._publish_balance_changes([receiver.id])
+        balance += self.balances.pending(receiver.id)
 
-            await session.commit()
-            await ctx.send(
-                f"Deposited {value} for {receiver.display_name}. New balance: {user.bank_balance}"
-            )
+        await ctx.send(
+            f"Deposited {value} for {receiver.display_name}. New balance: {balance}"
+        )
 
     @commands.is_owner()
     @commands.command(help="Withdraw a value from an user's account", pass_context=True)
@@ -78,26 +236,54 @@ class Economy(commands.Cog, name="Economy"):
 
         logging.info(f"Withdrawing {value} from {receiver.name}'s bank balance")
 
-        async with self.bot.Session() as session:
-            query = select(AobaUser).where(AobaUser.discord_id == receiver.id)
-            user = (await session.execute(query)).scalars().first()
-
-            if not user:
-                user = AobaUser(discord_id=receiver.id, bank_balance=value)
-                session.add(user)
-                logging.debug(
-                    f"Withdraw receiver {receiver.name} not in database, created user {vars(user)}"
-                )
-            else:
-                user.bank_balance = user.bank_balance - value if user else value
-                logging.debug(
-                    f"Withdraw receiver {receiver.name} in database, decreased balance by {value}"
-                )
+        async with self.bot.session_scope() as session:
+            balance = await repository.change_balance(session, receiver.id, -value)
+        self._balance_changed(receiver.id, balance)
+        await self._publish_balance_changes([receiver.id])
+        balance += self.balances.pending(receiver.id)
 
-            await session.commit()
-            await ctx.send(
-                f"Withdrew {value} from {receiver.display_name}. New balance: {user.bank_balance}"
+        await ctx.send(
+            f"Withdrew {value} from {receiver.display_name}. New balance: {balance}"
+        )
+
+    @commands.command(help="Users with the highest bank balances", pass_context=True)
+    async def leaderboard(self, ctx: Context, count: int = 10):
+        if not self.leaderboard.loaded:
+            await ctx.send(self._leaderboard_loading_message())
+            return
+
+        count = max(1, min(count, self.MAX_LEADERBOARD_SIZE))
+        lines = [
+            f"{position}. {self._user_name(discord_id)}: {balance}"
+            for position, (discord_id, balance) in enumerate(
+                self.leaderboard.top(count), start=1
             )
+        ]
+        if not lines:
+            await ctx.send("Nobody has a balance yet!")
+            return
+        await ctx.send("**Leaderboard:**\n" + "\n".join(lines))
+
+    @commands.command(help="Position of an user in the leaderboard", pass_context=True)
+    async def rank(self, ctx: Context, discord_user: discord.User = None):
+        if not discord_user:
+            discord_user = ctx.author
+
+        if not self.leaderboard.loaded:
+            await ctx.send(self._leaderboard_loading_message())
+            return
+
+        position = self.leaderboard.rank(discord_user.id)
+        if position is None:
+            await ctx.send(f"No balance found for {discord_user.display_name}!")
+            return
+        await ctx.send(
+            f"{discord_user.display_name} is ranked #{position} of {len(self.leaderboard)}!"
+        )
+
+    def _user_name(self, discord_id: int) -> str:
+        user = self.bot.get_user(discord_id)
+        return user.display_name if user else str(discord_id)
 
 
 def setup(bot: AobaDiscordBot):
@@ -0,0 +1,200 @@
+import bisect
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Entries pack (-balance, discord id) into a single int, which sorts the same way and takes less memory than a tuple
+_DISCORD_ID_BITS = 64
+_DISCORD_ID_MASK = (1 << _DISCORD_ID_BITS) - 1
+
+
+def _entry(discord_id: int, balance: int) -> int:
+    return (-balance << _DISCORD_ID_BITS) | discord_id
+
+
+def _unpack(entry: int) -> Tuple[int, int]:
+    """
+    return: (discord id, balance) of an entry
+    """
+    return entry & _DISCORD_ID_MASK, -(entry >> _DISCORD_ID_BITS)
+
+
+class _FenwickTree:
+    """
+    Prefix sums of a list of counts, each updated and queried in O(log n).
+    """
+
+    def __init__(self, counts: List[int]):
+        self._tree = [0] + counts
+        for index in range(1, len(self._tree)):
+            parent = index + (index & -index)
+            if parent < len(self._tree):
+                self._tree[parent] += self._tree[index]
+
+    def add(self, index: int, amount: int) -> None:
+        index += 1
+        while index < len(self._tree):
+            self._tree[index] += amount
+            index += index & -index
+
+    def prefix_sum(self, end: int) -> int:
+        """
+        return: sum of the counts before the index end
+        """
+        total = 0
+        while end > 0:
+            total += self._tree[end]
+            end -= end & -end
+        return total
+
+
+class Leaderboard:
+    """
+    Bank balances of every user ranked in memory, so the top users and the rank of an user are found without
+    sorting the user table.
+
+    Entries sort by descending balance with ties broken by discord id. They're kept in sorted buckets of about
+    BUCKET_SIZE entries, with a Fenwick tree of the bucket sizes, so updating a balance and finding a rank take
+    O(log n + BUCKET_SIZE) instead of shifting a list of every user.
+    """
+
+    BUCKET_SIZE = 1000
+
+    def __init__(self):
+        self._buckets: List[List[int]] = list()
+        # Last entry of each bucket, to find the bucket of an entry with a binary search
+        self._maxes: List[int] = list()
+        self._sizes = _FenwickTree([])
+        self._balances: Dict[int, int] = dict()
+        self._loading: Dict[int, int] = dict()
+        self._updates_while_loading: Dict[int, int] = dict()
+        self._is_loading = False
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return len(self._balances)
+
+    def start_loading(self) -> None:
+        """
+        Starts replacing the leaderboard with the balances given to load_chunk. A loaded leaderboard keeps being
+        served and updated until finish_loading.
+        """
+        self._loading = dict()
+        self._is_loading = True
+
+    def load_chunk(self, balances: Iterable[Tuple[int, int]]) -> None:
+        """
+        Adds (discord id, balance) pairs read from the database to the leaderboard being loaded, see
+        finish_loading.
+        """
+        for discord_id, balance in balances:
+            self._loading[discord_id] = balance or 0
+
+    def finish_loading(self) -> None:
+        """
+        Replaces the leaderboard with the balances given to load_chunk. Updates made while the balances were
+        being read are applied on top of them.
+        """
+        self._balances, self._loading = self._loading, dict()
+        self._balances.update(self._updates_while_loading)
+        self._updates_while_loading.clear()
+        self._is_loading = False
+
+        entries = sorted(
+            _entry(discord_id, balance)
+            for discord_id, balance in self._balances.items()
+        )
+        self._buckets = [
+            entries[start : start + self.BUCKET_SIZE]
+            for start in range(0, len(entries), self.BUCKET_SIZE)
+        ]
+        self._rebuild_index()
+        self.loaded = True
+
+    def load(self, balances: Iterable[Tuple[int, int]]) -> None:
+        """
+        Replaces the leaderboard with (discord id, balance) pairs, usually every user in the database.
+        """
+        self.start_loading()
+        self.load_chunk(balances)
+        self.finish_loading()
+
+    def update(self, discord_id: int, balance: int) -> None:
+        if self._is_loading or not self.loaded:
+            # The balances being loaded may have been read before the update
+            self._updates_while_loading[discord_id] = balance
+        if not self.loaded:
+            return
+
+        old_balance = self._balances.get(discord_id)
+        if old_balance is not None:
+            self._remove(_entry(discord_id, old_balance))
+
+        self._balances[discord_id] = balance
+        self._insert(_entry(discord_id, balance))
+
+    def top(self, count: int) -> List[Tuple[int, int]]:
+        """
+        return: (discord id, balance) of the users with the highest balances
+        """
+        top = list()
+        for bucket in self._buckets:
+            if len(top) >= count:
+                break
+            top.extend(_unpack(entry) for entry in bucket[: count - len(top)])
+        return top
+
+    def rank(self, discord_id: int) -> Optional[int]:
+        """
+        return: position of the user in the leaderboard starting at 1, None if the user has no balance
+        """
+        balance = self._balances.get(discord_id)
+        if balance is None:
+            return None
+
+        entry = _entry(discord_id, balance)
+        index = self._bucket_index(entry)
+        return (
+            self._sizes.prefix_sum(index)
+            + bisect.bisect_left(self._buckets[index], entry)
+            + 1
+        )
+
+    def _bucket_index(self, entry: int) -> int:
+        """
+        return: index of the bucket that has or would have the entry
+        """
+        return min(bisect.bisect_left(self._maxes, entry), len(self._buckets) - 1)
+
+    def _rebuild_index(self) -> None:
+        # Only needed when buckets are added or removed, which happens once every BUCKET_SIZE changes at most
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._sizes = _FenwickTree([len(bucket) for bucket in self._buckets])
+
+    def _insert(self, entry: int) -> None:
+        if not self._buckets:
+            self._buckets.append([entry])
+            self._rebuild_index()
+            return
+
+        index = self._bucket_index(entry)
+        bucket = self._buckets[index]
+        bisect.insort(bucket, entry)
+        if len(bucket) > 2 * self.BUCKET_SIZE:
+            half = len(bucket) // 2
+            self._buckets[index : index + 1] = [bucket[:half], bucket[half:]]
+            self._rebuild_index()
+            return
+
+        self._maxes[index] = bucket[-1]
+        self._sizes.add(index, 1)
+
+    def _remove(self, entry: int) -> None:
+        index = self._bucket_index(entry)
+        bucket = self._buckets[index]
+        del bucket[bisect.bisect_left(bucket, entry)]
+        if not bucket:
+            del self._buckets[index]
+            self._rebuild_index()
+            return
+
+        self._maxes[index] = bucket[-1]
+        self._sizes.add(index, -1)
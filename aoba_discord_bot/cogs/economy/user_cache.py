@@ -0,0 +1,133 @@
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+
+class CachedUser:
+    """
+    Bank balance of an user as written in the database, without the per-instance dict of ORM objects.
+    """
+
+    __slots__ = ("discord_id", "bank_balance")
+
+    def __init__(self, discord_id: int, bank_balance: Optional[int]):
+        self.discord_id = discord_id
+        self.bank_balance = bank_balance
+
+
+_NOT_CACHED = object()
+
+
+class UserCache:
+    """
+    Bounded least recently used read-through cache of AobaUser records, by discord id.
+
+    Writes made by this process update the cache, writes made by other processes invalidate it through an
+    InvalidationChannel. A record loaded while an user was being written could be older than the write, so loads
+    that overlap a write to the same user aren't cached.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        """
+        :param max_size: maximum number of users, the least recently used is evicted past it, 0 disables the cache
+        """
+        self.max_size = max_size
+        # None is cached for users without a record, so looking them up again doesn't query the database either
+        self._entries: "OrderedDict[int, Optional[CachedUser]]" = OrderedDict()
+        # Loads in progress of each user, each one counting the writes made to the user while it runs
+        self._loading: Dict[int, List[List[int]]] = dict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(
+        self,
+        discord_id: int,
+        load: Callable[[int], Awaitable[Optional[CachedUser]]],
+    ) -> Optional[CachedUser]:
+        """
+        Get an user from the cache, loading and caching it on a miss.
+        :param discord_id: discord id of the user
+        :param load: reads the user from the database, returns None if it has no record
+        return: the user or None if it has no record
+        """
+        user = self._entries.get(discord_id, _NOT_CACHED)
+        if user is not _NOT_CACHED:
+            self._entries.move_to_end(discord_id)
+            self.hits += 1
+            return user
+
+        self.misses += 1
+        writes = [0]
+        loads = self._loading.setdefault(discord_id, list())
+        loads.append(writes)
+        try:
+            user = await load(discord_id)
+        finally:
+            loads.remove(writes)
+            if not loads:
+                del self._loading[discord_id]
+        if writes[0] == 0:
+            self._store(discord_id, user)
+        return user
+
+    def set(self, user: CachedUser) -> None:
+        """
+        Caches an user just written to the database.
+        """
+        self._mark_written(user.discord_id)
+        self._store(user.discord_id, user)
+
+    def update(self, balances: Dict[int, int]) -> None:
+        """
+        Updates the balances of the cached users among the ones just written to the database, without caching the
+        others.
+        :param balances: new balance of each user, by discord id
+        """
+        for discord_id, balance in balances.items():
+            self._mark_written(discord_id)
+            if self._entries.get(discord_id) is not None:
+                self._entries[discord_id].bank_balance = balance
+            elif discord_id in self._entries:
+                # The user didn't have a record before this write
+                self._entries[discord_id] = CachedUser(discord_id, balance)
+
+    def invalidate(self, discord_ids: Optional[Iterable[int]]) -> None:
+        """
+        Removes users changed by another process, or every user if discord_ids is None.
+        """
+        if discord_ids is None:
+            discord_ids = list(self._entries) + list(self._loading)
+        for discord_id in discord_ids:
+            self._mark_written(discord_id)
+            if self._entries.pop(discord_id, _NOT_CACHED) is not _NOT_CACHED:
+                self.invalidations += 1
+
+    def _mark_written(self, discord_id: int) -> None:
+        for writes in self._loading.get(discord_id, ()):
+            writes[0] += 1
+
+    def _store(self, discord_id: int, user: Optional[CachedUser]) -> None:
+        if self.max_size <= 0:
+            return
+
+        self._entries[discord_id] = user
+        self._entries.move_to_end(discord_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 2) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Hashable, Optional
+
+import aiohttp
+
+from aoba_discord_bot.caches import TTLCache
+from aoba_discord_bot.rate_limit import (
+    PRIORITY_INTERACTIVE,
+    RateLimiter,
+    retry_with_backoff,
+)
+
+
+class OsuApiError(Exception):
+    def __init__(self, status: int, message: str, retry_after: float = None):
+        super().__init__(f"osu! API returned {status}: {message}")
+        self.status = status
+        self.retry_after = retry_after
+
+    @classmethod
+    async def from_response(cls, response: aiohttp.ClientResponse) -> "OsuApiError":
+        retry_after = response.headers.get("Retry-After")
+        return cls(
+            response.status,
+            await response.text(),
+            float(retry_after) if retry_after and retry_after.isdigit() else None,
+        )
+
+
+class _RequestCancelledError(Exception):
+    """
+    Set on an in-flight request whose caller was cancelled, so the callers waiting for it send it again instead
+    of being cancelled too.
+    """
+
+
+def _retry_delay(e: Exception) -> Optional[float]:
+    """
+    Rate limited requests, server errors and connection failures are retried.
+    """
+    if isinstance(e, OsuApiError):
+        if e.status == 429 or e.status >= 500:
+            return e.retry_after or 0
+        return None
+    if isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        return 0
+    return None
+
+
+class OsuApiClient:
+    """
+    Asynchronous client for the osu! API v2.
+
+    Requests share a single keep-alive connection pool, and concurrent requests that find the OAuth token missing
+    or expired wait on the same token request instead of each requesting a new token.
+
+    Responses are cached for a while, and identical requests made while one is in flight wait for its response
+    instead of being sent again.
+
+    Requests that reach the API wait for a rate limiter, which serves interactive commands first, and rate limited
+    or failed requests are retried with exponential backoff.
+    """
+
+    API_BASE_URL = "https://osu.ppy.sh/api/v2/"
+    API_OAUTH_URL = "https://osu.ppy.sh/oauth/token"
+    # Tokens are renewed a bit before they expire so in-flight requests don't use an expired token
+    TOKEN_EXPIRY_MARGIN = timedelta(seconds=60)
+
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        timeout: float = 10.0,
+        connection_limit: int = 10,
+        cache_size: int = 1024,
+        cache_ttl: float = 300.0,
+        rate_limit: float = 1.0,
+        rate_burst: int = 10,
+        queue_size: int = 100,
+        max_retries: int = 3,
+    ):
+        """
+        :param client_id: OAuth client id of the osu! application
+        :param client_secret: OAuth client secret of the osu! application
+        :param timeout: total seconds a request can take, including the connection
+        :param connection_limit: maximum number of simultaneous connections to the API
+        :param cache_size: maximum number of cached responses, 0 disables the cache
+        :param cache_ttl: seconds a response stays cached
+        :param rate_limit: requests per second allowed on average
+        :param rate_burst: requests that can be sent at once after a quiet period
+        :param queue_size: maximum number of requests waiting for the rate limiter
+        :param max_retries: retries of rate limited or failed requests
+        """
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.connection_limit = connection_limit
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._access_token: Optional[str] = None
+        self._token_expires_dt: Optional[datetime] = None
+        self._token_lock = asyncio.Lock()
+
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self._in_flight: Dict[Hashable, asyncio.Future] = dict()
+        self.deduplicated = 0
+
+        self.rate_limiter = RateLimiter(rate_limit, rate_burst, queue_size)
+        self.max_retries = max_retries
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connection_limit)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=self.timeout
+            )
+        return self._session
+
+    def _token_valid(self) -> bool:
+        return (
+            self._access_token is not None
+            and self._token_expires_dt is not None
+            and datetime.now() < self._token_expires_dt
+        )
+
+    async def _get_authorization_header(self) -> dict:
+        """
+        Handles the request for OAuth token and re-requesting it when expired.
+        return: dictionary with the authorization header with a valid OAuth token
+        """
+        if not self._token_valid():
+            async with self._token_lock:
+                # Another request may have renewed the token while this one waited for the lock
+                if not self._token_valid():
+                    await self._client_credentials_grant()
+
+        return {"Authorization": f"Bearer {self._access_token}"}
+
+    async def _client_credentials_grant(self) -> None:
+        """
+        Sends a post request for a new client credential token and stores it.
+        """
+        body = {
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "grant_type": "client_credentials",
+            "scope": "public",
+        }
+
+        async def request_token() -> dict:
+            await self.rate_limiter.acquire(PRIORITY_INTERACTIVE)
+            async with self._get_session().post(
+                self.API_OAUTH_URL, data=body
+            ) as response:
+                if response.status != 200:
+                    raise await OsuApiError.from_response(response)
+                return await response.json()
+
+        requested_dt = datetime.now()
+        token_info = await retry_with_backoff(
+            request_token, _retry_delay, self.max_retries
+        )
+
+        secs_to_expire = int(token_info.get("expires_in"))
+        self._access_token = token_info.get("access_token")
+        self._token_expires_dt = (
+            requested_dt + timedelta(seconds=secs_to_expire) - self.TOKEN_EXPIRY_MARGIN
+        )
+        logging.debug(f"Requested a new osu! API token valid for {secs_to_expire}s")
+
+    async def get(
+        self, endpoint: str, params: dict = None, priority: int = PRIORITY_INTERACTIVE
+    ) -> dict:
+        """
+        Sends a GET request to the osu! API, or reuses a cached or in-flight response for the same request.
+        :param endpoint: path of the endpoint relative to the API base url
+        :param params: query string parameters
+        :param priority: rate limiter priority, PRIORITY_BACKGROUND for requests no user is waiting on
+        return: the decoded JSON response, which is shared and must not be modified
+        """
+        key = (endpoint, tuple(sorted((params or dict()).items())))
+        while True:
+            response = self.cache.get(key)
+            if response is not None:
+                return response
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                return await self._send(key, endpoint, params, priority)
+
+            self.deduplicated += 1
+            try:
+                return await asyncio.shield(in_flight)
+            except _RequestCancelledError:
+                # The first caller to resume sends the request again and the others wait for it
+                continue
+
+    async def _send(
+        self, key: Hashable, endpoint: str, params: Optional[dict], priority: int
+    ) -> dict:
+        """
+        Sends a request, caching its response and sharing it with the identical requests made while it's in flight.
+        """
+        future = asyncio.get_event_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            response = await retry_with_backoff(
+                lambda: self._request(endpoint, params, priority),
+                _retry_delay,
+                self.max_retries,
+            )
+        except asyncio.CancelledError:
+            # Cancelling the future would cancel the waiting callers as well
+            future.set_exception(_RequestCancelledError())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Marks the exception as retrieved when no other request was waiting for it
+            future.exception()
+            raise
+        else:
+            self.cache.set(key, response)
+            future.set_result(response)
+            return response
+        finally:
+            del self._in_flight[key]
+
+    async def _request(self, endpoint: str, params: dict, priority: int) -> dict:
+        headers = await self._get_authorization_header()
+        await self.rate_limiter.acquire(priority)
+        url = f"{self.API_BASE_URL}{endpoint}"
+        async with self._get_session().get(
+            url, params=params, headers=headers
+        ) as response:
+            if response.status != 200:
+                raise await OsuApiError.from_response(response)
+            return await response.json()
+
+    def stats(self) -> dict:
+        return {
+            **self.cache.stats(),
+            "in_flight": len(self._in_flight),
+            "deduplicated": self.deduplicated,
+        }
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
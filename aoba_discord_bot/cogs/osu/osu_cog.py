@@ -1,71 +1,56 @@
+import asyncio
 import io
-import re
-from datetime import datetime, timedelta
+import tempfile
+from typing import BinaryIO
 
 import discord
-import requests
-from discord import Message
+from discord import Attachment, Message
 from discord.ext import commands
 from discord.ext.commands import Context
 
 from aoba_discord_bot import AobaDiscordBot
+from aoba_discord_bot.cogs.osu.osu_api import OsuApiClient, OsuApiError
+from aoba_discord_bot.cogs.osu.osu_db import OsuDbError, read_beatmapset_ids
+from aoba_discord_bot.rate_limit import QueueFullError
 
 
 class Osu(commands.Cog, name="Osu"):
-    API_BASE_URL = "https://osu.ppy.sh/api/v2/"
-    API_OAUTH_URL = "https://osu.ppy.sh/oauth/token"
-
-    def __init__(self):
+    def __init__(self, bot: AobaDiscordBot):
         """
         The osu! API requires the client id and a secret to request a token, both of which should be passed as arguments
         running the bot to use the osu! cog. Access your osu account settings at
         https://osu.ppy.sh/home/account/edit#oauth to get the id and secret.
         """
-        self._access_token_info = None
-        self._token_expires_dt = None
-
-    def _get_authorization_header(self, api_keys: dict) -> dict:
-        """
-        Handles the request for OAuth token and re-requesting it when expired.
-        return: dictionary with the authorization header with a valid OAuth token
-        """
-        now = datetime.now()
-
-        def token_expired() -> bool:
-            return self._token_expires_dt is not None and now >= self._token_expires_dt
-
-        if self._access_token_info is None or token_expired():
-            self._access_token_info = self._client_credentials_grant(api_keys)
-            secs_to_expire = int(self._access_token_info.get("expires_in"))
-            self._token_expires_dt = now + timedelta(seconds=secs_to_expire)
-
-        access_token = self._access_token_info.get("access_token")
+        self.bot = bot
+        self.api = OsuApiClient(
+            bot.api_keys.get("osu_client_id"),
+            bot.api_keys.get("osu_client_secret"),
+            **bot.osu_options,
+        )
+        bot.shutdown_hooks.append(self.api.close)
 
-        return {"Authorization": f"Bearer {access_token}"}
-
-    def _client_credentials_grant(self, api_keys: dict) -> dict:
-        """
-        Sends a post request for a new client credential token.
-        return: Dictionary with token_type(str=Bearer), expires_in(int in seconds), access_token(str)
-        """
-        body = {
-            "client_id": api_keys["osu_client_id"],
-            "client_secret": api_keys["osu_client_secret"],
-            "grant_type": "client_credentials",
-            "scope": "public",
-        }
-        return requests.post(url=Osu.API_OAUTH_URL, data=body).json()
+    def cog_unload(self):
+        # When the bot is closing, the shutdown hooks already closed it
+        if self.bot.closing:
+            return
+        self.bot.shutdown_hooks.remove(self.api.close)
+        self.bot.loop.create_task(self.api.close())
 
     @commands.command(help="Performance points obtained by the user in this map")
     async def score_pp(self, ctx: Context, beatmap_id: int, user_id: int):
-        url = f"{self.API_BASE_URL}beatmaps/{beatmap_id}/scores/users/{user_id}"
-        body = {
-            "mode": "std",
-            # "mods": "",
-        }
-        response = requests.get(
-            url=url, data=body, headers=self._get_authorization_header(ctx.bot.api_keys)
-        ).json()
+        try:
+            response = await self.api.get(
+                f"beatmaps/{beatmap_id}/scores/users/{user_id}", params={"mode": "osu"}
+            )
+        except OsuApiError as e:
+            if e.status == 404:
+                await ctx.send("No score found for this user on this map!")
+                return
+            raise
+        except QueueFullError:
+            await ctx.send("Too many osu! requests right now, try again later!")
+            return
+
         pp = response.get("score").get("pp")
         username = response.get("score").get("user").get("username")
         await ctx.send(
@@ -77,22 +62,30 @@ class Osu(commands.Cog, name="Osu"):
     )
     async def beatmaps_backup(self, ctx: Context):
         msg: Message = ctx.message
-        file = next(iter(msg.attachments))
-        contents_bin = io.BytesIO(await file.read()).getvalue()
-        beatmapset_ids = [
-            "".join([chr(c) for c in match[3:]])
-            for match in re.findall(b"\x00\x0b.\d+ ", contents_bin)
-        ]
-        ids_set = set(beatmapset_ids)
+        attachment = next(iter(msg.attachments), None)
+        if not attachment:
+            await ctx.send("Attach your osu!.db file to the command message!")
+            return
+
+        with tempfile.TemporaryFile() as osu_db_file:
+            await self._download_attachment(attachment, osu_db_file)
+            try:
+                ids_set, beatmap_count = await asyncio.get_event_loop().run_in_executor(
+                    None, read_beatmapset_ids, osu_db_file
+                )
+            except OsuDbError as e:
+                await ctx.send(f"Could not read the osu!.db file: {e}")
+                return
+
         download_urls = "\n".join(
             [
-                f"https://api.chimu.moe/v1/download/{bmp_set_id.strip()}?n=1"
-                for bmp_set_id in ids_set
+                f"https://api.chimu.moe/v1/download/{bmp_set_id}?n=1"
+                for bmp_set_id in sorted(ids_set)
             ]
         )
         file = discord.File(io.StringIO(download_urls), filename="beatmap_dl_links.txt")
         found = (
-            f"Found `{len(ids_set)}` beatmapsets for `{len(beatmapset_ids)}` beatmaps! Import the attached file"
+            f"Found `{len(ids_set)}` beatmapsets for `{beatmap_count}` beatmaps! Import the attached file"
             f" with DownThemAll! to re-download your maps."
         )
         await ctx.send(
@@ -100,6 +93,20 @@ class Osu(commands.Cog, name="Osu"):
             file=file,
         )
 
+    async def _download_attachment(
+        self, attachment: Attachment, file: BinaryIO
+    ) -> None:
+        """
+        Streams an attachment to a file in chunks, so large files are never held in memory. The chunks are written
+        by the executor, so a slow disk doesn't block the event loop.
+        """
+        loop = asyncio.get_event_loop()
+        async with self.bot.http_session.get(attachment.url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                await loop.run_in_executor(None, file.write, chunk)
+        await loop.run_in_executor(None, file.flush)
+
 
 def setup(bot: AobaDiscordBot):
-    bot.add_cog(Osu())
+    bot.add_cog(Osu(bot))
@@ -0,0 +1,133 @@
+"""
+Parser for the osu!.db file, where osu! stores the beatmaps a player has installed.
+
+The format is documented at https://github.com/ppy/osu/wiki/Legacy-database-file-structure
+"""
+import mmap
+import struct
+from typing import BinaryIO, Iterator, Set, Tuple
+
+# Versions of the file format that changed the layout of beatmap entries
+VERSION_FLOAT_DIFFICULTY = 20140609
+VERSION_NO_ENTRY_SIZE = 20191106
+VERSION_FLOAT_STAR_RATINGS = 20250107
+
+TIMING_POINT_SIZE = 17
+
+_BYTE = struct.Struct("<B")
+_INT = struct.Struct("<i")
+
+
+class OsuDbError(Exception):
+    pass
+
+
+class OsuDbReader:
+    """
+    Reads the primitive types of the osu!.db format from a buffer, usually a memory-mapped file so only the parts
+    being read are paged into memory.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.pos = 0
+
+    def _unpack(self, fmt: struct.Struct):
+        try:
+            (value,) = fmt.unpack_from(self.buffer, self.pos)
+        except struct.error:
+            raise OsuDbError(f"Unexpected end of file at byte {self.pos}")
+        self.pos += fmt.size
+        return value
+
+    def read_byte(self) -> int:
+        return self._unpack(_BYTE)
+
+    def read_int(self) -> int:
+        return self._unpack(_INT)
+
+    def skip(self, size: int) -> None:
+        if self.pos + size > len(self.buffer):
+            raise OsuDbError(f"Unexpected end of file at byte {self.pos}")
+        self.pos += size
+
+    def read_uleb128(self) -> int:
+        result = shift = 0
+        while True:
+            byte = self.read_byte()
+            result |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return result
+            shift += 7
+
+    def skip_string(self) -> None:
+        marker = self.read_byte()
+        if marker == 0x0B:
+            self.skip(self.read_uleb128())
+        elif marker != 0x00:
+            raise OsuDbError(
+                f"Invalid string marker {marker:#x} at byte {self.pos - 1}"
+            )
+
+
+def iter_beatmapset_ids(reader: OsuDbReader) -> Iterator[int]:
+    """
+    Reads every beatmap entry and yields its beatmapset id, which is 0 or -1 for beatmaps never submitted.
+    """
+    version = reader.read_int()
+    reader.skip(4 + 1 + 8)  # Folder count, account unlocked and unlock date
+    reader.skip_string()  # Player name
+    beatmap_count = reader.read_int()
+
+    float_difficulty = version >= VERSION_FLOAT_DIFFICULTY
+    star_rating_pair_size = 10 if version >= VERSION_FLOAT_STAR_RATINGS else 14
+
+    for _ in range(beatmap_count):
+        if version < VERSION_NO_ENTRY_SIZE:
+            reader.skip(4)  # Size of the entry
+
+        # Artist, title, creator, difficulty, audio file, hash and .osu file name
+        for _ in range(9):
+            reader.skip_string()
+        reader.skip(1 + 6 + 8)  # Ranked status, object counts and modification date
+        reader.skip(16 if float_difficulty else 4)  # AR, CS, HP and OD
+        reader.skip(8)  # Slider velocity
+        if float_difficulty:
+            for _ in range(4):  # Star ratings for each game mode
+                reader.skip(reader.read_int() * star_rating_pair_size)
+        reader.skip(4 + 4 + 4)  # Drain time, total time and preview time
+        reader.skip(reader.read_int() * TIMING_POINT_SIZE)
+        reader.skip(4)  # Difficulty id
+        yield reader.read_int()
+        reader.skip(4 + 4 + 2 + 4 + 1)  # Thread id, grades, offset, leniency, mode
+        reader.skip_string()  # Song source
+        reader.skip_string()  # Song tags
+        reader.skip(2)  # Online offset
+        reader.skip_string()  # Title font
+        reader.skip(1 + 8 + 1)  # Unplayed, last played and osz2
+        reader.skip_string()  # Folder name
+        reader.skip(8 + 5)  # Last checked and overrides
+        if not float_difficulty:
+            reader.skip(2)  # Unknown field
+        reader.skip(4 + 1)  # Modification time and mania scroll speed
+
+
+def read_beatmapset_ids(file: BinaryIO) -> Tuple[Set[int], int]:
+    """
+    Reads the submitted beatmapsets from an osu!.db file. Blocking, meant to run in a worker thread.
+    :param file: osu!.db file opened in binary mode
+    return: ids of the submitted beatmapsets and the number of beatmaps in the file
+    """
+    try:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        raise OsuDbError("The file is empty")
+
+    beatmapset_ids = set()
+    beatmap_count = 0
+    with buffer:
+        for set_id in iter_beatmapset_ids(OsuDbReader(buffer)):
+            beatmap_count += 1
+            if set_id > 0:
+                beatmapset_ids.add(set_id)
+    return beatmapset_ids, beatmap_count
@@ -1,17 +1,63 @@
 import itertools
+from typing import Hashable, Optional
 
 import discord
 from discord.ext import commands
-from discord.ext.commands import Bot, Context, DefaultHelpCommand
+from discord.ext.commands import Context, DefaultHelpCommand
 
 from aoba_discord_bot import AobaDiscordBot
+from aoba_discord_bot.caches import TTLCache
 from aoba_discord_bot.formatting import mention_author
 
 
 class AobaHelp(DefaultHelpCommand):
+    """
+    Help that lists the commands with the guild's prefix.
+
+    The pages are rendered once and cached by the User cog, keyed by everything they depend on: the prefix, the
+    version of the bot's command set, the checks the author passes and the command help was asked for.
+    """
+
     def __init__(self, **options):
         super().__init__(**options)
         self.max_width = 80
+        self._prefix: Optional[str] = None
+        self._cache_key: Optional[Hashable] = None
+        self._max_command_name_size: Optional[int] = None
+
+    async def _get_cache_key(self, ctx: Context, command: Optional[str]) -> Hashable:
+        bot: AobaDiscordBot = ctx.bot
+        self._prefix = await bot.command_prefix(bot, ctx.message)
+        # Every check of the bot's commands is either is_owner or author_is_admin
+        permission_class = (
+            await bot.is_owner(ctx.author),
+            isinstance(ctx.author, discord.Member)
+            and ctx.author.guild_permissions.administrator,
+        )
+        return (
+            self._prefix,
+            ctx.invoked_with,
+            bot.commands_version,
+            permission_class,
+            command,
+        )
+
+    async def command_callback(self, ctx: Context, *, command: str = None):
+        cache_key = await self._get_cache_key(ctx, command)
+        pages = self.cog.help_pages.get(cache_key)
+        if pages is None:
+            self._cache_key = cache_key
+            await super().command_callback(ctx, command=command)
+            return
+
+        destination = self.get_destination()
+        for page in pages:
+            await destination.send(page)
+
+    async def send_pages(self):
+        if self._cache_key is not None:
+            self.cog.help_pages.set(self._cache_key, list(self.paginator.pages))
+        await super().send_pages()
 
     async def add_indented_commands(self, commands, *, heading, max_size=None):
         if not commands:
@@ -24,11 +70,11 @@ class AobaHelp(DefaultHelpCommand):
         for command in commands:
             name = command.name
             width = max_size - (get_width(name) - len(name))
-            ctx: Context = self.context
-            bot: Bot = ctx.bot
-            prefix = await bot.command_prefix(None, ctx.message)
             entry = "{0}{1:<{width}} {2}".format(
-                (self.indent - 1) * " " + prefix, name, command.short_doc, width=width
+                (self.indent - 1) * " " + self._prefix,
+                name,
+                command.short_doc,
+                width=width,
             )
             self.paginator.add_line(self.shorten_text(entry))
         self.paginator.add_line(self.max_width * "_")
@@ -36,7 +82,11 @@ class AobaHelp(DefaultHelpCommand):
     def shorten_text(self, text):
         if len(text) > self.max_width:
             start, rest = text[: self.max_width], text[self.max_width :]
-            max_cmd_name_size = self.get_max_size(self.context.bot.commands)
+            if self._max_command_name_size is None:
+                self._max_command_name_size = self.get_max_size(
+                    self.context.bot.commands
+                )
+            max_cmd_name_size = self._max_command_name_size
             step = self.max_width - max_cmd_name_size - 3
             split_rest = [rest[i : i + step] for i in range(0, len(rest), step)]
 
@@ -117,8 +167,13 @@ class AobaHelp(DefaultHelpCommand):
 
 
 class User(commands.Cog, name="User"):
+    HELP_CACHE_SIZE = 1024
+    HELP_CACHE_TTL = 3600.0
+
     def __init__(self, bot: AobaDiscordBot):
         self.bot = bot
+        # Rendered help pages by AobaHelp's cache key, which only has a few values per prefix
+        self.help_pages = TTLCache(self.HELP_CACHE_SIZE, self.HELP_CACHE_TTL)
         self._original_help_command = bot.help_command
         bot.help_command = AobaHelp()
         bot.help_command.cog = self
@@ -1,4 +1,14 @@
-from sqlalchemy import BigInteger, Column, ForeignKey, Integer, String
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    func,
+)
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -10,6 +20,16 @@ class AobaGuild(Base):
     command_prefix = Column(String)
     commands = relationship("AobaCommand", back_populates="guild")
     announcement_channel_id = Column(BigInteger)
+    # Only the guilds with an announcement channel are indexed, the targets of owner announcements
+    __table_args__ = (
+        Index(
+            "ix_guild_announcement_channel",
+            guild_id,
+            announcement_channel_id,
+            postgresql_where=announcement_channel_id.isnot(None),
+            sqlite_where=announcement_channel_id.isnot(None),
+        ),
+    )
 
 
 class AobaCommand(Base):
@@ -18,6 +38,9 @@ class AobaCommand(Base):
     """
 
     __tablename__ = "command"
+    __table_args__ = (
+        Index("ix_command_guild_id_name", "guild_id", "name", unique=True),
+    )
     id = Column(Integer, primary_key=True)
     name = Column(String)
     text = Column(String)
@@ -32,4 +55,44 @@ class AobaUser(Base):
 
     __tablename__ = "aobauser"
     discord_id = Column(BigInteger, primary_key=True, autoincrement=False)
-    bank_balance = Column(Integer)
+    bank_balance = Column(Integer, index=True)
+
+
+class AobaLedgerEntry(Base):
+    """
+    Append-only record of every change to an user's bank balance
+    """
+
+    __tablename__ = "ledger"
+    id = Column(Integer, primary_key=True)
+    discord_id = Column(BigInteger, index=True)
+    amount = Column(Integer)
+    # Balance of the user after the change
+    balance = Column(Integer)
+    created_at = Column(DateTime, server_default=func.now())
+
+
+class AobaBroadcast(Base):
+    """
+    Announcement sent by the bot owner to every guild, with the progress needed to resume it
+    """
+
+    __tablename__ = "broadcast"
+    id = Column(Integer, primary_key=True)
+    text = Column(String)
+    # Every guild with an id up to the cursor has already been processed
+    cursor = Column(BigInteger, default=0)
+    # Comma separated ids of the guilds after the cursor that were already processed
+    processed_guild_ids = Column(String, default="")
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    finished = Column(Boolean, default=False)
+
+
+class AobaSchemaVersion(Base):
+    """
+    Version of the database schema, the number of the last migration applied to it
+    """
+
+    __tablename__ = "schema_version"
+    version = Column(Integer, primary_key=True, autoincrement=False)
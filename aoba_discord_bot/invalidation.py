@@ -0,0 +1,166 @@
+"""Channels that tell the caches of other bot processes which of their entries were changed."""
+import asyncio
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+# Called with the keys changed by another process, or None if every entry may have changed
+Subscriber = Callable[[Optional[List[int]]], None]
+
+
+class InvalidationChannel(ABC):
+    """
+    Publishes the keys changed by this process under a topic, usually the name of a cache, and delivers the
+    keys published by other processes to the subscribers of the topic.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, List[Subscriber]] = defaultdict(list)
+
+    def subscribe(self, topic: str, subscriber: Subscriber) -> None:
+        self._subscribers[topic].append(subscriber)
+
+    def _deliver(self, topic: str, keys: Optional[List[int]]) -> None:
+        for subscriber in self._subscribers[topic]:
+            try:
+                subscriber(keys)
+            except Exception:
+                logging.exception(f"Invalidation subscriber {subscriber} failed")
+
+    def _deliver_all(self) -> None:
+        for topic in self._subscribers:
+            self._deliver(topic, None)
+
+    async def start(self) -> None:
+        pass
+
+    @abstractmethod
+    async def publish(self, topic: str, keys: Iterable[int]) -> None:
+        """
+        Sends the keys changed by this process to the other processes subscribed to the topic.
+        """
+
+    async def close(self) -> None:
+        pass
+
+
+class LocalInvalidationChannel(InvalidationChannel):
+    """
+    Delivers invalidations between channels of the same process, a stand-in for PostgresInvalidationChannel in
+    single process installs and tests. Channels created with the same peers list receive each other's keys.
+    """
+
+    def __init__(self, peers: Optional[List["LocalInvalidationChannel"]] = None):
+        super().__init__()
+        self.peers = peers if peers is not None else list()
+        self.peers.append(self)
+
+    async def publish(self, topic: str, keys: Iterable[int]) -> None:
+        keys = list(keys)
+        for peer in self.peers:
+            if peer is not self:
+                peer._deliver(topic, keys)
+
+    async def close(self) -> None:
+        if self in self.peers:
+            self.peers.remove(self)
+
+
+class PostgresInvalidationChannel(InvalidationChannel):
+    """
+    Invalidations sent between bot processes with PostgreSQL's LISTEN/NOTIFY, over a connection of the engine's
+    pool held while the channel is open.
+
+    Notifications sent while the connection is lost can't be received, so when it's lost or restored every
+    subscriber is told that every entry may have changed.
+    """
+
+    CHANNEL = "aoba_invalidation"
+    RECONNECT_DELAY = 5.0
+    # NOTIFY payloads must be shorter than 8000 bytes
+    MAX_PAYLOAD_SIZE = 7900
+
+    def __init__(self, engine: AsyncEngine):
+        super().__init__()
+        self.engine = engine
+        # Notifications are also delivered to the connection that sent them, they're skipped by sender id
+        self.sender_id = uuid.uuid4().hex[:12]
+        self._connection: Optional[AsyncConnection] = None
+        self._listener = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def start(self) -> None:
+        self._connection = await self.engine.connect()
+        raw_connection = await self._connection.get_raw_connection()
+        self._listener = raw_connection.driver_connection
+        await self._listener.add_listener(self.CHANNEL, self._on_notification)
+        self._listener.add_termination_listener(self._on_termination)
+
+    def _on_notification(self, connection, pid: int, channel: str, payload: str):
+        sender_id, topic, keys = payload.split(":", 2)
+        if sender_id != self.sender_id:
+            self._deliver(topic, [int(key) for key in keys.split(",")])
+
+    def _on_termination(self, connection):
+        if self._closed:
+            return
+        logging.warning("Lost the connection of the invalidation channel, reconnecting")
+        self._deliver_all()
+        self._reconnect_task = asyncio.ensure_future(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        await self._connection.invalidate()
+        while not self._closed:
+            await asyncio.sleep(self.RECONNECT_DELAY)
+            try:
+                await self.start()
+            except Exception:
+                logging.exception("Failed to reconnect the invalidation channel")
+                continue
+            # Invalidations published while disconnected were missed
+            self._deliver_all()
+            return
+
+    def _payloads(self, topic: str, keys: Iterable[int]) -> Iterator[str]:
+        prefix = f"{self.sender_id}:{topic}:"
+        chunk: List[str] = list()
+        size = len(prefix)
+        for key in keys:
+            key = str(key)
+            if chunk and size + len(key) + 1 > self.MAX_PAYLOAD_SIZE:
+                yield prefix + ",".join(chunk)
+                chunk, size = list(), len(prefix)
+            chunk.append(key)
+            size += len(key) + 1
+        if chunk:
+            yield prefix + ",".join(chunk)
+
+    async def publish(self, topic: str, keys: Iterable[int]) -> None:
+        # Sent over a pooled connection, so other processes are notified even while the listener reconnects
+        async with self.engine.connect() as conn:
+            for payload in self._payloads(topic, keys):
+                await conn.execute(
+                    text("SELECT pg_notify(:channel, :payload)"),
+                    {"channel": self.CHANNEL, "payload": payload},
+                )
+            # Notifications are sent when the transaction commits
+            await conn.commit()
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        if self._connection is not None:
+            if self._listener is not None and not self._listener.is_closed():
+                await self._listener.remove_listener(
+                    self.CHANNEL, self._on_notification
+                )
+            await self._connection.close()
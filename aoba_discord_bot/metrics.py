@@ -0,0 +1,344 @@
+"""Metrics of the bot, exposed in the Prometheus text format over a local HTTP endpoint."""
+import asyncio
+import contextvars
+import logging
+import math
+import time
+import weakref
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# Name of the command being run by the current task, so database queries can be attributed to it
+current_command: "contextvars.ContextVar[str]" = contextvars.ContextVar(
+    "current_command", default=""
+)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (
+        str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+        for value in values
+    )
+    return (
+        "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+    )
+
+
+class Metric(ABC):
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+    @abstractmethod
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """
+        return: (sample name, formatted labels, value) of every sample of the metric
+        """
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        lines.extend(
+            f"{name}{labels} {_format_value(value)}"
+            for name, labels, value in self.samples()
+        )
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[Labels, float] = defaultdict(float)
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        self._values[label_values] += amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for label_values, value in self._values.items():
+            yield self.name, _format_labels(self.label_names, label_values), value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[Labels, float] = dict()
+
+    def set(self, value: float, *label_values: str) -> None:
+        self._values[label_values] = value
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for label_values, value in self._values.items():
+            yield self.name, _format_labels(self.label_names, label_values), value
+
+
+class Histogram(Metric):
+    """
+    Counts observations in cumulative buckets, like Prometheus histograms, so quantiles can be estimated from
+    the scraped buckets.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: Dict[Labels, List[int]] = dict()
+        self._sums: Dict[Labels, float] = defaultdict(float)
+
+    def observe(self, value: float, *label_values: str) -> None:
+        counts = self._counts.get(label_values)
+        if counts is None:
+            counts = self._counts[label_values] = [0] * len(self.buckets)
+        for index, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                counts[index] += 1
+                break
+        self._sums[label_values] += value
+
+    def count(self, *label_values: str) -> int:
+        return sum(self._counts.get(label_values, ()))
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        names = self.label_names + ("le",)
+        for label_values, counts in self._counts.items():
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    _format_labels(names, label_values + (_format_value(upper_bound),)),
+                    cumulative,
+                )
+            labels = _format_labels(self.label_names, label_values)
+            yield f"{self.name}_sum", labels, self._sums[label_values]
+            yield f"{self.name}_count", labels, cumulative
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: List[Metric] = list()
+        # Called before rendering, to update gauges that are read from elsewhere
+        self.collectors: List[Callable[[], None]] = list()
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception:
+                logging.exception(f"Metrics collector {collector} failed")
+        lines = list()
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class BotMetrics:
+    """
+    Command, database, gateway and event loop metrics of the bot, plus the statistics shown by the stats command.
+    """
+
+    LOOP_LAG_INTERVAL = 0.5
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.registry = MetricsRegistry()
+        self.commands = self.registry.register(
+            Counter(
+                "aoba_commands_total",
+                "Commands invoked, by outcome",
+                ["command", "outcome"],
+            )
+        )
+        self.command_duration = self.registry.register(
+            Histogram(
+                "aoba_command_duration_seconds",
+                "Time to run a command, including its checks",
+                ["command"],
+            )
+        )
+        self.db_queries = self.registry.register(
+            Counter(
+                "aoba_db_queries_total",
+                "Database queries, by the command that ran them",
+                ["command"],
+            )
+        )
+        self.db_query_duration = self.registry.register(
+            Histogram(
+                "aoba_db_query_duration_seconds",
+                "Time to execute a database query, by the command that ran it",
+                ["command"],
+            )
+        )
+        self.gateway_latency = self.registry.register(
+            Gauge(
+                "aoba_gateway_latency_seconds",
+                "Time between a gateway heartbeat and its acknowledgement",
+                ["shard"],
+            )
+        )
+        self.loop_lag = self.registry.register(
+            Histogram(
+                "aoba_event_loop_lag_seconds",
+                "Delay of the event loop in running a task scheduled to wake up",
+                buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+            )
+        )
+        self.internal_stats = self.registry.register(
+            Gauge(
+                "aoba_internal_stat",
+                "Statistics shown by the stats command",
+                ["section", "name"],
+            )
+        )
+        self.loop_stalls = self.registry.register(
+            Counter(
+                "aoba_event_loop_stalls_total",
+                "Stalls of the event loop reported by the watchdog",
+            )
+        )
+        self.registry.collectors.append(self._collect_bot_stats)
+
+        # Description of the command each task is running, read by the watchdog when the loop stalls
+        self.running_commands: "weakref.WeakKeyDictionary[asyncio.Task, str]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._loop_lag_task: Optional[asyncio.Task] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    @contextmanager
+    def track_command(self, ctx):
+        """
+        Times the command of a context and attributes the database queries made while it runs to it.
+        """
+        name = ctx.command.qualified_name
+        token = current_command.set(name)
+        task = asyncio.current_task()
+        self.running_commands[
+            task
+        ] = f"command {name} invoked by {ctx.author} in {ctx.guild or 'a DM'}"
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            current_command.reset(token)
+            self.running_commands.pop(task, None)
+            self.command_duration.observe(time.perf_counter() - start, name)
+            self.commands.inc(name, "error" if ctx.command_failed else "success")
+
+    def describe_task(self, task: asyncio.Task) -> Optional[str]:
+        return self.running_commands.get(task)
+
+    def record_stall(self, duration: float) -> None:
+        self.loop_stalls.inc()
+
+    def instrument_engine(self, engine: AsyncEngine) -> None:
+        event.listen(engine.sync_engine, "before_cursor_execute", self._before_query)
+        event.listen(engine.sync_engine, "after_cursor_execute", self._after_query)
+        event.listen(engine.sync_engine, "handle_error", self._on_query_error)
+
+    @staticmethod
+    def _before_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", list()).append(time.perf_counter())
+
+    def _after_query(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["query_start"].pop()
+        command = current_command.get() or "none"
+        self.db_queries.inc(command)
+        self.db_query_duration.observe(duration, command)
+
+    @staticmethod
+    def _on_query_error(exception_context):
+        # after_cursor_execute isn't called for failed queries
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_start"):
+            connection.info["query_start"].pop()
+
+    def _collect_bot_stats(self) -> None:
+        latencies = getattr(self.bot, "latencies", None) or [(0, self.bot.latency)]
+        for shard_id, latency in latencies:
+            if not math.isnan(latency):
+                self.gateway_latency.set(latency, str(shard_id))
+
+        self.internal_stats.clear()
+        for section, stats in self.bot.stats_sections().items():
+            for name, value in stats.items():
+                if isinstance(value, (int, float)):
+                    self.internal_stats.set(value, section, name)
+
+    async def _sample_loop_lag(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            scheduled = loop.time() + self.LOOP_LAG_INTERVAL
+            await asyncio.sleep(self.LOOP_LAG_INTERVAL)
+            self.loop_lag.observe(max(0.0, loop.time() - scheduled))
+
+    async def start(self, host: str = "127.0.0.1", port: Optional[int] = None):
+        """
+        Starts sampling the event loop lag and, if a port is given, serving the metrics at /metrics.
+        """
+        self._loop_lag_task = asyncio.ensure_future(self._sample_loop_lag())
+        if port is None:
+            return
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logging.info(f"Serving metrics at http://{host}:{port}/metrics")
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=self.registry.render(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    async def close(self) -> None:
+        if self._loop_lag_task is not None:
+            self._loop_lag_task.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
@@ -0,0 +1,188 @@
+"""Client-side rate limiting and retries for calls to external APIs."""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class TokenBucket:
+    """
+    Allows `rate` operations per second on average, with bursts of up to `capacity` operations.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    def try_acquire(self) -> float:
+        """
+        Takes a token if one is available.
+        return: 0 if a token was taken, otherwise the seconds until one is available
+        """
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def release(self) -> None:
+        """
+        Gives back a token taken by try_acquire that wasn't used.
+        """
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + 1)
+
+
+class RateLimiter:
+    """
+    Token bucket with a bounded queue of waiting callers, where callers with a lower priority number are served
+    first and callers with the same priority are served in arrival order.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 10, max_queue: int = 100):
+        """
+        :param rate: operations allowed per second on average
+        :param burst: operations that can happen at once after a quiet period
+        :param max_queue: maximum number of waiting callers, more callers are rejected with QueueFullError
+        """
+        self.bucket = TokenBucket(rate, burst)
+        self.max_queue = max_queue
+        self._queue: List[Tuple[int, int, asyncio.Future]] = list()
+        self._counter = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        self.acquired = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """
+        Waits until the caller is allowed to make a request.
+        :param priority: PRIORITY_INTERACTIVE for requests a user is waiting on, PRIORITY_BACKGROUND otherwise
+        """
+        start = time.monotonic()
+
+        if not self._queue and self.bucket.try_acquire() == 0:
+            self._record_wait(0.0)
+            return
+
+        if len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(f"Rate limiter queue is full ({self.max_queue})")
+
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._counter), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Cancelled after being given a token, which goes to the next caller instead
+                self._grant()
+            raise
+        self._record_wait(time.monotonic() - start)
+
+    async def _dispatch(self) -> None:
+        while self._queue:
+            wait = self.bucket.try_acquire()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            self._grant()
+
+    def _grant(self) -> None:
+        """
+        Gives a taken token to the first waiting caller that wasn't cancelled, or back to the bucket if there's
+        none.
+        """
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.bucket.release()
+
+    def _record_wait(self, wait: float) -> None:
+        self.acquired += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "acquired": self.acquired,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.total_wait / self.acquired * 1000, 2)
+            if self.acquired
+            else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+        }
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """
+    Exponential backoff with full jitter.
+    :param attempt: number of the retry, starting at 0
+    return: random number of seconds between 0 and the exponential delay for the attempt
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+async def retry_with_backoff(
+    func: Callable[[], Awaitable[T]],
+    should_retry: Callable[[Exception], Optional[float]],
+    max_retries: int = 3,
+    base_delay: float = 0.5,
+    max_delay: float = 30.0,
+) -> T:
+    """
+    Calls func until it succeeds, sleeping between attempts with exponential backoff and jitter.
+    :param func: coroutine function making one attempt
+    :param should_retry: returns None for exceptions that shouldn't be retried, otherwise the seconds the server
+        asked to wait, or 0 if it didn't
+    :param max_retries: attempts after the first one before the last exception is raised
+    :param base_delay: delay of the first retry before jitter
+    :param max_delay: maximum delay between attempts
+    return: the result of func
+    """
+    for attempt in itertools.count():
+        try:
+            return await func()
+        except Exception as e:
+            retry_after = should_retry(e)
+            if retry_after is None or attempt >= max_retries:
+                raise
+            delay = max(retry_after, backoff_delay(attempt, base_delay, max_delay))
+            logging.warning(
+                f"Retrying in {delay:.2f}s after attempt {attempt + 1} failed: {e}"
+            )
+            await asyncio.sleep(delay)
@@ -0,0 +1,330 @@
+"""Database queries used by the bot and its cogs."""
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, literal, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from aoba_discord_bot.caches import DEFAULT_COMMAND_PREFIX
+from aoba_discord_bot.db_models import (
+    AobaBroadcast,
+    AobaCommand,
+    AobaGuild,
+    AobaLedgerEntry,
+    AobaUser,
+)
+
+
+def _dialect_insert(session: AsyncSession):
+    """
+    INSERT construct of the session's dialect, which supports ON CONFLICT clauses. The dialect module is imported
+    on first use, so only the one of the configured database is loaded.
+    """
+    if session.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+# Rows per INSERT, so the statements of bulk inserts stay below the databases' limits of bound parameters
+INSERT_CHUNK_SIZE = 1000
+
+
+async def get_guild(session: AsyncSession, guild_id: int) -> Optional[AobaGuild]:
+    return await session.get(AobaGuild, guild_id)
+
+
+async def add_guilds(session: AsyncSession, guild_ids: Iterable[int]) -> List[int]:
+    """
+    Adds records with the default prefix for the guilds that don't have one, without reading the existing ones.
+    :param session: session the records are added in, they're not committed
+    :param guild_ids: ids of the guilds
+    return: ids of the guilds that were added
+    """
+    insert = _dialect_insert(session)
+    guild_ids = list(guild_ids)
+    added_guild_ids = list()
+    for start in range(0, len(guild_ids), INSERT_CHUNK_SIZE):
+        rows = [
+            {"guild_id": guild_id, "command_prefix": DEFAULT_COMMAND_PREFIX}
+            for guild_id in guild_ids[start : start + INSERT_CHUNK_SIZE]
+        ]
+        query = (
+            insert(AobaGuild)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=[AobaGuild.guild_id])
+            .returning(AobaGuild.guild_id)
+        )
+        added_guild_ids.extend((await session.execute(query)).scalars().all())
+    return added_guild_ids
+
+
+async def remove_guild(session: AsyncSession, guild_id: int) -> None:
+    """
+    Deletes the record of a guild and its custom commands.
+    """
+    await session.execute(delete(AobaCommand).where(AobaCommand.guild_id == guild_id))
+    await session.execute(delete(AobaGuild).where(AobaGuild.guild_id == guild_id))
+
+
+def _in_shard(shard_id: int, shard_count: int):
+    """
+    Condition on the guild records whose events Discord sends to a shard, sharding.shard_id_for_guild in SQL.
+    """
+    return AobaGuild.guild_id.op(">>")(22) % shard_count == shard_id
+
+
+async def get_custom_prefixes(
+    session: AsyncSession, shard_id: Optional[int] = None, shard_count: int = 1
+) -> List[Tuple[int, str]]:
+    """
+    Get the (guild id, prefix) of the guilds that changed their prefix from the default.
+    :param session: database session
+    :param shard_id: only guilds whose events Discord sends to this shard are returned, the ones where
+                     (guild_id >> 22) % shard_count is the shard id
+    :param shard_count: total number of shards
+    """
+    query = select(AobaGuild.guild_id, AobaGuild.command_prefix).where(
+        AobaGuild.command_prefix != DEFAULT_COMMAND_PREFIX
+    )
+    if shard_id is not None:
+        query = query.where(_in_shard(shard_id, shard_count))
+    return (await session.execute(query)).all()
+
+
+async def get_announcement_channels(
+    session: AsyncSession,
+    after_guild_id: int = 0,
+    shard_id: Optional[int] = None,
+    shard_count: int = 1,
+) -> List[Tuple[int, int]]:
+    """
+    Get the (guild id, announcement channel id) of every guild with an announcement channel set, ordered by
+    guild id. Read from the partial index of the guilds with a channel, without scanning the table.
+    :param session: database session
+    :param after_guild_id: only guilds with a greater id are returned
+    :param shard_id: only guilds whose events Discord sends to this shard are returned
+    :param shard_count: total number of shards
+    """
+    query = (
+        select(AobaGuild.guild_id, AobaGuild.announcement_channel_id)
+        .where(
+            AobaGuild.announcement_channel_id.isnot(None),
+            AobaGuild.guild_id > after_guild_id,
+        )
+        .order_by(AobaGuild.guild_id)
+    )
+    if shard_id is not None:
+        query = query.where(_in_shard(shard_id, shard_count))
+    return (await session.execute(query)).all()
+
+
+async def set_announcement_channel(
+    session: AsyncSession, guild_id: int, channel_id: Optional[int]
+) -> bool:
+    """
+    Sets or, with None, unsets the announcement channel of a guild without reading its record.
+    :param session: session the change is executed in, it's not committed
+    return: whether the guild has a record
+    """
+    query = (
+        update(AobaGuild)
+        .where(AobaGuild.guild_id == guild_id)
+        .values(announcement_channel_id=channel_id)
+    )
+    return (await session.execute(query)).rowcount > 0
+
+
+async def clear_announcement_channel(
+    session: AsyncSession, guild_id: int, channel_id: int
+) -> None:
+    """
+    Unsets the announcement channel of a guild if it's still the given channel, for example once it's deleted.
+    """
+    await session.execute(
+        update(AobaGuild)
+        .where(
+            AobaGuild.guild_id == guild_id,
+            AobaGuild.announcement_channel_id == channel_id,
+        )
+        .values(announcement_channel_id=None)
+    )
+
+
+async def get_command(
+    session: AsyncSession, guild_id: int, name: str
+) -> Optional[AobaCommand]:
+    query = select(AobaCommand).where(
+        AobaCommand.guild_id == guild_id, AobaCommand.name == name
+    )
+    return (await session.execute(query)).scalars().first()
+
+
+async def get_all_commands(session: AsyncSession) -> List[AobaCommand]:
+    return (await session.execute(select(AobaCommand))).scalars().all()
+
+
+async def set_command(
+    session: AsyncSession, guild_id: int, name: str, text: str
+) -> None:
+    """
+    Add a custom command to a guild or replace the text of the command if it already exists, with a single upsert
+    so concurrent calls for the same name can't both insert it.
+    :param session: session the change is executed in, it's not committed
+    :param guild_id: id of the guild the command belongs to
+    :param name: name used to invoke the command
+    :param text: text that will be displayed
+    """
+    insert = _dialect_insert(session)
+    await session.execute(
+        insert(AobaCommand)
+        .values(guild_id=guild_id, name=name, text=text)
+        .on_conflict_do_update(
+            index_elements=[AobaCommand.guild_id, AobaCommand.name],
+            set_={"text": text},
+        )
+    )
+
+
+async def get_user(session: AsyncSession, discord_id: int) -> Optional[AobaUser]:
+    return await session.get(AobaUser, discord_id)
+
+
+async def get_balances(
+    session: AsyncSession, discord_ids: Iterable[int]
+) -> List[Tuple[int, int]]:
+    """
+    Get the (discord id, balance) of the users with the given ids that exist.
+    """
+    query = select(AobaUser.discord_id, AobaUser.bank_balance).where(
+        AobaUser.discord_id.in_(list(discord_ids))
+    )
+    return (await session.execute(query)).all()
+
+
+async def iter_balances(
+    session: AsyncSession, chunk_size: int = 10000
+) -> AsyncIterator[List[Tuple[int, int]]]:
+    """
+    Get the (discord id, balance) of every user in chunks, paginated by discord id over the primary key, so neither
+    the database nor the bot sorts or buffers the whole table.
+    :param session: database session
+    :param chunk_size: maximum number of users in each chunk
+    """
+    last_discord_id = -1
+    while True:
+        query = (
+            select(AobaUser.discord_id, AobaUser.bank_balance)
+            .where(AobaUser.discord_id > last_discord_id)
+            .order_by(AobaUser.discord_id)
+            .limit(chunk_size)
+        )
+        balances = (await session.execute(query)).all()
+        if balances:
+            yield balances
+        if len(balances) < chunk_size:
+            return
+        last_discord_id = balances[-1][0]
+
+
+async def change_balance(session: AsyncSession, discord_id: int, amount: int) -> int:
+    """
+    Atomically adds an amount to an user's bank balance, creating the user if needed, and records the change in
+    the ledger. On PostgreSQL both writes are a single statement.
+    :param session: session the change is executed in, it's not committed
+    :param discord_id: discord id of the user
+    :param amount: value added to the balance, negative to withdraw
+    return: the new balance
+    """
+    insert = _dialect_insert(session)
+    balance_upsert = (
+        insert(AobaUser)
+        .values(discord_id=discord_id, bank_balance=amount)
+        .on_conflict_do_update(
+            index_elements=[AobaUser.discord_id],
+            set_={"bank_balance": func.coalesce(AobaUser.bank_balance, 0) + amount},
+        )
+        .returning(AobaUser.discord_id, AobaUser.bank_balance)
+    )
+
+    if session.bind.dialect.name == "postgresql":
+        balance_update = balance_upsert.cte("balance_update")
+        query = (
+            insert(AobaLedgerEntry)
+            .from_select(
+                ["discord_id", "amount", "balance"],
+                select(
+                    balance_update.c.discord_id,
+                    literal(amount),
+                    balance_update.c.bank_balance,
+                ),
+            )
+            .returning(AobaLedgerEntry.balance)
+        )
+        return (await session.execute(query)).scalar_one()
+
+    # Other databases can't have data-modifying statements in a WITH clause
+    balance = (await session.execute(balance_upsert)).one().bank_balance
+    session.add(AobaLedgerEntry(discord_id=discord_id, amount=amount, balance=balance))
+    return balance
+
+
+async def change_balances(
+    session: AsyncSession, amounts: Dict[int, int]
+) -> Dict[int, int]:
+    """
+    Adds amounts to the bank balances of many users with a single upsert and records the changes in the ledger.
+    :param session: session the changes are executed in, they're not committed
+    :param amounts: value added to the balance of each user, by discord id
+    return: the new balance of each user, by discord id
+    """
+    if not amounts:
+        return dict()
+
+    insert = _dialect_insert(session)
+    # Rows are locked in the same order by every flush, so concurrent flushes can't deadlock
+    rows = [
+        {"discord_id": discord_id, "bank_balance": amount}
+        for discord_id, amount in sorted(amounts.items())
+    ]
+    balance_upsert = insert(AobaUser).values(rows)
+    balance_upsert = balance_upsert.on_conflict_do_update(
+        index_elements=[AobaUser.discord_id],
+        set_={
+            "bank_balance": func.coalesce(AobaUser.bank_balance, 0)
+            + balance_upsert.excluded.bank_balance
+        },
+    ).returning(AobaUser.discord_id, AobaUser.bank_balance)
+    balances = dict((await session.execute(balance_upsert)).all())
+
+    await session.execute(
+        AobaLedgerEntry.__table__.insert(),
+        [
+            {
+                "discord_id": discord_id,
+                "amount": amount,
+                "balance": balances[discord_id],
+            }
+            for discord_id, amount in amounts.items()
+        ],
+    )
+    return balances
+
+
+async def get_broadcast(
+    session: AsyncSession, broadcast_id: int
+) -> Optional[AobaBroadcast]:
+    return await session.get(AobaBroadcast, broadcast_id)
+
+
+async def get_unfinished_broadcast(session: AsyncSession) -> Optional[AobaBroadcast]:
+    """
+    Get the most recent broadcast that was interrupted before reaching every guild.
+    """
+    query = (
+        select(AobaBroadcast)
+        .where(AobaBroadcast.finished.is_(False))
+        .order_by(AobaBroadcast.id.desc())
+    )
+    return (await session.execute(query)).scalars().first()
@@ -0,0 +1,94 @@
+"""Helpers for running the bot over several gateway connections (shards)."""
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, Iterable, List, Tuple
+
+
+def parse_shard_ids(value: str) -> List[int]:
+    """
+    Parses a list of shard ids and ranges of shard ids, for example "0-3,8" is [0, 1, 2, 3, 8].
+    :raises ValueError: if the value isn't a valid list of shard ids
+    """
+    shard_ids = set()
+    for part in value.split(","):
+        start, separator, end = part.strip().partition("-")
+        first = int(start)
+        last = int(end) if separator else first
+        if first < 0 or last < first:
+            raise ValueError(f"Invalid shard id range `{part.strip()}`")
+        shard_ids.update(range(first, last + 1))
+    return sorted(shard_ids)
+
+
+def shard_id_for_guild(guild_id: int, shard_count: int) -> int:
+    """
+    return: id of the shard Discord sends the events of a guild to
+    """
+    return (guild_id >> 22) % shard_count
+
+
+class ShardStats:
+    """
+    Messages received and connections made by each shard. Messages are the bulk of the gateway events the bot
+    handles, so their rate shows how busy each shard is.
+
+    Rates are computed over a sliding window of one second buckets, so recording a message is constant time no
+    matter how many are received.
+    """
+
+    def __init__(self, window: int = 60):
+        """
+        :param window: seconds the message rate is averaged over
+        """
+        self.window = window
+        self.messages: Dict[int, int] = defaultdict(int)
+        self.connects: Dict[int, int] = defaultdict(int)
+        self.disconnects: Dict[int, int] = defaultdict(int)
+        # [second, number of messages] of the seconds in the window, oldest first
+        self._buckets: Dict[int, Deque[List[int]]] = defaultdict(deque)
+
+    def record_message(self, shard_id: int) -> None:
+        second = int(time.monotonic())
+        self.messages[shard_id] += 1
+
+        buckets = self._buckets[shard_id]
+        if buckets and buckets[-1][0] == second:
+            buckets[-1][1] += 1
+        else:
+            buckets.append([second, 1])
+            while buckets[0][0] <= second - self.window:
+                buckets.popleft()
+
+    def record_connect(self, shard_id: int) -> None:
+        self.connects[shard_id] += 1
+
+    def record_disconnect(self, shard_id: int) -> None:
+        self.disconnects[shard_id] += 1
+
+    def message_rate(self, shard_id: int) -> float:
+        """
+        return: average messages per second received by the shard over the window
+        """
+        oldest = int(time.monotonic()) - self.window
+        recent = sum(
+            count for second, count in self._buckets[shard_id] if second > oldest
+        )
+        return recent / self.window
+
+    def stats(
+        self, latencies: Iterable[Tuple[int, float]]
+    ) -> Dict[int, Dict[str, float]]:
+        """
+        :param latencies: (shard id, gateway latency in seconds) of every shard, like AutoShardedBot.latencies
+        return: statistics of each shard, by shard id
+        """
+        return {
+            shard_id: {
+                "latency_ms": round(latency * 1000, 2),
+                "messages": self.messages[shard_id],
+                "messages_per_second": round(self.message_rate(shard_id), 2),
+                "connects": self.connects[shard_id],
+                "disconnects": self.disconnects[shard_id],
+            }
+            for shard_id, latency in latencies
+        }
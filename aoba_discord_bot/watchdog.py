@@ -0,0 +1,135 @@
+"""Detection of event loop stalls, the blocking calls that freeze every command and the gateway heartbeat."""
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Callable, Optional
+
+
+class LoopWatchdog:
+    """
+    Watches the event loop from a separate thread. A task in the loop updates a heartbeat and, when the heartbeat
+    is late by more than the stall threshold, the thread logs what the loop is running: the task, the command it
+    belongs to and its stack. Until the loop recovers, the stack is sampled and the most frequent stacks are logged
+    as a profile of the stall.
+
+    Optionally enables asyncio's debug mode, which logs every callback and coroutine step slower than the slow
+    callback duration along with where it was scheduled.
+    """
+
+    PROFILE_INTERVAL = 0.005
+    PROFILE_TOP_STACKS = 5
+    PROFILE_STACK_DEPTH = 8
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        stall_threshold: float = 0.25,
+        slow_callback_duration: Optional[float] = None,
+        describe_task: Callable[[asyncio.Task], Optional[str]] = None,
+        on_stall: Callable[[float], None] = None,
+    ):
+        """
+        :param loop: event loop to watch
+        :param stall_threshold: seconds the loop can go without running the heartbeat before it's reported
+        :param slow_callback_duration: seconds after which asyncio logs a callback, None keeps debug mode off
+        :param describe_task: returns what a task is doing, for example the command it runs
+        :param on_stall: called in the event loop with the duration of each stall once it ends
+        """
+        self.loop = loop
+        self.stall_threshold = stall_threshold
+        self.slow_callback_duration = slow_callback_duration
+        self.describe_task = describe_task
+        self.on_stall = on_stall
+        self.stalls = 0
+
+        self._interval = min(stall_threshold / 2, 0.1)
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """
+        Starts watching the loop, must be called from the loop's thread.
+        """
+        self._loop_thread_id = threading.get_ident()
+        if self.slow_callback_duration is not None:
+            self.loop.set_debug(True)
+            self.loop.slow_callback_duration = self.slow_callback_duration
+
+        self._last_beat = time.monotonic()
+        self._heartbeat_task = asyncio.ensure_future(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        logging.info(
+            f"Watching the event loop for stalls longer than {self.stall_threshold}s"
+        )
+
+    async def close(self) -> None:
+        self._stopped.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+
+    async def _heartbeat(self) -> None:
+        while True:
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(self._interval)
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self._interval):
+            late = time.monotonic() - self._last_beat - self._interval
+            if late > self.stall_threshold:
+                self._report_stall()
+
+    def _loop_frame(self):
+        return sys._current_frames().get(self._loop_thread_id)
+
+    def _report_stall(self) -> None:
+        beat = self._last_beat
+        started = beat + self._interval
+
+        task = asyncio.current_task(self.loop)
+        description = ""
+        if task is not None:
+            description = f" in {task!r}"
+            context = self.describe_task(task) if self.describe_task else None
+            if context:
+                description += f", running {context}"
+        frame = self._loop_frame()
+        stack = "".join(traceback.format_stack(frame)) if frame else ""
+        logging.warning(
+            f"Event loop stalled for {time.monotonic() - started:.3f}s{description}:\n{stack}"
+        )
+
+        samples = collections.Counter()
+        while self._last_beat == beat and not self._stopped.is_set():
+            frame = self._loop_frame()
+            if frame is not None:
+                samples[self._collapse_stack(frame)] += 1
+            time.sleep(self.PROFILE_INTERVAL)
+
+        duration = time.monotonic() - started
+        self.stalls += 1
+        total = sum(samples.values())
+        profile = "\n".join(
+            f"{count / total:6.1%} {stack}"
+            for stack, count in samples.most_common(self.PROFILE_TOP_STACKS)
+        )
+        logging.warning(
+            f"Event loop stall ended after {duration:.3f}s, {total} stack samples:\n{profile}"
+        )
+        if self.on_stall:
+            self.loop.call_soon_threadsafe(self.on_stall, duration)
+
+    def _collapse_stack(self, frame) -> str:
+        """
+        return: the innermost frames of a stack in one line, innermost first
+        """
+        summary = traceback.extract_stack(frame, limit=self.PROFILE_STACK_DEPTH)
+        return " <- ".join(
+            f"{entry.name} ({entry.filename}:{entry.lineno})"
+            for entry in reversed(summary)
+        )
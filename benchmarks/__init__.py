@@ -0,0 +1 @@
+"""Offline benchmarks of the bot, run with ``python -m benchmarks.bot_benchmark``."""
@@ -0,0 +1,352 @@
+"""
+Throughput and latency of the bot handling synthetic message streams, with a fake gateway and a local database.
+
+Each scenario starts a bot connected to thousands of fake guilds, replays messages from concurrent senders and
+reports messages per second, percentiles of the time to handle a message and database queries per message.
+"""
+import asyncio
+import logging
+import random
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import click
+
+from aoba_discord_bot import database, migrations
+from aoba_discord_bot.bot import AobaDiscordBot
+from aoba_discord_bot.db_models import AobaCommand, AobaGuild, AobaUser, Base
+from benchmarks.fake_discord import FakeGateway, delivery_tasks
+
+OWNER_ID = 10**17
+FIRST_USER_ID = OWNER_ID + 1
+CUSTOM_PREFIX = "?"
+# Share of the guilds that changed their prefix from the default
+CUSTOM_PREFIX_RATIO = 0.2
+CUSTOM_COMMANDS_PER_GUILD = 5
+
+# (guild id, author id, content) of a message
+Message = Tuple[int, int, str]
+
+
+@dataclass
+class World:
+    """
+    Guilds, users and database records shared by the bot and the message generators.
+    """
+
+    guild_ids: List[int]
+    user_ids: List[int]
+    prefixes: Dict[int, str]
+    owners: Dict[int, int]
+
+    @classmethod
+    def generate(cls, guild_count: int, user_count: int, rng: random.Random):
+        guild_ids = [(index + 1) << 22 for index in range(guild_count)]
+        user_ids = [FIRST_USER_ID + index for index in range(user_count)]
+        return cls(
+            guild_ids=guild_ids,
+            user_ids=user_ids,
+            prefixes={
+                guild_id: CUSTOM_PREFIX if rng.random() < CUSTOM_PREFIX_RATIO else "!"
+                for guild_id in guild_ids
+            },
+            owners={guild_id: rng.choice(user_ids) for guild_id in guild_ids},
+        )
+
+    @staticmethod
+    def channel_id(guild_id: int) -> int:
+        return guild_id + 1
+
+
+def prefix_messages(world: World, rng: random.Random) -> Iterator[Message]:
+    """
+    Mostly chat, which only needs the prefix resolved, with some commands that don't touch the database.
+    """
+    while True:
+        guild_id = rng.choice(world.guild_ids)
+        author_id = rng.choice(world.user_ids)
+        if rng.random() < 0.8:
+            yield guild_id, author_id, "hello there, how is everyone doing?"
+        else:
+            yield guild_id, author_id, f"{world.prefixes[guild_id]}em **bold**"
+
+
+def custom_command_messages(world: World, rng: random.Random) -> Iterator[Message]:
+    while True:
+        guild_id = rng.choice(world.guild_ids)
+        name = f"cmd{rng.randrange(CUSTOM_COMMANDS_PER_GUILD)}"
+        yield guild_id, rng.choice(world.user_ids), f"{world.prefixes[guild_id]}{name}"
+
+
+def economy_messages(world: World, rng: random.Random) -> Iterator[Message]:
+    """
+    Balance checks by guild owners, which outnumber everything else, rank and leaderboard lookups by anyone and
+    deposits by the bot owner.
+    """
+    while True:
+        guild_id = rng.choice(world.guild_ids)
+        prefix = world.prefixes[guild_id]
+        roll = rng.random()
+        if roll < 0.5:
+            yield guild_id, world.owners[guild_id], f"{prefix}balance"
+        elif roll < 0.75:
+            yield guild_id, rng.choice(world.user_ids), f"{prefix}rank"
+        elif roll < 0.95:
+            yield guild_id, rng.choice(world.user_ids), f"{prefix}leaderboard"
+        else:
+            yield guild_id, OWNER_ID, f"{prefix}deposit 10"
+
+
+def help_messages(world: World, rng: random.Random) -> Iterator[Message]:
+    while True:
+        guild_id = rng.choice(world.guild_ids)
+        yield guild_id, rng.choice(world.user_ids), f"{world.prefixes[guild_id]}help"
+
+
+SCENARIOS: Dict[str, Callable[[World, random.Random], Iterator[Message]]] = {
+    "prefix": prefix_messages,
+    "custom_commands": custom_command_messages,
+    "economy": economy_messages,
+    "help": help_messages,
+}
+
+
+class BenchmarkBot(AobaDiscordBot):
+    """
+    Aoba with the event handler tasks of each delivered message recorded, so the gateway can wait for them.
+    """
+
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        task = super()._schedule_event(coro, event_name, *args, **kwargs)
+        tasks = delivery_tasks.get()
+        if tasks is not None:
+            tasks.append(task)
+        return task
+
+
+@dataclass
+class ScenarioResult:
+    scenario: str
+    messages: int
+    seconds: float
+    latencies: List[float]
+    db_queries: int
+    replies: int
+
+    @property
+    def messages_per_second(self) -> float:
+        return self.messages / self.seconds
+
+    @property
+    def queries_per_message(self) -> float:
+        return self.db_queries / self.messages
+
+    def latency_percentile(self, percentile: float) -> float:
+        """
+        return: latency in milliseconds below which the given percentage of the messages were handled
+        """
+        latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        return latencies[index] * 1000
+
+
+async def seed_database(database_url: str, world: World, rng: random.Random) -> None:
+    """
+    Recreates the tables and fills them with the guilds, custom commands and balances of the world.
+    """
+    engine = database.create_engine(database.normalize_url(database_url))
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await migrations.upgrade(engine)
+    async with engine.begin() as conn:
+        await conn.execute(
+            AobaGuild.__table__.insert(),
+            [
+                {"guild_id": guild_id, "command_prefix": prefix}
+                for guild_id, prefix in world.prefixes.items()
+            ],
+        )
+        await conn.execute(
+            AobaCommand.__table__.insert(),
+            [
+                {"guild_id": guild_id, "name": f"cmd{index}", "text": f"Text {index}"}
+                for guild_id in world.guild_ids
+                for index in range(CUSTOM_COMMANDS_PER_GUILD)
+            ],
+        )
+        await conn.execute(
+            AobaUser.__table__.insert(),
+            [
+                {"discord_id": user_id, "bank_balance": rng.randrange(10000)}
+                for user_id in world.user_ids
+            ],
+        )
+    await engine.dispose()
+
+
+async def start_bot(
+    database_url: str, world: World
+) -> Tuple[BenchmarkBot, FakeGateway]:
+    """
+    Starts a bot connected to the guilds of the world and waits for it to finish starting up.
+    """
+    bot = BenchmarkBot({}, database_url, command_prefix="!", owner_id=OWNER_ID)
+    gateway = FakeGateway(bot)
+    for guild_id in world.guild_ids:
+        gateway.add_guild(guild_id, world.channel_id(guild_id), world.owners[guild_id])
+    gateway.connect()
+    await bot.startup_complete.wait()
+    economy = bot.get_cog("Economy")
+    while not economy.leaderboard.loaded:
+        await asyncio.sleep(0.01)
+    return bot, gateway
+
+
+def _total_db_queries(bot: AobaDiscordBot) -> int:
+    return int(sum(value for _, _, value in bot.metrics.db_queries.samples()))
+
+
+async def run_scenario(
+    scenario: str,
+    database_url: str,
+    guild_count: int = 5000,
+    user_count: int = 20000,
+    message_count: int = 5000,
+    concurrency: int = 50,
+    warmup: int = 200,
+    seed: int = 0,
+) -> ScenarioResult:
+    """
+    Starts a bot with a fresh database and replays the messages of a scenario.
+    :param scenario: name of the scenario in SCENARIOS
+    :param database_url: url of the database whose tables are recreated, in the format the bot accepts
+    :param guild_count: number of guilds the bot is in
+    :param user_count: number of users sending messages
+    :param message_count: number of messages measured
+    :param concurrency: number of senders, each sends its next message once the previous one was handled
+    :param warmup: messages sent before measuring, so caches are filled like in a running bot
+    :param seed: seed of the generated guilds and messages
+    """
+    rng = random.Random(seed)
+    world = World.generate(guild_count, user_count, rng)
+    await seed_database(database_url, world, rng)
+    bot, gateway = await start_bot(database_url, world)
+    economy = bot.get_cog("Economy")
+
+    messages = SCENARIOS[scenario](world, rng)
+    for _ in range(warmup):
+        await gateway.deliver(*next(messages))
+
+    latencies = list()
+    remaining = iter(range(message_count))
+
+    async def sender():
+        for _ in remaining:
+            latencies.append(await gateway.deliver(*next(messages)))
+
+    queries_before = _total_db_queries(bot)
+    replies_before = gateway.http.sent_messages
+    start = time.perf_counter()
+    await asyncio.gather(*(sender() for _ in range(concurrency)))
+    # Balance changes are written behind, their cost is part of handling the messages
+    await economy.balances.flush()
+    seconds = time.perf_counter() - start
+
+    result = ScenarioResult(
+        scenario=scenario,
+        messages=message_count,
+        seconds=seconds,
+        latencies=latencies,
+        db_queries=_total_db_queries(bot) - queries_before,
+        replies=gateway.http.sent_messages - replies_before,
+    )
+    await bot.close()
+    await bot.db_engine.dispose()
+    return result
+
+
+def format_results(results: List[ScenarioResult]) -> str:
+    lines = [
+        f"{'scenario':<16} {'messages':>8} {'msgs/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'queries/msg':>11} {'replies':>8}"
+    ]
+    for result in results:
+        lines.append(
+            f"{result.scenario:<16} {result.messages:>8} {result.messages_per_second:>9.1f} "
+            f"{result.latency_percentile(50):>8.2f} {result.latency_percentile(99):>8.2f} "
+            f"{result.queries_per_message:>11.3f} {result.replies:>8}"
+        )
+    return "\n".join(lines)
+
+
+@click.command()
+@click.option(
+    "--scenario",
+    "scenarios",
+    type=click.Choice(list(SCENARIOS)),
+    multiple=True,
+    help="Scenario to run, can be repeated, every scenario by default",
+)
+@click.option("--guilds", default=5000, show_default=True, help="Guilds the bot is in")
+@click.option(
+    "--users", default=20000, show_default=True, help="Users sending messages"
+)
+@click.option(
+    "--messages", default=5000, show_default=True, help="Messages measured per scenario"
+)
+@click.option(
+    "--concurrency", default=50, show_default=True, help="Concurrent message senders"
+)
+@click.option(
+    "--warmup", default=200, show_default=True, help="Messages sent before measuring"
+)
+@click.option(
+    "--seed",
+    default=0,
+    show_default=True,
+    help="Seed of the generated guilds and messages",
+)
+@click.option(
+    "--database_url",
+    help="Url of a database to benchmark against, like the bot's, its tables are dropped and recreated. "
+    "A temporary SQLite database is used by default",
+)
+@click.option("--verbose", is_flag=True, help="Show the bot's logs")
+def main(
+    scenarios: Tuple[str, ...],
+    guilds: int,
+    users: int,
+    messages: int,
+    concurrency: int,
+    warmup: int,
+    seed: int,
+    database_url: Optional[str],
+    verbose: bool,
+):
+    """Runs the benchmark scenarios and prints a report."""
+    logging.basicConfig(level=logging.INFO if verbose else logging.WARNING)
+
+    results = list()
+    with tempfile.TemporaryDirectory() as directory:
+        for scenario in scenarios or SCENARIOS:
+            url = database_url or f"sqlite:///{directory}/{scenario}.db"
+            results.append(
+                asyncio.run(
+                    run_scenario(
+                        scenario,
+                        url,
+                        guilds,
+                        users,
+                        messages,
+                        concurrency,
+                        warmup,
+                        seed,
+                    )
+                )
+            )
+    click.echo(format_results(results))
+
+
+if __name__ == "__main__":
+    main()
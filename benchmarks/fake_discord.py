@@ -0,0 +1,190 @@
+"""
+Stand-ins for Discord's gateway and HTTP API, so the bot can be driven with synthetic traffic without a network.
+
+Guilds and messages are created from the same payloads Discord sends over the gateway and parsed by discord.py's
+connection state, so the bot sees the objects it would see in production.
+"""
+import asyncio
+import contextvars
+import itertools
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import discord
+
+# Handler tasks scheduled while the current message is being delivered, collected by FakeGateway.deliver
+delivery_tasks: "contextvars.ContextVar[Optional[List[asyncio.Task]]]" = (
+    contextvars.ContextVar("delivery_tasks", default=None)
+)
+
+_TIMESTAMP = datetime(2022, 1, 1, tzinfo=timezone.utc).isoformat()
+
+
+class FakeHTTP:
+    """
+    Replaces discord.py's HTTP client. Sent messages are recorded instead of reaching Discord.
+    """
+
+    def __init__(self, bot_user: dict):
+        self.bot_user = bot_user
+        self.sent_messages = 0
+        self.sent_characters = 0
+        self.last_content: Optional[str] = None
+        self._message_ids = itertools.count(1 << 60)
+
+    async def send_message(self, channel_id, content, **options) -> dict:
+        self.sent_messages += 1
+        self.sent_characters += len(content or "")
+        self.last_content = content
+        return message_payload(
+            next(self._message_ids), int(channel_id), None, self.bot_user, content
+        )
+
+    async def close(self):
+        pass
+
+
+def user_payload(user_id: int) -> dict:
+    return {
+        "id": str(user_id),
+        "username": f"user{user_id}",
+        "discriminator": f"{user_id % 10000:04}",
+        "avatar": None,
+    }
+
+
+def member_payload(user: dict) -> dict:
+    return {
+        "user": user,
+        "roles": [],
+        "joined_at": _TIMESTAMP,
+        "deaf": False,
+        "mute": False,
+    }
+
+
+def guild_payload(
+    guild_id: int, channel_id: int, owner_id: int, bot_user: dict
+) -> dict:
+    """
+    return: GUILD_CREATE payload of a guild with a single text channel, an @everyone role and the bot as its only
+            cached member
+    """
+    return {
+        "id": str(guild_id),
+        "name": f"guild{guild_id}",
+        "owner_id": str(owner_id),
+        "member_count": 1,
+        "members": [member_payload(bot_user)],
+        "roles": [
+            {
+                "id": str(guild_id),
+                "name": "@everyone",
+                "permissions": "104324673",
+                "position": 0,
+                "color": 0,
+                "hoist": False,
+                "managed": False,
+                "mentionable": False,
+            }
+        ],
+        "channels": [
+            {
+                "id": str(channel_id),
+                "type": 0,
+                "name": "general",
+                "position": 0,
+                "permission_overwrites": [],
+            }
+        ],
+    }
+
+
+def message_payload(
+    message_id: int,
+    channel_id: int,
+    guild_id: Optional[int],
+    author: dict,
+    content: str,
+) -> dict:
+    """
+    return: MESSAGE_CREATE payload of a message sent by an user in a guild channel, or by the bot if guild_id is None
+    """
+    payload = {
+        "id": str(message_id),
+        "channel_id": str(channel_id),
+        "author": author,
+        "content": content,
+        "timestamp": _TIMESTAMP,
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+    }
+    if guild_id is not None:
+        payload["guild_id"] = str(guild_id)
+        payload["member"] = member_payload(author)
+        # Members of messages don't include their user, it's the author
+        del payload["member"]["user"]
+    return payload
+
+
+class FakeGateway:
+    """
+    Connects a bot to fake guilds and delivers messages to it as if they were received from the gateway.
+    """
+
+    def __init__(self, bot, bot_user_id: int = 1):
+        """
+        :param bot: bot whose _schedule_event records the tasks in delivery_tasks, like BenchmarkBot
+        :param bot_user_id: discord id of the bot's user
+        """
+        self.bot = bot
+        self.state = bot._connection
+        self.bot_user = user_payload(bot_user_id)
+        self.http = FakeHTTP(self.bot_user)
+        self.channels: Dict[int, int] = dict()
+        self._message_ids = itertools.count(1 << 50)
+
+        bot.http = self.state.http = self.http
+        self.state.user = discord.ClientUser(state=self.state, data=self.bot_user)
+
+    def add_guild(self, guild_id: int, channel_id: int, owner_id: int) -> None:
+        self.state._add_guild_from_data(
+            guild_payload(guild_id, channel_id, owner_id, self.bot_user)
+        )
+        self.channels[guild_id] = channel_id
+
+    def connect(self) -> None:
+        """
+        Marks the bot as ready, like the READY event once every guild was received.
+        """
+        self.bot._ready.set()
+
+    async def deliver(self, guild_id: int, author_id: int, content: str) -> float:
+        """
+        Delivers a message sent in a guild and waits for every event handler it triggered to finish.
+        return: seconds between receiving the message and its handlers finishing
+        """
+        data = message_payload(
+            next(self._message_ids),
+            self.channels[guild_id],
+            guild_id,
+            user_payload(author_id),
+            content,
+        )
+        tasks = list()
+        token = delivery_tasks.set(tasks)
+        start = time.perf_counter()
+        try:
+            self.state.parse_message_create(data)
+        finally:
+            delivery_tasks.reset(token)
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - start
@@ -64,9 +64,12 @@ setup(
     entry_points={
         "console_scripts": [
             "aoba_discord_bot=aoba_discord_bot.cli:main",
+            "aoba_discord_bot_cluster=aoba_discord_bot.cluster:main",
+            "aoba_discord_bot_migrate=aoba_discord_bot.migrations:main",
         ],
     },
     install_requires=requirements,
+    extras_require={"sqlite": ["aiosqlite>=0.17.0"]},
     license="MIT license",
     long_description=readme + "\n\n" + history,
     long_description_content_type="text/x-rst",
@@ -0,0 +1,40 @@
+"""Tests for the admin cog in `aoba_discord_bot.cogs.admin.admin_cog`."""
+
+import asyncio
+import random
+
+from aoba_discord_bot import repository
+from benchmarks.bot_benchmark import World, seed_database, start_bot
+
+
+def test_custom_command_cannot_shadow_a_bot_command(tmp_path):
+    async def run():
+        database_url = f"sqlite:///{tmp_path}/admin.db"
+        rng = random.Random(0)
+        world = World.generate(guild_count=1, user_count=3, rng=rng)
+        world.prefixes = dict.fromkeys(world.guild_ids, "!")
+        await seed_database(database_url, world, rng)
+        bot, gateway = await start_bot(database_url, world)
+        guild_id = world.guild_ids[0]
+        owner_id = world.owners[guild_id]
+
+        await gateway.deliver(guild_id, owner_id, '!custom_cmd add help "Not help"')
+        rejected = gateway.http.last_content
+        await gateway.deliver(guild_id, owner_id, '!custom_cmd add hello "Hello!"')
+        added = gateway.http.last_content
+        async with bot.Session() as session:
+            help_command = await repository.get_command(session, guild_id, "help")
+        registered = (guild_id, "help") in bot.custom_commands
+
+        await bot.close()
+        await bot.db_engine.dispose()
+        return rejected, added, help_command, registered
+
+    rejected, added, help_command, registered = asyncio.run(run())
+
+    assert (
+        rejected == "Error adding command `help`, a bot command already has this name"
+    )
+    assert added == "Command `hello` was successfully added!"
+    assert help_command is None
+    assert not registered
@@ -0,0 +1,115 @@
+"""Tests for the balance write-behind buffer in `aoba_discord_bot.cogs.economy.balance_accumulator`."""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from aoba_discord_bot import database, migrations, repository
+from aoba_discord_bot.cogs.economy.balance_accumulator import BalanceAccumulator
+
+
+def test_changes_stay_pending_until_the_flush_commits(tmp_path):
+    async def run():
+        engine = database.create_engine(
+            database.normalize_url(f"sqlite:///{tmp_path}/aoba.db")
+        )
+        await migrations.upgrade(engine)
+        Session = async_sessionmaker(engine, expire_on_commit=False)
+        writing = asyncio.Event()
+        commit = asyncio.Event()
+
+        @asynccontextmanager
+        async def session_scope():
+            async with Session() as session:
+                async with session.begin():
+                    yield session
+                    # Holds the write open so the test can read the balances during it
+                    writing.set()
+                    await commit.wait()
+
+        accumulator = BalanceAccumulator(session_scope)
+        accumulator.add(1, 5)
+        flush = asyncio.ensure_future(accumulator.flush())
+        await writing.wait()
+        accumulator.add(1, 2)
+        during_flush = accumulator.pending(1), accumulator.stats()["in_flight_users"]
+
+        commit.set()
+        await flush
+        after_flush = accumulator.pending(1)
+        async with Session() as session:
+            balance = (await repository.get_user(session, 1)).bank_balance
+        await engine.dispose()
+        return during_flush, after_flush, balance
+
+    during_flush, after_flush, balance = asyncio.run(run())
+
+    assert during_flush == (7, 1)
+    assert after_flush == 2
+    assert balance == 5
+
+
+def test_changes_are_merged_per_user_and_flushed_at_the_flush_size(tmp_path):
+    async def run():
+        engine = database.create_engine(
+            database.normalize_url(f"sqlite:///{tmp_path}/aoba.db")
+        )
+        await migrations.upgrade(engine)
+        Session = async_sessionmaker(engine, expire_on_commit=False)
+
+        @asynccontextmanager
+        async def session_scope():
+            async with Session() as session:
+                async with session.begin():
+                    yield session
+
+        flushed = list()
+        accumulator = BalanceAccumulator(
+            session_scope, flush_size=2, on_flush=flushed.append
+        )
+        accumulator.add(1, 5)
+        accumulator.add(1, 3)
+        merged = accumulator.stats()["backlog_users"]
+        # The second user reaches the flush size
+        accumulator.add(2, 1)
+        await accumulator._flush_task
+        async with Session() as session:
+            ledger = await session.execute(
+                text("SELECT discord_id, amount FROM ledger ORDER BY discord_id")
+            )
+            ledger = ledger.all()
+        await engine.dispose()
+        return merged, flushed, ledger
+
+    merged, flushed, ledger = asyncio.run(run())
+
+    assert merged == 1
+    assert flushed == [{1: 8, 2: 1}]
+    assert ledger == [(1, 8), (2, 1)]
+
+
+def test_changes_stay_pending_when_the_flush_fails():
+    class WriteFailed(Exception):
+        pass
+
+    @asynccontextmanager
+    async def failing_session_scope():
+        raise WriteFailed
+        yield
+
+    async def run():
+        accumulator = BalanceAccumulator(failing_session_scope)
+        accumulator.add(1, 5)
+        try:
+            await accumulator.flush()
+        except WriteFailed:
+            pass
+        accumulator.add(1, 2)
+        return accumulator.pending(1), accumulator.stats()
+
+    pending, stats = asyncio.run(run())
+
+    assert pending == 7
+    assert (stats["failed_flushes"], stats["in_flight_users"]) == (1, 0)
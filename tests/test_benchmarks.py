@@ -0,0 +1,28 @@
+"""Smoke test of the offline benchmark harness in `benchmarks`."""
+
+import asyncio
+
+import pytest
+
+from benchmarks.bot_benchmark import SCENARIOS, run_scenario
+
+
+@pytest.mark.parametrize("scenario", list(SCENARIOS))
+def test_scenario_runs_offline(scenario, tmp_path):
+    result = asyncio.run(
+        run_scenario(
+            scenario,
+            f"sqlite:///{tmp_path}/benchmark.db",
+            guild_count=20,
+            user_count=50,
+            message_count=40,
+            concurrency=4,
+            warmup=10,
+        )
+    )
+
+    assert result.messages == len(result.latencies) == 40
+    assert result.messages_per_second > 0
+    if scenario != "prefix":
+        # Every message of the other scenarios is a command that replies
+        assert result.replies == 40
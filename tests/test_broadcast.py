@@ -0,0 +1,119 @@
+"""Tests for the owner announcements sent by `aoba_discord_bot.broadcast`."""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, List
+
+import aiohttp
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from aoba_discord_bot import database, migrations, repository
+from aoba_discord_bot.broadcast import Broadcast
+from aoba_discord_bot.db_models import AobaBroadcast
+
+
+class FakeChannel:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.sent: List[str] = list()
+        # Cleared to hold the send until the test sets it
+        self.released = asyncio.Event()
+        self.released.set()
+
+    async def send(self, text: str):
+        await self.released.wait()
+        if self.fail:
+            raise aiohttp.ClientConnectionError("connection reset")
+        self.sent.append(text)
+
+
+class FakeBot:
+    cluster = None
+
+    def __init__(self, engine, channels: Dict[int, FakeChannel]):
+        self.db_engine = engine
+        self.Session = async_sessionmaker(engine, expire_on_commit=False)
+        self.channels = channels
+
+    def get_channel(self, channel_id: int):
+        return self.channels.get(channel_id)
+
+    @asynccontextmanager
+    async def session_scope(self):
+        async with self.Session() as session:
+            async with session.begin():
+                yield session
+
+
+async def _fake_bot(tmp_path, channels):
+    engine = database.create_engine(
+        database.normalize_url(f"sqlite:///{tmp_path}/aoba.db")
+    )
+    await migrations.upgrade(engine)
+    return FakeBot(engine, channels)
+
+
+async def _no_progress(broadcast):
+    pass
+
+
+def test_unexpected_errors_fail_only_their_target(tmp_path):
+    async def run():
+        channels = {10: FakeChannel(), 20: FakeChannel(fail=True), 30: FakeChannel()}
+        bot = await _fake_bot(tmp_path, channels)
+        async with bot.session_scope() as session:
+            record = AobaBroadcast(text="hello")
+            session.add(record)
+
+        broadcast = Broadcast(bot, record, [(1, 10), (2, 20), (3, 30)])
+        await asyncio.wait_for(broadcast.run(_no_progress), timeout=5)
+        async with bot.Session() as session:
+            saved = await repository.get_broadcast(session, record.id)
+        await bot.db_engine.dispose()
+        return channels, broadcast, saved
+
+    channels, broadcast, saved = asyncio.run(run())
+
+    assert channels[10].sent == channels[30].sent == ["hello"]
+    assert broadcast.failures == [(2, "ClientConnectionError: connection reset")]
+    assert (saved.sent, saved.failed, saved.finished) == (2, 1, True)
+
+
+def test_resumed_broadcast_skips_targets_finished_out_of_order(tmp_path):
+    async def run():
+        channels = {guild_id * 10: FakeChannel() for guild_id in range(1, 6)}
+        # The first target is still being sent when the broadcast is interrupted
+        channels[10].released.clear()
+        bot = await _fake_bot(tmp_path, channels)
+        async with bot.session_scope() as session:
+            record = AobaBroadcast(text="hello")
+            session.add(record)
+
+        targets = [(guild_id, guild_id * 10) for guild_id in range(1, 6)]
+        task = asyncio.ensure_future(Broadcast(bot, record, targets).run(_no_progress))
+        while sum(len(channel.sent) for channel in channels.values()) < 4:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        async with bot.Session() as session:
+            interrupted = await repository.get_unfinished_broadcast(session)
+        channels[10].released.set()
+        resumed = Broadcast(
+            bot,
+            interrupted,
+            [target for target in targets if target[0] > (interrupted.cursor or 0)],
+        )
+        await asyncio.wait_for(resumed.run(_no_progress), timeout=5)
+        async with bot.Session() as session:
+            saved = await repository.get_broadcast(session, record.id)
+        await bot.db_engine.dispose()
+        return channels, interrupted, resumed, saved
+
+    channels, interrupted, resumed, saved = asyncio.run(run())
+
+    assert interrupted.processed_guild_ids == "2,3,4,5"
+    assert resumed.targets == [(1, 10)]
+    assert all(channel.sent == ["hello"] for channel in channels.values())
+    assert (saved.sent, saved.failed, saved.finished) == (5, 0, True)
+    assert saved.cursor == 1 and saved.processed_guild_ids == "2,3,4,5"
@@ -0,0 +1,93 @@
+"""Tests for the in-memory caches in `aoba_discord_bot.caches`."""
+
+from aoba_discord_bot import caches
+from aoba_discord_bot.caches import (
+    AnnouncementChannelIndex,
+    CustomCommandRegistry,
+    PrefixCache,
+    TTLCache,
+)
+
+
+def test_prefix_cache_hits_and_misses():
+    cache = PrefixCache()
+    cache.warm([(1, "?"), (2, "$")])
+
+    assert cache.get(1) == "?"
+    assert cache.get(3) == "!"
+    assert cache.stats() == {"size": 2, "hits": 1, "misses": 1}
+
+
+def test_prefix_cache_write_through():
+    cache = PrefixCache()
+    cache.set(1, ">")
+    assert cache.get(1) == ">"
+
+    cache.remove(1)
+    assert cache.get(1) == "!"
+
+
+def test_custom_commands_are_isolated_per_guild():
+    registry = CustomCommandRegistry()
+    registry.load([(1, "hello", "Hello from guild 1")])
+    registry.add(2, "hello", "Hello from guild 2")
+
+    assert registry.get(1, "hello") == "Hello from guild 1"
+    assert registry.get(2, "hello") == "Hello from guild 2"
+    assert registry.get(3, "hello") is None
+
+    assert registry.remove(1, "hello")
+    assert not registry.remove(1, "hello")
+    assert (2, "hello") in registry
+
+
+def test_announcement_channels_follow_changes_and_deleted_channels():
+    index = AnnouncementChannelIndex()
+    index.warm([(3, 30), (1, 10)])
+    index.set(2, 20)
+    # Replacing a channel forgets the old one
+    index.set(1, 11)
+
+    assert index.get(1) == 11
+    assert index.remove_channel(10) is None
+    assert index.remove_channel(20) == 2
+    assert index.get(2) is None
+    assert index.targets() == [(1, 11), (3, 30)]
+    assert index.targets(after_guild_id=1) == [(3, 30)]
+
+    index.remove(3)
+    assert index.remove_channel(30) is None
+    assert index.stats() == {"size": 1}
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_ttl_cache_expires_entries(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(caches.time, "monotonic", lambda: now)
+    cache = TTLCache(max_size=2, ttl=10)
+    cache.set("a", 1)
+
+    now += 11
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_custom_commands_removed_with_their_guild():
+    registry = CustomCommandRegistry()
+    registry.load([(1, "hello", "Hello"), (1, "bye", "Bye"), (2, "hello", "Hi")])
+
+    registry.remove_guild(1)
+    assert len(registry) == 1
+    assert registry.get(2, "hello") == "Hi"
@@ -0,0 +1,53 @@
+"""Tests for the multi-process cluster in `aoba_discord_bot.cluster`."""
+
+import asyncio
+import threading
+from multiprocessing import Pipe
+from multiprocessing.connection import wait
+from types import SimpleNamespace
+
+from aoba_discord_bot.cluster import ClusterClient, ClusterSupervisor, split_shards
+
+
+def test_split_shards():
+    assert split_shards(10, 3) == [range(0, 4), range(4, 7), range(7, 10)]
+    assert split_shards(4, 4) == [range(i, i + 1) for i in range(4)]
+
+
+def test_requests_are_answered_by_every_cluster():
+    supervisor = ClusterSupervisor(shard_count=4, cluster_count=2, bot_args=[])
+    clients = list()
+    for cluster in supervisor.clusters:
+        supervisor_connection, cluster_connection = Pipe()
+        # Stand-in for the cluster process, the clients run in this process
+        cluster.process = SimpleNamespace()
+        cluster.connection = supervisor_connection
+        clients.append(ClusterClient(cluster.cluster_id, cluster_connection))
+
+    stopped = threading.Event()
+
+    def relay():
+        connections = {cluster.connection: cluster for cluster in supervisor.clusters}
+        while not stopped.is_set():
+            for ready in wait(list(connections), 0.05):
+                supervisor._receive(connections[ready])
+
+    async def run():
+        for client in clients:
+            client.start(asyncio.get_event_loop())
+
+            async def cluster_id(client=client):
+                return client.cluster_id
+
+            client.register("cluster_id", cluster_id)
+        return await clients[1].request("cluster_id")
+
+    relay_thread = threading.Thread(target=relay)
+    relay_thread.start()
+    try:
+        results = asyncio.run(run())
+    finally:
+        stopped.set()
+        relay_thread.join()
+
+    assert sorted(results) == [0, 1]
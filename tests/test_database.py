@@ -0,0 +1,73 @@
+"""Tests for the database backends in `aoba_discord_bot.database`."""
+
+import asyncio
+
+import pytest
+from sqlalchemy import text
+
+from aoba_discord_bot import database
+from aoba_discord_bot.db_models import Base
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("postgres://u:p@host/aoba", "postgresql+asyncpg://u:p@host/aoba"),
+        ("postgresql://u:p@host/aoba", "postgresql+asyncpg://u:p@host/aoba"),
+        ("postgresql+psycopg2://u:p@host/aoba", "postgresql+asyncpg://u:p@host/aoba"),
+        ("sqlite:///aoba.db", "sqlite+aiosqlite:///aoba.db"),
+        ("sqlite+aiosqlite://", "sqlite+aiosqlite://"),
+    ],
+)
+def test_normalize_url(url, expected):
+    assert database.normalize_url(url) == expected
+
+
+@pytest.mark.parametrize("url", ["mysql://u:p@host/aoba", "aoba.db"])
+def test_normalize_url_unsupported(url):
+    with pytest.raises(ValueError):
+        database.normalize_url(url)
+
+
+def test_sqlite_engine_uses_wal(tmp_path):
+    async def run():
+        engine = database.create_engine(
+            database.normalize_url(f"sqlite:///{tmp_path}/aoba.db"), pool_size=3
+        )
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            journal_mode = (await conn.execute(text("PRAGMA journal_mode"))).scalar()
+        await engine.dispose()
+        return journal_mode
+
+    assert asyncio.run(run()).lower() == "wal"
+
+
+def test_in_memory_sqlite_engine_shares_its_database():
+    async def run():
+        engine = database.create_engine(database.normalize_url("sqlite://"))
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with engine.connect() as conn:
+            tables = (
+                await conn.execute(text("SELECT name FROM sqlite_master"))
+            ).scalars()
+            names = set(tables)
+        await engine.dispose()
+        return names
+
+    assert "guild" in asyncio.run(run())
+
+
+@pytest.mark.parametrize("pool_size, max_overflow", [(0, 0), (5, -1)])
+def test_pool_stats_of_unbounded_pool(pool_size, max_overflow):
+    engine = database.create_engine(
+        database.normalize_url("postgres://u:p@localhost/aoba"),
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+    )
+
+    stats = database.pool_stats(engine)
+
+    assert engine.sync_engine.pool.capacity() == 0
+    assert stats["saturation"] == 0.0
@@ -0,0 +1,172 @@
+"""Tests for the economy cog in `aoba_discord_bot.cogs.economy.economy_cog`."""
+
+import asyncio
+import gc
+import random
+import time
+from types import SimpleNamespace
+
+from aoba_discord_bot import repository
+from aoba_discord_bot.cogs.economy.economy_cog import Economy
+from benchmarks.bot_benchmark import OWNER_ID, World, seed_database, start_bot
+
+
+async def _start_bot(tmp_path, guild_count=1, user_count=3):
+    database_url = f"sqlite:///{tmp_path}/economy.db"
+    rng = random.Random(0)
+    world = World.generate(guild_count=guild_count, user_count=user_count, rng=rng)
+    await seed_database(database_url, world, rng)
+    bot, gateway = await start_bot(database_url, world)
+    return bot, gateway, world
+
+
+def test_closing_the_bot_closes_the_economy_once(tmp_path):
+    errors = list()
+
+    async def run():
+        asyncio.get_event_loop().set_exception_handler(
+            lambda loop, context: errors.append(context)
+        )
+        bot, _, _ = await _start_bot(tmp_path)
+        economy = bot.get_cog("Economy")
+        await bot.close()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        gc.collect()
+        await bot.db_engine.dispose()
+        return economy
+
+    economy = asyncio.run(run())
+
+    assert errors == []
+    assert economy.invalidations.peers == []
+
+
+def test_unloading_the_economy_closes_it_once(tmp_path):
+    errors = list()
+
+    async def run():
+        asyncio.get_event_loop().set_exception_handler(
+            lambda loop, context: errors.append(context)
+        )
+        bot, _, _ = await _start_bot(tmp_path)
+        economy = bot.get_cog("Economy")
+        bot.unload_extension("aoba_discord_bot.cogs.economy.economy_cog")
+        hooks_after_unload = list(bot.shutdown_hooks)
+        await bot.close()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        gc.collect()
+        await bot.db_engine.dispose()
+        return economy, hooks_after_unload
+
+    economy, hooks_after_unload = asyncio.run(run())
+
+    assert errors == []
+    assert economy.balances.close not in hooks_after_unload
+    assert economy.invalidations.peers == []
+
+
+def test_chat_rewards_expire_oldest_first(tmp_path):
+    async def run():
+        bot, _, world = await _start_bot(tmp_path)
+        economy = bot.get_cog("Economy")
+        # Keeps the rewards pending to read them
+        economy.balances.flush_size = 100000
+        guild = bot.get_guild(world.guild_ids[0])
+
+        def message(author_id):
+            return SimpleNamespace(
+                author=SimpleNamespace(id=author_id, bot=False), guild=guild
+            )
+
+        for author_id in range(1, 20001):
+            await economy.on_message(message(author_id))
+        # Rewarded again within the cooldown
+        await economy.on_message(message(1))
+        # The first two users' cooldowns are over
+        expired = time.monotonic() - economy.ACTIVITY_COOLDOWN
+        economy._last_rewarded[1] = economy._last_rewarded[2] = expired
+        await economy.on_message(message(1))
+        rewarded = list(economy._last_rewarded)
+        pending = economy.balances.pending(1), economy.balances.pending(3)
+
+        await bot.close()
+        await bot.db_engine.dispose()
+        return rewarded, pending
+
+    rewarded, pending = asyncio.run(run())
+
+    assert rewarded[0] == 3 and rewarded[-1] == 1
+    assert len(rewarded) == 19999
+    assert pending == (2 * Economy.ACTIVITY_REWARD, Economy.ACTIVITY_REWARD)
+
+
+def test_balance_changes_reach_the_leaderboards_of_other_processes(tmp_path):
+    async def run():
+        database_url = f"sqlite:///{tmp_path}/economy.db"
+        rng = random.Random(0)
+        world = World.generate(guild_count=1, user_count=3, rng=rng)
+        await seed_database(database_url, world, rng)
+        bots = [(await start_bot(database_url, world)) for _ in range(2)]
+        economies = [bot.get_cog("Economy") for bot, _ in bots]
+        # Both processes share the channel, like two clusters connected to one database
+        peers = [economy.invalidations for economy in economies]
+        for economy in economies:
+            economy.invalidations.peers = peers
+
+        guild_id = world.guild_ids[0]
+        await bots[0][1].deliver(guild_id, OWNER_ID, "!deposit 1000000")
+        for _ in range(100):
+            if economies[1].leaderboard.top(1)[0][0] == OWNER_ID:
+                break
+            await asyncio.sleep(0.01)
+        tops = [economy.leaderboard.top(1) for economy in economies]
+
+        # Changes published while the channel was disconnected were missed
+        async with bots[1][0].session_scope() as session:
+            await repository.change_balance(session, world.user_ids[0], 2000000)
+        economies[1].invalidations._deliver(Economy.USER_CACHE_TOPIC, None)
+        await economies[1]._leaderboard_load
+        reloaded_top = economies[1].leaderboard.top(1)
+
+        for bot, _ in bots:
+            await bot.close()
+            await bot.db_engine.dispose()
+        return world, tops, reloaded_top
+
+    world, tops, reloaded_top = asyncio.run(run())
+
+    assert tops[0] == tops[1] == [(OWNER_ID, tops[0][0][1])]
+    assert reloaded_top[0][0] == world.user_ids[0]
+
+
+def test_failed_leaderboard_loads_are_retried(tmp_path, monkeypatch, caplog):
+    iter_balances = repository.iter_balances
+    attempts = list()
+
+    def failing_iter_balances(session):
+        attempts.append(session)
+        if len(attempts) <= 2:
+            raise ConnectionError("database unavailable")
+        return iter_balances(session)
+
+    monkeypatch.setattr(repository, "iter_balances", failing_iter_balances)
+    monkeypatch.setattr(Economy, "LEADERBOARD_RETRY_DELAY", 0.01)
+
+    async def run():
+        bot, gateway, world = await _start_bot(tmp_path)
+        economy = bot.get_cog("Economy")
+        await gateway.deliver(world.guild_ids[0], world.user_ids[0], "!rank")
+        response = gateway.http.last_content
+        loaded_users = len(economy.leaderboard)
+        await bot.close()
+        await bot.db_engine.dispose()
+        return world, response, loaded_users
+
+    world, response, loaded_users = asyncio.run(run())
+
+    assert len(attempts) == 3
+    assert caplog.text.count("Failed to load the leaderboard") == 2
+    assert loaded_users == len(world.user_ids)
+    assert "is ranked #" in response
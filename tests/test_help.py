@@ -0,0 +1,45 @@
+"""Tests for the cached help pages of `aoba_discord_bot.cogs.user.user_cog.AobaHelp`."""
+
+import asyncio
+import random
+
+from benchmarks.bot_benchmark import World, seed_database, start_bot
+
+
+def test_help_is_rendered_once_per_prefix_and_command_set(tmp_path):
+    async def run():
+        database_url = f"sqlite:///{tmp_path}/help.db"
+        rng = random.Random(0)
+        world = World.generate(guild_count=2, user_count=5, rng=rng)
+        world.prefixes = dict.fromkeys(world.guild_ids, "!")
+        await seed_database(database_url, world, rng)
+        bot, gateway = await start_bot(database_url, world)
+        help_pages = bot.get_cog("User").help_pages
+        first_guild, second_guild = world.guild_ids
+        # A member who isn't an administrator of either guild sees the same commands in both
+        user_id = next(
+            user_id
+            for user_id in world.user_ids
+            if user_id not in world.owners.values()
+        )
+
+        await gateway.deliver(first_guild, user_id, "!help")
+        rendered = gateway.http.last_content
+        await gateway.deliver(second_guild, user_id, "!help")
+        assert gateway.http.last_content == rendered
+        assert (help_pages.hits, help_pages.misses) == (1, 1)
+
+        # A new prefix and a new command each render the pages again
+        bot.prefix_cache.set(second_guild, "?")
+        await gateway.deliver(second_guild, user_id, "?help")
+        assert "?escape_markdown" in gateway.http.last_content
+        bot.remove_command("escape_markdown")
+        await gateway.deliver(first_guild, user_id, "!help")
+        assert "escape_markdown" not in gateway.http.last_content
+        assert "escape_markdown" in rendered
+        assert help_pages.misses == 3
+
+        await bot.close()
+        await bot.db_engine.dispose()
+
+    asyncio.run(run())
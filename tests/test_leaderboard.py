@@ -0,0 +1,107 @@
+"""Tests for the economy leaderboard in `aoba_discord_bot.cogs.economy.leaderboard`."""
+
+import asyncio
+import random
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from aoba_discord_bot import database, migrations, repository
+from aoba_discord_bot.cogs.economy.leaderboard import Leaderboard
+from aoba_discord_bot.db_models import AobaUser
+
+
+def test_leaderboard_ranks_by_balance():
+    leaderboard = Leaderboard()
+    leaderboard.load([(1, 10), (2, 30), (3, 20)])
+
+    assert leaderboard.top(2) == [(2, 30), (3, 20)]
+    assert leaderboard.rank(1) == 3
+    assert leaderboard.rank(4) is None
+
+
+def test_leaderboard_updates_keep_order():
+    leaderboard = Leaderboard()
+    leaderboard.load([(1, 10), (2, 30)])
+    leaderboard.update(1, 50)
+    leaderboard.update(3, 40)
+
+    assert leaderboard.top(3) == [(1, 50), (3, 40), (2, 30)]
+    assert leaderboard.rank(2) == 3
+
+
+def test_leaderboard_keeps_updates_made_while_loading():
+    leaderboard = Leaderboard()
+    leaderboard.update(1, 100)
+    leaderboard.load([(1, 10), (2, 30)])
+
+    assert leaderboard.top(1) == [(1, 100)]
+
+
+def test_leaderboard_is_served_and_updated_while_reloading():
+    leaderboard = Leaderboard()
+    leaderboard.load([(1, 10), (2, 30)])
+    leaderboard.start_loading()
+    leaderboard.load_chunk([(1, 10), (2, 30), (3, 20)])
+    leaderboard.update(1, 50)
+    served = leaderboard.top(3)
+    leaderboard.finish_loading()
+
+    assert served == [(1, 50), (2, 30)]
+    assert leaderboard.top(3) == [(1, 50), (2, 30), (3, 20)]
+
+
+def test_leaderboard_matches_a_sorted_table_of_many_users():
+    rng = random.Random(0)
+    balances = {discord_id: rng.randrange(-100, 1000) for discord_id in range(200000)}
+    leaderboard = Leaderboard()
+    leaderboard.load(balances.items())
+
+    # A burst of rewards, including new users, moves entries between buckets and splits them
+    for _ in range(20000):
+        discord_id = rng.randrange(210000)
+        balances[discord_id] = balances.get(discord_id, 0) + rng.randrange(1, 50)
+        leaderboard.update(discord_id, balances[discord_id])
+    # Users leaving the top empty the first buckets
+    for discord_id, balance in sorted(balances.items(), key=lambda item: -item[1])[
+        :3000
+    ]:
+        balances[discord_id] = -1000
+        leaderboard.update(discord_id, -1000)
+
+    ranking = sorted(balances.items(), key=lambda item: (-item[1], item[0]))
+    assert len(leaderboard) == len(balances)
+    assert leaderboard.top(25) == ranking[:25]
+    for position in [0, 1, 999, 1000, 1001, 65432, len(ranking) - 1]:
+        assert leaderboard.rank(ranking[position][0]) == position + 1
+
+
+def test_leaderboard_is_loaded_in_chunks_from_the_database(tmp_path):
+    async def run():
+        engine = database.create_engine(
+            database.normalize_url(f"sqlite:///{tmp_path}/aoba.db")
+        )
+        await migrations.upgrade(engine)
+        async with engine.begin() as conn:
+            await conn.execute(
+                AobaUser.__table__.insert(),
+                [
+                    {"discord_id": discord_id, "bank_balance": discord_id % 97}
+                    for discord_id in range(1, 2501)
+                ],
+            )
+
+        leaderboard = Leaderboard()
+        chunk_sizes = list()
+        async with AsyncSession(engine) as session:
+            async for balances in repository.iter_balances(session, chunk_size=1000):
+                chunk_sizes.append(len(balances))
+                leaderboard.load_chunk(balances)
+        leaderboard.finish_loading()
+        await engine.dispose()
+        return leaderboard, chunk_sizes
+
+    leaderboard, chunk_sizes = asyncio.run(run())
+
+    assert chunk_sizes == [1000, 1000, 500]
+    assert len(leaderboard) == 2500
+    assert leaderboard.top(2) == [(96, 96), (193, 96)]
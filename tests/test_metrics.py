@@ -0,0 +1,68 @@
+"""Tests for the metrics in `aoba_discord_bot.metrics`."""
+
+import asyncio
+from types import SimpleNamespace
+
+from aoba_discord_bot.metrics import (
+    BotMetrics,
+    Counter,
+    Histogram,
+    MetricsRegistry,
+    current_command,
+)
+
+
+def test_counter_rendering_escapes_labels():
+    counter = Counter("aoba_test_total", "Test counter", ["name"])
+    counter.inc('say "hi"')
+    counter.inc('say "hi"', amount=2)
+
+    assert counter.render() == [
+        "# HELP aoba_test_total Test counter",
+        "# TYPE aoba_test_total counter",
+        'aoba_test_total{name="say \\"hi\\""} 3.0',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.register(
+        Histogram("aoba_test_seconds", "Test histogram", buckets=(0.1, 1.0))
+    )
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+
+    lines = registry.render().splitlines()
+    assert 'aoba_test_seconds_bucket{le="0.1"} 1.0' in lines
+    assert 'aoba_test_seconds_bucket{le="1.0"} 3.0' in lines
+    assert 'aoba_test_seconds_bucket{le="+Inf"} 4.0' in lines
+    assert "aoba_test_seconds_sum 6.05" in lines
+    assert "aoba_test_seconds_count 4.0" in lines
+
+
+def test_track_command_records_outcome_and_context():
+    metrics = BotMetrics(bot=None)
+    ctx = SimpleNamespace(
+        command=SimpleNamespace(qualified_name="balance"),
+        command_failed=False,
+        author="aoba#0001",
+        guild=None,
+    )
+
+    async def invoke():
+        with metrics.track_command(ctx):
+            assert current_command.get() == "balance"
+            task = asyncio.current_task()
+            assert metrics.describe_task(task) == (
+                "command balance invoked by aoba#0001 in a DM"
+            )
+        assert metrics.describe_task(task) is None
+
+    asyncio.run(invoke())
+    ctx.command_failed = True
+    asyncio.run(invoke())
+
+    assert current_command.get() == ""
+    assert metrics.commands.value("balance", "success") == 1
+    assert metrics.commands.value("balance", "error") == 1
+    assert metrics.command_duration.count("balance") == 2
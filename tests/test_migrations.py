@@ -0,0 +1,159 @@
+"""Tests for the schema migrations in `aoba_discord_bot.migrations`."""
+
+import asyncio
+
+from sqlalchemy import inspect, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from aoba_discord_bot import database, migrations, repository
+from aoba_discord_bot.db_models import AobaCommand, AobaGuild
+
+
+def _engine(tmp_path):
+    return database.create_engine(
+        database.normalize_url(f"sqlite:///{tmp_path}/aoba.db")
+    )
+
+
+def test_new_database_is_migrated_to_the_latest_version(tmp_path):
+    async def run():
+        engine = _engine(tmp_path)
+        assert await migrations.get_schema_version(engine) == 0
+        applied = await migrations.upgrade(engine)
+        version = await migrations.get_schema_version(engine)
+        # Already up to date
+        applied_again = await migrations.upgrade(engine)
+        await engine.dispose()
+        return applied, version, applied_again
+
+    applied, version, applied_again = asyncio.run(run())
+
+    assert applied == [migration.version for migration in migrations.MIGRATIONS]
+    assert version == migrations.SCHEMA_VERSION
+    assert applied_again == []
+
+
+def test_old_schema_gets_indexes_and_duplicate_commands_are_removed(tmp_path):
+    async def run():
+        engine = _engine(tmp_path)
+        async with engine.begin() as conn:
+            # Tables as created by versions of the bot before migrations
+            await conn.execute(
+                text(
+                    "CREATE TABLE guild (guild_id BIGINT PRIMARY KEY, command_prefix VARCHAR, "
+                    "announcement_channel_id BIGINT)"
+                )
+            )
+            await conn.execute(
+                text(
+                    "CREATE TABLE command (id INTEGER PRIMARY KEY, name VARCHAR, text VARCHAR, "
+                    "guild_id BIGINT REFERENCES guild (guild_id))"
+                )
+            )
+            await conn.execute(
+                text(
+                    "CREATE TABLE aobauser (discord_id BIGINT PRIMARY KEY, bank_balance INTEGER)"
+                )
+            )
+            await conn.execute(text("INSERT INTO guild VALUES (1, '!', NULL)"))
+            await conn.execute(
+                text(
+                    "INSERT INTO command (name, text, guild_id) "
+                    "VALUES ('hi', 'old', 1), ('hi', 'new', 1), ('bye', 'bye', 1)"
+                )
+            )
+
+        await migrations.upgrade(engine)
+
+        async with engine.connect() as conn:
+            commands = (
+                await conn.execute(select(AobaCommand.name, AobaCommand.text))
+            ).all()
+            indexes = await conn.run_sync(
+                lambda sync_conn: {
+                    table: {
+                        index["name"] for index in inspect(sync_conn).get_indexes(table)
+                    }
+                    for table in ("guild", "command", "aobauser", "ledger")
+                }
+            )
+        await engine.dispose()
+        return commands, indexes
+
+    commands, indexes = asyncio.run(run())
+
+    assert sorted(commands) == [("bye", "bye"), ("hi", "new")]
+    assert "ix_command_guild_id_name" in indexes["command"]
+    assert "ix_aobauser_bank_balance" in indexes["aobauser"]
+    assert "ix_guild_announcement_channel" in indexes["guild"]
+    # Missing tables are created with their indexes
+    assert "ix_ledger_discord_id" in indexes["ledger"]
+
+
+def test_announcement_channels_are_read_from_the_partial_index(tmp_path):
+    async def run():
+        engine = _engine(tmp_path)
+        await migrations.upgrade(engine)
+        async with engine.begin() as conn:
+            await conn.execute(
+                AobaGuild.__table__.insert(),
+                [
+                    {"guild_id": 1, "announcement_channel_id": 10},
+                    {"guild_id": 2, "announcement_channel_id": None},
+                    {"guild_id": 3, "announcement_channel_id": 30},
+                ],
+            )
+
+        async with AsyncSession(engine) as session:
+            channels = await repository.get_announcement_channels(session)
+            query = select(AobaGuild.guild_id, AobaGuild.announcement_channel_id).where(
+                AobaGuild.announcement_channel_id.isnot(None),
+                AobaGuild.guild_id > 1,
+            )
+            plan = (
+                await session.execute(
+                    text(
+                        "EXPLAIN QUERY PLAN "
+                        + str(
+                            query.compile(
+                                engine.sync_engine,
+                                compile_kwargs={"literal_binds": True},
+                            )
+                        )
+                    )
+                )
+            ).all()
+        await engine.dispose()
+        return channels, plan
+
+    channels, plan = asyncio.run(run())
+
+    assert channels == [(1, 10), (3, 30)]
+    assert any("ix_guild_announcement_channel" in row[-1] for row in plan)
+
+
+def test_old_broadcast_table_gets_processed_guild_ids(tmp_path):
+    async def run():
+        engine = _engine(tmp_path)
+        async with engine.begin() as conn:
+            # Broadcasts as saved before out of order progress was recorded
+            await conn.execute(
+                text(
+                    "CREATE TABLE broadcast (id INTEGER PRIMARY KEY, text VARCHAR, cursor BIGINT, "
+                    "sent INTEGER, failed INTEGER, finished BOOLEAN)"
+                )
+            )
+            await conn.execute(
+                text("INSERT INTO broadcast VALUES (1, 'hello', 5, 1, 0, 0)")
+            )
+
+        await migrations.upgrade(engine)
+
+        async with AsyncSession(engine) as session:
+            broadcast = await repository.get_unfinished_broadcast(session)
+        await engine.dispose()
+        return broadcast
+
+    broadcast = asyncio.run(run())
+
+    assert (broadcast.cursor, broadcast.processed_guild_ids) == (5, None)
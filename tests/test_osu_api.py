@@ -0,0 +1,92 @@
+"""Tests for the osu! API client in `aoba_discord_bot.cogs.osu.osu_api`."""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from aoba_discord_bot.cogs.osu.osu_api import OsuApiClient
+
+
+class FakeOsuApiClient(OsuApiClient):
+    """
+    Client whose requests wait for the test to release them instead of reaching the API.
+    """
+
+    def __init__(self):
+        super().__init__("id", "secret")
+        self.requests = 0
+        self.release = asyncio.Event()
+
+    async def _request(self, endpoint: str, params: dict, priority: int) -> dict:
+        self.requests += 1
+        await self.release.wait()
+        return {"endpoint": endpoint, "request": self.requests}
+
+
+def test_identical_requests_share_the_response():
+    async def run():
+        client = FakeOsuApiClient()
+        requests = [
+            asyncio.ensure_future(client.get("users/1", {"mode": "osu"}))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0)
+        client.release.set()
+        responses = await asyncio.gather(*requests)
+        return responses, client.requests, client.deduplicated
+
+    responses, requests, deduplicated = asyncio.run(run())
+
+    assert responses == [{"endpoint": "users/1", "request": 1}] * 3
+    assert requests == 1
+    assert deduplicated == 2
+
+
+def test_waiting_request_is_sent_again_when_the_first_caller_is_cancelled():
+    async def run():
+        client = FakeOsuApiClient()
+        first = asyncio.ensure_future(client.get("users/1"))
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(client.get("users/1"))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        await asyncio.sleep(0)
+        client.release.set()
+        response = await asyncio.wait_for(waiting, timeout=1)
+        return first.cancelled(), response, client.requests
+
+    first_cancelled, response, requests = asyncio.run(run())
+
+    assert first_cancelled
+    assert response == {"endpoint": "users/1", "request": 2}
+    assert requests == 2
+
+
+def test_concurrent_requests_with_an_expired_token_request_one_token():
+    class TokenCountingClient(OsuApiClient):
+        def __init__(self):
+            super().__init__("id", "secret")
+            self.token_requests = 0
+            self._access_token = "expired"
+            self._token_expires_dt = datetime.now() - timedelta(seconds=1)
+
+        async def _client_credentials_grant(self) -> None:
+            self.token_requests += 1
+            await asyncio.sleep(0.01)
+            self._access_token = f"token {self.token_requests}"
+            self._token_expires_dt = datetime.now() + timedelta(hours=1)
+
+        async def _request(self, endpoint: str, params: dict, priority: int) -> dict:
+            return await self._get_authorization_header()
+
+    async def run():
+        client = TokenCountingClient()
+        headers = await asyncio.gather(
+            *(client.get(f"users/{user_id}") for user_id in range(10))
+        )
+        return headers, client.token_requests
+
+    headers, token_requests = asyncio.run(run())
+
+    assert token_requests == 1
+    assert headers == [{"Authorization": "Bearer token 1"}] * 10
@@ -0,0 +1,77 @@
+"""Tests for the osu!.db parser in `aoba_discord_bot.cogs.osu.osu_db`."""
+
+import struct
+import tempfile
+
+import pytest
+
+from aoba_discord_bot.cogs.osu.osu_db import OsuDbError, read_beatmapset_ids
+
+
+def osu_string(text: str) -> bytes:
+    if not text:
+        return b"\x00"
+    data = text.encode()
+    return b"\x0b" + bytes([len(data)]) + data
+
+
+def beatmap_entry(version: int, beatmapset_id: int, tags: str = "") -> bytes:
+    float_difficulty = version >= 20140609
+    entry = b"".join(osu_string(s) for s in ["artist", "", "title", "", "creator"])
+    entry += b"".join(osu_string(s) for s in ["Hard", "audio.mp3", "0" * 32, "a.osu"])
+    entry += struct.pack("<BhhhQ", 4, 100, 50, 1, 0)
+    entry += struct.pack("<ffff", 9, 4, 6, 8) if float_difficulty else bytes(4)
+    entry += struct.pack("<d", 1.4)
+    if float_difficulty:
+        if version >= 20250107:
+            star_rating = struct.pack("<BiBf", 0x08, 0, 0x0C, 5.5)
+        else:
+            star_rating = struct.pack("<BiBd", 0x08, 0, 0x0D, 5.5)
+        entry += (struct.pack("<i", 1) + star_rating) + struct.pack("<i", 0) * 3
+    entry += struct.pack("<iii", 60, 60000, 1000)
+    entry += struct.pack("<i", 1) + struct.pack("<dd?", 300.0, 0.0, True)
+    entry += struct.pack("<iii", 1000, beatmapset_id, 0)
+    entry += bytes(4) + struct.pack("<hfB", 0, 0.7, 0)
+    entry += osu_string("") + osu_string(tags)
+    entry += struct.pack("<h", 0) + osu_string("")
+    entry += struct.pack("<?Q?", False, 0, False)
+    entry += osu_string(f"{beatmapset_id} artist - title")
+    entry += struct.pack("<Q", 0) + bytes(5)
+    if not float_difficulty:
+        entry += bytes(2)
+    entry += struct.pack("<iB", 0, 0)
+
+    if version < 20191106:
+        entry = struct.pack("<i", len(entry)) + entry
+    return entry
+
+
+def osu_db(version: int, beatmapset_ids: list, tags: str = "") -> bytes:
+    header = struct.pack("<ii?Q", version, 1, True, 0) + osu_string("player")
+    header += struct.pack("<i", len(beatmapset_ids))
+    entries = b"".join(beatmap_entry(version, i, tags) for i in beatmapset_ids)
+    return header + entries + struct.pack("<i", 0)
+
+
+def parse(contents: bytes):
+    with tempfile.TemporaryFile() as file:
+        file.write(contents)
+        file.flush()
+        return read_beatmapset_ids(file)
+
+
+@pytest.mark.parametrize("version", [20131216, 20191105, 20211122, 20250107])
+def test_read_beatmapset_ids(version):
+    ids, beatmap_count = parse(osu_db(version, [1, 1, 42, 0, -1]))
+    assert ids == {1, 42}
+    assert beatmap_count == 5
+
+
+def test_ids_in_strings_are_not_read_as_beatmapsets():
+    ids, _ = parse(osu_db(20211122, [7], tags="\x00\x0b\x07123456 abc"))
+    assert ids == {7}
+
+
+def test_truncated_file_raises():
+    with pytest.raises(OsuDbError):
+        parse(osu_db(20211122, [1, 2])[:-40])
@@ -0,0 +1,109 @@
+"""Tests for `aoba_discord_bot.rate_limit`."""
+
+import asyncio
+
+import pytest
+
+from aoba_discord_bot.rate_limit import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    QueueFullError,
+    RateLimiter,
+    retry_with_backoff,
+)
+
+
+def test_rate_limiter_serves_interactive_requests_first():
+    async def run():
+        limiter = RateLimiter(rate=100, burst=1, max_queue=10)
+        await limiter.acquire()
+        order = []
+
+        async def request(name, priority):
+            await limiter.acquire(priority)
+            order.append(name)
+
+        await asyncio.gather(
+            request("background", PRIORITY_BACKGROUND),
+            request("interactive", PRIORITY_INTERACTIVE),
+        )
+        return order
+
+    assert asyncio.run(run()) == ["interactive", "background"]
+
+
+def test_rate_limiter_rejects_when_queue_is_full():
+    async def run():
+        limiter = RateLimiter(rate=1, burst=1, max_queue=1)
+        await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            await limiter.acquire()
+        waiting.cancel()
+        return limiter.rejected
+
+    assert asyncio.run(run()) == 1
+
+
+def test_rate_limiter_token_of_cancelled_caller_goes_to_the_next_one():
+    async def run():
+        # Refills too slowly for the waiting callers to get a new token
+        limiter = RateLimiter(rate=0.001, burst=1, max_queue=10)
+        await limiter.acquire()
+        first = asyncio.ensure_future(limiter.acquire())
+        second = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+
+        # The first caller is cancelled after being given a token, before it resumes
+        limiter.bucket.release()
+        assert limiter.bucket.try_acquire() == 0
+        limiter._grant()
+        first.cancel()
+
+        await asyncio.wait_for(second, timeout=1)
+        limiter._dispatcher.cancel()
+        return first.cancelled(), limiter.acquired
+
+    assert asyncio.run(run()) == (True, 2)
+
+
+def test_rate_limiter_token_of_cancelled_callers_goes_back_to_the_bucket():
+    async def run():
+        limiter = RateLimiter(rate=0.001, burst=1, max_queue=10)
+        await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.sleep(0)
+
+        limiter.bucket.release()
+        assert limiter.bucket.try_acquire() == 0
+        limiter._grant()
+        return limiter.bucket.try_acquire()
+
+    assert asyncio.run(run()) == 0
+
+
+def test_retry_with_backoff_retries_until_success():
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError
+        return "ok"
+
+    result = asyncio.run(
+        retry_with_backoff(flaky, lambda e: 0, max_retries=3, base_delay=0.001)
+    )
+    assert result == "ok"
+    assert len(attempts) == 3
+
+
+def test_retry_with_backoff_raises_non_retryable_errors():
+    async def fail():
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        asyncio.run(retry_with_backoff(fail, lambda e: None))
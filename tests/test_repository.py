@@ -0,0 +1,240 @@
+"""Tests for the database queries in `aoba_discord_bot.repository`."""
+
+import asyncio
+from types import SimpleNamespace
+from typing import Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+
+from aoba_discord_bot import database, migrations, repository
+from aoba_discord_bot.db_models import AobaGuild, AobaLedgerEntry
+
+
+async def _sessionmaker(tmp_path) -> Tuple[AsyncEngine, async_sessionmaker]:
+    """
+    return: engine of a new SQLite database with the latest schema and its session factory
+    """
+    engine = database.create_engine(
+        database.normalize_url(f"sqlite:///{tmp_path}/aoba.db")
+    )
+    await migrations.upgrade(engine)
+    return engine, async_sessionmaker(engine, expire_on_commit=False)
+
+
+async def _ledger(Session):
+    async with Session() as session:
+        query = select(
+            AobaLedgerEntry.discord_id, AobaLedgerEntry.amount, AobaLedgerEntry.balance
+        ).order_by(AobaLedgerEntry.id)
+        return (await session.execute(query)).all()
+
+
+def test_change_balance_creates_the_user_and_records_each_change(tmp_path):
+    async def run():
+        engine, Session = await _sessionmaker(tmp_path)
+        balances = list()
+        for amount in (10, -3, 5):
+            async with Session.begin() as session:
+                balances.append(await repository.change_balance(session, 1, amount))
+        async with Session() as session:
+            user = await repository.get_user(session, 1)
+        ledger = await _ledger(Session)
+        await engine.dispose()
+        return balances, user, ledger
+
+    balances, user, ledger = asyncio.run(run())
+
+    assert balances == [10, 7, 12]
+    assert user.bank_balance == 12
+    assert ledger == [(1, 10, 10), (1, -3, 7), (1, 5, 12)]
+
+
+def test_concurrent_balance_changes_are_not_lost(tmp_path):
+    amounts = [5, -2, 7, 1, 3, -4, 10, 2]
+
+    async def run():
+        engine, Session = await _sessionmaker(tmp_path)
+
+        async def change(amount):
+            async with Session.begin() as session:
+                return await repository.change_balance(session, 1, amount)
+
+        await asyncio.gather(*(change(amount) for amount in amounts))
+        async with Session() as session:
+            user = await repository.get_user(session, 1)
+            ledger_count = (
+                await session.execute(select(func.count(AobaLedgerEntry.id)))
+            ).scalar()
+        ledger = await _ledger(Session)
+        await engine.dispose()
+        return user, ledger_count, ledger
+
+    user, ledger_count, ledger = asyncio.run(run())
+
+    assert user.bank_balance == sum(amounts)
+    assert ledger_count == len(amounts)
+    # Each entry's balance is the running total of the changes committed before it
+    running = 0
+    for _, amount, balance in ledger:
+        running += amount
+        assert balance == running
+
+
+def test_change_balances_upserts_many_users(tmp_path):
+    async def run():
+        engine, Session = await _sessionmaker(tmp_path)
+        async with Session.begin() as session:
+            await repository.change_balance(session, 1, 10)
+        async with Session.begin() as session:
+            balances = await repository.change_balances(session, {1: -4, 2: 6})
+        ledger = await _ledger(Session)
+        await engine.dispose()
+        return balances, ledger
+
+    balances, ledger = asyncio.run(run())
+
+    assert balances == {1: 6, 2: 6}
+    assert sorted(ledger) == [(1, -4, 6), (1, 10, 10), (2, 6, 6)]
+
+
+def test_change_balance_is_a_single_statement_on_postgresql():
+    statements = list()
+
+    class CompilingSession:
+        bind = SimpleNamespace(dialect=postgresql.dialect())
+
+        async def execute(self, statement):
+            statements.append(statement)
+            return SimpleNamespace(scalar_one=lambda: 15)
+
+    balance = asyncio.run(repository.change_balance(CompilingSession(), 1, 5))
+    sql = " ".join(str(statements[0].compile(dialect=postgresql.dialect())).split())
+
+    assert balance == 15
+    assert len(statements) == 1
+    assert sql.startswith("WITH balance_update AS (INSERT INTO aobauser")
+    assert "ON CONFLICT (discord_id) DO UPDATE SET bank_balance" in sql
+    assert "INSERT INTO ledger (discord_id, amount, balance) SELECT" in sql
+    assert sql.endswith("RETURNING ledger.balance")
+
+
+def test_concurrent_set_command_calls_keep_one_command_with_the_latest_text(tmp_path):
+    async def run():
+        engine, Session = await _sessionmaker(tmp_path)
+        async with Session.begin() as session:
+            await repository.add_guilds(session, [1])
+
+        async def set_command(text):
+            async with Session.begin() as session:
+                await repository.set_command(session, 1, "hello", text)
+
+        await asyncio.gather(*(set_command(f"hello {index}") for index in range(8)))
+        await set_command("hello again")
+
+        async with Session() as session:
+            commands = await repository.get_all_commands(session)
+        await engine.dispose()
+        return [(command.guild_id, command.name, command.text) for command in commands]
+
+    assert asyncio.run(run()) == [(1, "hello", "hello again")]
+
+
+async def _guild_ids(Session):
+    async with Session() as session:
+        query = select(AobaGuild.guild_id).order_by(AobaGuild.guild_id)
+        return (await session.execute(query)).scalars().all()
+
+
+def test_add_guilds_inserts_and_returns_only_the_missing_guilds(tmp_path):
+    async def run():
+        engine, Session = await _sessionmaker(tmp_path)
+        async with Session.begin() as session:
+            first = await repository.add_guilds(session, [1, 2])
+        async with Session.begin() as session:
+            second = await repository.add_guilds(session, [2, 3])
+        # A guild joined again
+        async with Session.begin() as session:
+            repeated = await repository.add_guilds(session, [3])
+        guild_ids = await _guild_ids(Session)
+        await engine.dispose()
+        return first, second, repeated, guild_ids
+
+    first, second, repeated, guild_ids = asyncio.run(run())
+
+    assert sorted(first) == [1, 2]
+    assert second == [3]
+    assert repeated == []
+    assert guild_ids == [1, 2, 3]
+
+
+def test_add_guilds_inserts_more_guilds_than_a_chunk(tmp_path):
+    guild_count = 2 * repository.INSERT_CHUNK_SIZE + 1
+
+    async def run():
+        engine, Session = await _sessionmaker(tmp_path)
+        async with Session.begin() as session:
+            await repository.add_guilds(session, [0])
+        async with Session.begin() as session:
+            added = await repository.add_guilds(session, range(guild_count))
+        guild_ids = await _guild_ids(Session)
+        await engine.dispose()
+        return added, guild_ids
+
+    added, guild_ids = asyncio.run(run())
+
+    assert sorted(added) == list(range(1, guild_count))
+    assert guild_ids == list(range(guild_count))
+
+
+def test_remove_guild_deletes_its_commands(tmp_path):
+    async def run():
+        engine, Session = await _sessionmaker(tmp_path)
+        async with Session.begin() as session:
+            await repository.add_guilds(session, [1, 2])
+            await repository.set_command(session, 1, "hello", "Hello")
+            await repository.set_command(session, 2, "hello", "Hi")
+        async with Session.begin() as session:
+            await repository.remove_guild(session, 1)
+        guild_ids = await _guild_ids(Session)
+        async with Session() as session:
+            commands = await repository.get_all_commands(session)
+        await engine.dispose()
+        return guild_ids, [(command.guild_id, command.text) for command in commands]
+
+    guild_ids, commands = asyncio.run(run())
+
+    assert guild_ids == [2]
+    assert commands == [(2, "Hi")]
+
+
+def test_get_custom_prefixes_of_a_shard(tmp_path):
+    # Shards 2, 2 and 0 of 4
+    guild_ids = [81384788765712384, 41771983423143937, 613425648685547541]
+
+    async def run():
+        engine, Session = await _sessionmaker(tmp_path)
+        async with Session.begin() as session:
+            await repository.add_guilds(session, guild_ids)
+            await session.execute(
+                update(AobaGuild)
+                .where(AobaGuild.guild_id != guild_ids[1])
+                .values(command_prefix="?")
+            )
+        async with Session() as session:
+            shard_prefixes = [
+                await repository.get_custom_prefixes(
+                    session, shard_id=shard_id, shard_count=4
+                )
+                for shard_id in range(4)
+            ]
+        await engine.dispose()
+        return shard_prefixes
+
+    assert asyncio.run(run()) == [
+        [(guild_ids[2], "?")],
+        [],
+        [(guild_ids[0], "?")],
+        [],
+    ]
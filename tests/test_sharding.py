@@ -0,0 +1,46 @@
+"""Tests for the sharding helpers in `aoba_discord_bot.sharding`."""
+
+import pytest
+
+from aoba_discord_bot.sharding import ShardStats, parse_shard_ids, shard_id_for_guild
+
+
+def test_parse_shard_ids_ranges():
+    assert parse_shard_ids("0-3,8") == [0, 1, 2, 3, 8]
+    assert parse_shard_ids("5") == [5]
+    assert parse_shard_ids("2-3, 1-2") == [1, 2, 3]
+
+
+@pytest.mark.parametrize("value", ["", "a", "3-1", "-1", "1-"])
+def test_parse_shard_ids_invalid(value):
+    with pytest.raises(ValueError):
+        parse_shard_ids(value)
+
+
+@pytest.mark.parametrize(
+    "guild_id, shard_count, shard_id",
+    [
+        (81384788765712384, 1, 0),
+        (81384788765712384, 4, 2),
+        (81384788765712384, 100, 98),
+        (613425648685547541, 16, 8),
+        (613425648685547541, 100, 44),
+        (41771983423143937, 16, 6),
+    ],
+)
+def test_shard_id_for_guild(guild_id, shard_count, shard_id):
+    assert shard_id_for_guild(guild_id, shard_count) == shard_id
+
+
+def test_shard_stats_message_rate():
+    stats = ShardStats(window=10)
+    for _ in range(20):
+        stats.record_message(1)
+    stats.record_connect(1)
+
+    shard_stats = stats.stats([(0, 0.05), (1, 0.1)])
+    assert shard_stats[0]["messages"] == 0
+    assert shard_stats[1]["messages"] == 20
+    assert shard_stats[1]["messages_per_second"] == 2.0
+    assert shard_stats[1]["latency_ms"] == 100.0
+    assert shard_stats[1]["connects"] == 1
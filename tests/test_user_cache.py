@@ -0,0 +1,81 @@
+"""Tests for the user cache in `aoba_discord_bot.cogs.economy.user_cache`."""
+
+import asyncio
+
+from aoba_discord_bot.cogs.economy.user_cache import CachedUser, UserCache
+from aoba_discord_bot.invalidation import LocalInvalidationChannel
+
+
+def _loader(balances, loads):
+    async def load(discord_id):
+        loads.append(discord_id)
+        balance = balances.get(discord_id)
+        await asyncio.sleep(0)
+        return None if balance is None else CachedUser(discord_id, balance)
+
+    return load
+
+
+def test_user_cache_reads_through_and_evicts_least_recently_used():
+    loads = list()
+    load = _loader({1: 10, 2: 20, 3: 30}, loads)
+    cache = UserCache(max_size=2)
+
+    async def run():
+        assert (await cache.get(1, load)).bank_balance == 10
+        assert await cache.get(4, load) is None
+        await cache.get(1, load)
+        await cache.get(2, load)
+        await cache.get(4, load)
+
+    asyncio.run(run())
+
+    # The user without a record is cached too, until it's the least recently used
+    assert loads == [1, 4, 2, 4]
+    assert cache.stats()["hits"] == 1
+    assert (cache.misses, cache.evictions, len(cache)) == (4, 2, 2)
+
+
+def test_user_cache_writes_update_cached_users_only():
+    cache = UserCache()
+
+    async def run():
+        await cache.get(1, _loader({1: 10}, list()))
+        await cache.get(2, _loader({}, list()))
+
+    asyncio.run(run())
+    cache.update({1: 15, 2: 5, 3: 7})
+    cache.set(CachedUser(4, 40))
+
+    assert cache._entries[1].bank_balance == 15
+    assert cache._entries[2].bank_balance == 5
+    assert 3 not in cache._entries
+    assert cache._entries[4].bank_balance == 40
+
+
+def test_user_cache_skips_loads_overlapping_a_write():
+    cache = UserCache()
+    balances = {1: 10}
+
+    async def run():
+        loading = asyncio.ensure_future(cache.get(1, _loader(balances, list())))
+        await asyncio.sleep(0)
+        # Written while the old balance was being read
+        balances[1] = 20
+        cache.invalidate([1])
+        assert (await loading).bank_balance == 10
+        return await cache.get(1, _loader(balances, list()))
+
+    assert asyncio.run(run()).bank_balance == 20
+
+
+def test_local_invalidation_channel_delivers_to_peers():
+    peers = list()
+    first, second = LocalInvalidationChannel(peers), LocalInvalidationChannel(peers)
+    received = {"first": list(), "second": list()}
+    first.subscribe("aobauser", received["first"].append)
+    second.subscribe("aobauser", received["second"].append)
+
+    asyncio.run(first.publish("aobauser", [1, 2]))
+
+    assert received == {"first": [], "second": [[1, 2]]}
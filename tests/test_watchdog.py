@@ -0,0 +1,43 @@
+"""Tests for the event loop stall detection in `aoba_discord_bot.watchdog`."""
+
+import asyncio
+import time
+
+from aoba_discord_bot.watchdog import LoopWatchdog
+
+
+def test_watchdog_reports_blocking_call(caplog):
+    stalls = list()
+
+    async def run():
+        watchdog = LoopWatchdog(
+            asyncio.get_event_loop(),
+            stall_threshold=0.05,
+            describe_task=lambda task: "command blocking",
+            on_stall=stalls.append,
+        )
+        watchdog.start()
+        await asyncio.sleep(0.1)
+        time.sleep(0.3)
+        await asyncio.sleep(0.1)
+        await watchdog.close()
+        return watchdog
+
+    watchdog = asyncio.run(run())
+
+    assert watchdog.stalls == 1
+    assert len(stalls) == 1 and stalls[0] >= 0.2
+    assert "running command blocking" in caplog.text
+    # The profile points at the coroutine that blocked the loop
+    assert "time.sleep(0.3)" in caplog.text
+
+
+def test_watchdog_ignores_idle_loop():
+    async def run():
+        watchdog = LoopWatchdog(asyncio.get_event_loop(), stall_threshold=0.05)
+        watchdog.start()
+        await asyncio.sleep(0.3)
+        await watchdog.close()
+        return watchdog
+
+    assert asyncio.run(run()).stalls == 0